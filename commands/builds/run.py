@@ -7,15 +7,16 @@ from ...core import (
     DependencyManager,
     GenericShell,
     JavaUtils,
-    JavaStructure,
     JDKManager,
     Logger,
     Macro,
     MultiThreadProgress,
-    RE,
     Settings,
-    StateProperty
+    StateProperty,
+    StatusManager,
+    SymbolIndex
 )
+from ...threads import BackgroundThread
 
 
 class JavatarRunCommand(sublime_plugin.WindowCommand):
@@ -57,49 +58,6 @@ class JavatarRunCommand(sublime_plugin.WindowCommand):
         if not failed:
             self.run(skip_build=True)
 
-    def get_runnable_files(self, dir_path=None):
-        """
-        Returns a list of runnable file paths in specified directory and its
-            sub-directory
-
-        @param dir_path: a directory path
-        """
-        if not dir_path:
-            return []
-        files = []
-        for name in os.listdir(dir_path):
-            path_name = os.path.join(dir_path, name)
-            if (os.path.isdir(path_name) and
-                    name not in Settings().get_sublime(
-                        "folder_exclude_patterns", []
-                    )):
-                files += self.get_runnable_files(path_name)
-            elif (os.path.isfile(path_name) and
-                    self.is_main_class(path_name)):
-                files.append(path_name)
-        return files
-
-    def is_main_class(self, file_path):
-        """
-        Returns whether the specified path is a main class
-
-        @param file_path: a file path to be validated
-        """
-        if not StateProperty().is_java(file_path):
-            return False
-
-        for cl in JavaStructure().classes_in_file(file_path):
-            for method in JavaStructure().methods_in_class(cl):
-                if method["name"] != "main":
-                    continue
-                elif len(method["params"]) != 1:
-                    continue
-                elif not RE().get("string_type_match", "^String\\b").search(
-                        method["params"][0]["type"]):
-                    continue
-                return True
-        return False
-
     def trim_extension(self, file_path):
         """
         Remove a file extension from the file path
@@ -222,32 +180,43 @@ class JavatarRunCommand(sublime_plugin.WindowCommand):
 
         self.run_program(self.runnable_files[index])
 
-    def run(self, skip_build=False):
+    def find_runnable_files(self, file_path=None):
         """
-        Detect and run a main class
+        Returns a list of files to run, the current file is returned alone
+            if it is a main class
 
-        This will show a panel if there are multiple files available
+        The searching status is hidden if the files cannot be found
+
+        @param file_path: a path to the current file
         """
-        if not skip_build and Settings().get("automatic_build"):
-            self.build_project()
-            return
+        try:
+            return self.get_runnable_files(file_path)
+        except Exception:
+            sublime.set_timeout(
+                lambda: StatusManager().hide_status("run_main_class"), 0
+            )
+            raise
 
-        self.prefix = os.path.dirname(
-            os.path.commonprefix(StateProperty().get_project_dirs())
-        )
+    def get_runnable_files(self, file_path=None):
+        """
+        Returns a list of files to run, the current file is returned alone
+            if it is a main class
 
-        # Check the current file
-        if (not Settings().get("always_ask_to_run") and
-            StateProperty().is_project() and
-                StateProperty().is_file()):
-            if self.is_main_class(self.window.active_view().file_name()):
-                self.run_program(self.window.active_view().file_name())
-                return
-
-        self.runnable_files = []
-        # Check the whole project
-        for source_folder in StateProperty().get_source_folders():
-            self.runnable_files += self.get_runnable_files(source_folder)
+        @param file_path: a path to the current file
+        """
+        if (file_path and StateProperty().is_java(file_path) and
+                SymbolIndex().has_main_method(file_path)):
+            return [file_path]
+        return SymbolIndex().get_main_files()
+
+    def on_find_runnable_files(self, runnable_files):
+        """
+        A callback when files to run are found
+
+        @param runnable_files: a list of files to run
+        """
+        StatusManager().hide_status("run_main_class")
+        self.runnable_files = runnable_files
         if len(self.runnable_files) > 1:
             self.window.show_quick_panel(
                 [
@@ -263,3 +232,38 @@ class JavatarRunCommand(sublime_plugin.WindowCommand):
             self.run_program(self.runnable_files[0])
         else:
             sublime.error_message("No main class found in the project")
+
+    def run(self, skip_build=False):
+        """
+        Detect and run a main class
+
+        This will show a panel if there are multiple files available
+        """
+        if not skip_build and Settings().get("automatic_build"):
+            self.build_project()
+            return
+
+        self.prefix = os.path.dirname(
+            os.path.commonprefix(StateProperty().get_project_dirs())
+        )
+
+        # Check the current file before the whole project
+        file_path = None
+        if (not Settings().get("always_ask_to_run") and
+            StateProperty().is_project() and
+                StateProperty().is_file()):
+            file_path = self.window.active_view().file_name()
+
+        StatusManager().show_status(
+            "Searching for main classes...",
+            delay=-1,
+            ref="run_main_class"
+        )
+        # Files are parsed in the background
+        BackgroundThread(
+            func=self.find_runnable_files,
+            args=[file_path],
+            on_complete=lambda runnable_files: sublime.set_timeout(
+                lambda: self.on_find_runnable_files(runnable_files), 0
+            )
+        )
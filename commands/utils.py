@@ -3,9 +3,9 @@ import sublime_plugin
 import sys
 from imp import reload
 import hashlib
-from ..parser.GrammarParser import GrammarParser
 from ..core import (
     ActionHistory,
+    GrammarManager,
     JavaStructure,
     JSONPanel,
     Logger,
@@ -132,9 +132,7 @@ class JavatarUtilsCommand(sublime_plugin.TextCommand):
         @param selector: scope selector (refer to GrammarParser's selector)
         """
         try:
-            scope = GrammarParser(sublime.decode_value(sublime.load_resource(
-                "Packages/Javatar/grammars/Java8.javatar-grammar"
-            )))
+            scope = GrammarManager().get_parser("Java8")
             parse_output = scope.parse_grammar(self.view.substr(
                 sublime.Region(0, self.view.size())
             ))
@@ -4,7 +4,9 @@ from .build_system import *
 from .dependency_manager import *
 from .dict import *
 from .event_handler import *
+from .file_walker import *
 from .generic_shell import *
+from .grammar_manager import *
 from .helper_service import *
 from .java_structure import *
 from .java_utils import *
@@ -12,6 +14,7 @@ from. jdk_manager import *
 from .json_panel import *
 from .logger import *
 from .macro import *
+from .parse_cache import *
 from .plugin_manager import *
 from .project_restoration import *
 from .regex import *
@@ -19,5 +22,6 @@ from .settings import *
 from .snippets_manager import *
 from .state_property import *
 from .status_manager import *
+from .symbol_index import *
 from .thread_progress import *
 from .usages import *
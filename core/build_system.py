@@ -3,6 +3,7 @@ import os
 import time
 import math
 from .action_history import ActionHistory
+from .file_walker import FileWalker
 from .java_utils import JavaUtils
 from .settings import Settings
 from .state_property import StateProperty
@@ -282,18 +283,7 @@ class _BuildSystem:
         """
         if not dir_path:
             return []
-        files = []
-        for name in os.listdir(dir_path):
-            path_name = os.path.join(dir_path, name)
-            if (os.path.isdir(path_name) and
-                    name not in Settings().get_sublime(
-                        "folder_exclude_patterns", []
-                    )):
-                files += self.get_files(path_name)
-            elif (os.path.isfile(path_name) and
-                    JavaUtils().is_java_file(path_name)):
-                files.append(path_name)
-        return files
+        return FileWalker().get_files([dir_path], JavaUtils().is_java_file)
 
 
 def BuildSystem():
@@ -0,0 +1,155 @@
+import sublime
+import fnmatch
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .settings import Settings
+
+
+# Number of threads to list the directories with
+WALKER_THREADS = 4
+# Minimum number of directories to list in the thread pool
+WALKER_PARALLEL_DIRS = 4
+# Maximum number of directory listings to keep in memory
+WALKER_CACHE_SIZE = 20000
+
+
+class _FileWalker:
+
+    """
+    A walker to list files in the source trees, directory listings are
+        reused until the directory is modified
+    """
+
+    @classmethod
+    def instance(cls):
+        if not hasattr(cls, "_instance"):
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Directory path => (mtime, directory names, file names)
+        self.listings = {}
+        self.exclude_patterns = None
+        self.exclude_match = None
+        self.pool = None
+
+    def get_pool(self):
+        """
+        Returns a thread pool to list the directories with
+        """
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(WALKER_THREADS)
+            return self.pool
+
+    def get_exclude_match(self):
+        """
+        Returns a function to match the excluded directory names, names are
+            matched case-insensitively on case-insensitive platforms
+        """
+        patterns = tuple(Settings().get_sublime("folder_exclude_patterns", []))
+        flags = 0
+        if sublime.platform() != "linux":
+            flags = re.IGNORECASE
+        with self.lock:
+            if (patterns, flags) != self.exclude_patterns:
+                self.exclude_patterns = (patterns, flags)
+                if patterns:
+                    self.exclude_match = re.compile("|".join(
+                        "(?:%s)" % (fnmatch.translate(pattern))
+                        for pattern in patterns
+                    ), flags).match
+                else:
+                    self.exclude_match = None
+            return self.exclude_match
+
+    def list_dir(self, dir_path):
+        """
+        Returns a tuple of directory names and file names in specified
+            directory, the listing is empty if the directory cannot be read
+
+        Symbolic links to directories are not listed, so the walker cannot
+            loop through them
+
+        @param dir_path: a directory path
+        """
+        try:
+            mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            return ([], [])
+        listing = self.listings.get(dir_path)
+        if listing is not None and listing[0] == mtime:
+            return listing[1:]
+        dir_names = []
+        file_names = []
+        try:
+            if hasattr(os, "scandir"):
+                for entry in os.scandir(dir_path):
+                    if entry.is_dir(follow_symlinks=False):
+                        dir_names.append(entry.name)
+                    elif entry.is_file():
+                        file_names.append(entry.name)
+            else:
+                for name in os.listdir(dir_path):
+                    path_name = os.path.join(dir_path, name)
+                    if os.path.islink(path_name):
+                        if os.path.isfile(path_name):
+                            file_names.append(name)
+                    elif os.path.isdir(path_name):
+                        dir_names.append(name)
+                    elif os.path.isfile(path_name):
+                        file_names.append(name)
+        except OSError:
+            return ([], [])
+        dir_names.sort()
+        file_names.sort()
+        with self.lock:
+            if len(self.listings) >= WALKER_CACHE_SIZE:
+                self.listings = {}
+            self.listings[dir_path] = (mtime, dir_names, file_names)
+        return (dir_names, file_names)
+
+    def get_files(self, dir_paths, file_filter=None):
+        """
+        Returns a list of file paths in specified directories and their
+            sub-directories, excluded directories are skipped
+
+        @param dir_paths: a list of directory paths
+        @param file_filter: a function returns whether the file path
+            will be included
+        """
+        exclude_match = self.get_exclude_match()
+        files = []
+        pending = [dir_path for dir_path in dir_paths if dir_path]
+        # Directories are listed level by level, so wide trees are listed
+        #   in parallel
+        while pending:
+            if len(pending) >= WALKER_PARALLEL_DIRS:
+                listings = self.get_pool().map(self.list_dir, pending)
+            else:
+                listings = map(self.list_dir, pending)
+            next_pending = []
+            for dir_path, (dir_names, file_names) in zip(pending, listings):
+                for name in dir_names:
+                    if not exclude_match or not exclude_match(name):
+                        next_pending.append(os.path.join(dir_path, name))
+                for name in file_names:
+                    file_path = os.path.join(dir_path, name)
+                    if not file_filter or file_filter(file_path):
+                        files.append(file_path)
+            pending = next_pending
+        return sorted(files)
+
+    def reset(self):
+        """
+        Removes all cached directory listings
+        """
+        with self.lock:
+            self.listings = {}
+
+
+def FileWalker():
+    return _FileWalker.instance()
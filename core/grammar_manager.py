@@ -0,0 +1,118 @@
+import sublime
+import os
+import threading
+from .action_history import ActionHistory
+from .event_handler import EventHandler
+from ..parser.GrammarParser import CompiledGrammar, GrammarParser
+
+
+class _GrammarManager:
+
+    """
+    Load and compile grammars once and share them between parsers
+    """
+
+    @classmethod
+    def instance(cls):
+        if not hasattr(cls, "_instance"):
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset(silent=True)
+        EventHandler().register_handler(
+            self,
+            EventHandler().ON_POST_SAVE_ASYNC
+        )
+
+    def reset(self, silent=False):
+        """
+        Resets all stored grammars
+        """
+        if not silent:
+            ActionHistory().add_action(
+                "javatar.core.grammar_manager.reset", "Reset all grammars"
+            )
+        with self.lock:
+            self.grammars = {}
+
+    def get_grammar_path(self, name):
+        """
+        Returns a resource path of specified grammar
+
+        @param name: a grammar name (such as Java8)
+        """
+        return "Packages/Javatar/grammars/%s.javatar-grammar" % (name)
+
+    def get_grammar_signature(self, grammar_path):
+        """
+        Returns a modification time of the grammar file if the package is
+            unpacked, otherwise, returns None
+
+        @param grammar_path: a resource path of the grammar
+        """
+        if grammar_path[:9] != "Packages/":
+            return None
+        file_path = os.path.join(sublime.packages_path(), grammar_path[9:])
+        if os.path.exists(file_path):
+            return os.path.getmtime(file_path)
+        return None
+
+    def get_grammar(self, name):
+        """
+        Returns a compiled grammar, the grammar will be loaded on first use
+            or when its file has been changed
+
+        @param name: a grammar name (such as Java8)
+        """
+        grammar_path = self.get_grammar_path(name)
+        signature = self.get_grammar_signature(grammar_path)
+        with self.lock:
+            if name in self.grammars and self.grammars[name][0] == signature:
+                return self.grammars[name][1]
+        ActionHistory().add_action(
+            "javatar.core.grammar_manager.get_grammar",
+            "Load grammar [name=" + name + "]"
+        )
+        # Grammar is optimized since only the named regions are used
+        compiled_grammar = CompiledGrammar(
+            sublime.decode_value(sublime.load_resource(grammar_path)),
+            optimize=True
+        )
+        with self.lock:
+            self.grammars[name] = (signature, compiled_grammar)
+        return compiled_grammar
+
+    def get_parser(self, name, **options):
+        """
+        Returns a new parser for specified grammar
+
+        @param name: a grammar name (such as Java8)
+        @param options: additional parser options (such as packrat)
+        """
+        return GrammarParser(self.get_grammar(name), **options)
+
+    def invalidate(self, name=None):
+        """
+        Removes specified grammar (or all grammars) from the cache
+
+        @param name: a grammar name to remove
+        """
+        with self.lock:
+            if name is None:
+                self.grammars = {}
+            elif name in self.grammars:
+                del self.grammars[name]
+
+    def on_post_save_async(self, view):
+        """
+        Saving event handler
+        """
+        file_name = view.file_name()
+        if file_name and file_name.endswith(".javatar-grammar"):
+            self.invalidate(os.path.splitext(os.path.basename(file_name))[0])
+
+
+def GrammarManager():
+    return _GrammarManager.instance()
@@ -1,10 +1,16 @@
-import sublime
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from .action_history import ActionHistory
+from .event_handler import EventHandler
+from .grammar_manager import GrammarManager
 from .helper_service import HelperService
 from .java_utils import JavaClassPath, JavaUtils
+from .parse_cache import ParseCache
 from .state_property import StateProperty
 from .settings import Settings
+from .symbol_index import SymbolIndex
 from ..parser.GrammarParser import GrammarParser
 
 
@@ -15,28 +21,53 @@ class _JavaStructure:
             cls._instance = cls()
         return cls._instance
 
+    def __init__(self):
+        self.structure_lock = threading.Lock()
+        self.reset_structure_cache()
+        EventHandler().register_handler(
+            self,
+            EventHandler().ON_POST_SAVE_ASYNC
+        )
+
     def file_with_class_path(self, class_path):
+        """
+        Returns a path to Java file declares specified class path or None
+
+        The class path is looked up from the symbol index, files which are
+            not indexed yet are looked up from the package folders
+
+        @param class_path: a class path to find
+        """
         class_path = JavaClassPath(class_path)
-        jpackage = class_path.get_package()
-        jclass = class_path.get_class()
-
-        path_list = StateProperty().get_source_folders()
-        output_path = None
-        while len(jpackage) > 0:
-            for path in path_list:
-                if os.path.exists(path, jpackage[0]):
-                    output_path = os.path.join(path, jpackage[0])
-                    path_list = os.listdir(output_path)
-                    jpackage = jpackage[1:]
-                    continue
-            output_path = None
-            break
-        if not output_path:
+        jclass = class_path.get_class().get()
+        if not jclass:
             return None
-        for file_name in os.listdir(output_path):
-            file_path = os.path.join(output_path, file_name)
-            if jclass.get() in self.classes_in_java_file(file_path):
-                return file_path
+        file_path = SymbolIndex().get_class_file(class_path.as_class_path())
+        if file_path and os.path.isfile(file_path):
+            return file_path
+
+        package_path = class_path.get_package().as_path()
+        package_dirs = [
+            os.path.join(source_folder, package_path)
+            for source_folder in StateProperty().get_source_folders()
+        ]
+        package_dirs = [
+            package_dir
+            for package_dir in package_dirs
+            if os.path.isdir(package_dir)
+        ]
+        # Public class is declared in a file with the same name
+        for package_dir in package_dirs:
+            for extension in Settings().get("java_extensions"):
+                file_path = os.path.join(package_dir, jclass + extension)
+                if os.path.isfile(file_path):
+                    return file_path
+        for package_dir in package_dirs:
+            for file_name in sorted(os.listdir(package_dir)):
+                file_path = os.path.join(package_dir, file_name)
+                for declared_class in self.iter_classes_in_file(file_path):
+                    if declared_class["name"] == jclass:
+                        return file_path
         return None
 
     def find_class_paths_for_classes(self, classes, include_local=True,
@@ -49,28 +80,8 @@ class _JavaStructure:
                 on_complete=callback
             )
         class_paths = {}
-        found_classes = []
         if include_local:
-            for source_folder in StateProperty().get_source_folders():
-                for root, dir_names, file_names in os.walk(source_folder):
-                    for file_name in file_names:
-                        for class_name in classes:
-                            if file_name != class_name + ".java":
-                                continue
-                            class_path = ".".join([
-                                x for x in [
-                                    JavaUtils().to_package(
-                                        root
-                                    ).as_class_path(),
-                                    class_name
-                                ] if x
-                            ])
-                            if class_name in class_paths:
-                                class_paths[class_name].append(class_path)
-                            else:
-                                class_paths[class_name] = [class_path]
-                            if class_name not in found_classes:
-                                found_classes.append(class_name)
+            class_paths = SymbolIndex().get_class_paths_for_classes(classes)
 
         cont = True
         if custom_filter:
@@ -91,22 +102,215 @@ class _JavaStructure:
             class_paths[class_name].sort()
         return class_paths
 
+    def reset_structure_cache(self):
+        """
+        Removes all parsed file structures from the cache
+        """
+        with self.structure_lock:
+            self.structures = OrderedDict()
+
+    def invalidate_structure(self, file_path):
+        """
+        Removes a parsed structure of specified file from the cache
+
+        @param file_path: a path to Java file
+        """
+        file_path = os.path.abspath(file_path)
+        with self.structure_lock:
+            if file_path in self.structures:
+                del self.structures[file_path]
+
+    def on_post_save_async(self, view):
+        """
+        Saving event handler
+        """
+        if view.file_name():
+            self.invalidate_structure(view.file_name())
+
+    def get_cached_structure(self, file_path, signature, content_hash=None):
+        with self.structure_lock:
+            if file_path not in self.structures:
+                return None
+            cache = self.structures[file_path]
+            if cache["signature"] != signature:
+                if not content_hash or cache["hash"] != content_hash:
+                    return None
+                # File is touched but the content is not changed
+                cache["signature"] = signature
+            self.structures.move_to_end(file_path)
+            return cache["structure"]
+
+    def store_structure(self, file_path, signature, content_hash, structure):
+        with self.structure_lock:
+            self.structures[file_path] = {
+                "signature": signature,
+                "hash": content_hash,
+                "structure": structure
+            }
+            self.structures.move_to_end(file_path)
+            cache_size = max(Settings().get("structure_cache_size", 100), 1)
+            while len(self.structures) > cache_size:
+                self.structures.popitem(last=False)
+
+    def structure_in_file(self, file_path):
+        """
+        Returns a structure of specified Java file, the file will be parsed
+            only once until it is modified
+
+        The structure is a dict contains...
+            success: a boolean specified whether the file is parsed
+            package_nodes: a list of package declaration nodes
+            imports: a list of imported class paths
+            import_nodes: a list of import declaration nodes
+            types: a list of type names used in the file
+            classes: a list of classes, each class is a dict contains name,
+                nodes, constructors, fields and methods
+
+        @param file_path: a path to Java file
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        signature = (stat.st_mtime, stat.st_size)
+        structure = self.get_cached_structure(file_path, signature)
+        if structure:
+            return structure
+
+        java_file = open(file_path, "r")
+        source_code = java_file.read()
+        java_file.close()
+        content_hash = hashlib.sha1(source_code.encode("utf-8")).hexdigest()
+        structure = self.get_cached_structure(
+            file_path, signature, content_hash
+        )
+        if structure:
+            return structure
+
+        ActionHistory().add_action(
+            "javatar.core.java_structure.structure_in_file",
+            "Parse file [file_path=" + file_path + "]"
+        )
+        structure = self.parse_structure(source_code, content_hash)
+        self.store_structure(file_path, signature, content_hash, structure)
+        return structure
+
+    def parse_structure(self, source_code, content_hash=None):
+        """
+        Parses Java source code and returns its structure
+
+        @param source_code: a Java source code
+        @param content_hash: a hash of the source code
+            if provided, the parse result will be loaded from (or stored to)
+            the parse cache
+        """
+        structure = {
+            "success": False,
+            "package_nodes": [],
+            "imports": [],
+            "import_nodes": [],
+            "types": [],
+            "classes": [],
+            "errors": []
+        }
+        # Recovered parse still yields the structure of incomplete code
+        parser = GrammarManager().get_parser("Java8", recover=True)
+        parse_output = None
+        if content_hash:
+            parse_output = ParseCache().load_parse(
+                parser, source_code, content_hash
+            )
+        if parse_output is None:
+            parse_output = parser.parse_grammar(source_code)
+            if content_hash:
+                ParseCache().store_parse(parser, parse_output, content_hash)
+        if not parse_output["success"]:
+            return structure
+        structure["success"] = True
+        structure["errors"] = parse_output["errors"]
+
+        structure["package_nodes"] = parser.find_by_selectors(
+            Settings().get("package_declaration_selector")
+        )
+
+        type_declarations = parser.find_by_selectors(
+            Settings().get("type_selectors")
+        )
+        for type_declaration in type_declarations:
+            structure["types"].append(type_declaration["value"])
+
+        declarations = parser.find_by_selectors(
+            Settings().get("declarations_selector")
+        )
+        structure["import_nodes"] = parser.find_by_selectors(
+            Settings().get("import_declaration_selector"),
+            declarations
+        )
+        import_declarations = parser.find_by_selectors(
+            Settings().get("import_declaration_package_selector"),
+            declarations
+        )
+        for import_declaration in import_declarations:
+            structure["imports"].append(
+                JavaClassPath(import_declaration["value"])
+            )
+
+        structure["classes"] = self.parse_classes(parser)
+        return structure
+
+    def parse_classes(self, parser):
+        """
+        Returns a list of classes from the regions in the parser
+
+        @param parser: a parser contains the parsed regions
+        """
+        classes = []
+        class_names = parser.find_by_selectors(
+            Settings().get("class_declaration_name_selector"),
+        )
+        for class_name in class_names:
+            nodes = parser.find_by_selectors(
+                Settings().get("class_members_filter_selector") % (
+                    class_name["value"]
+                )
+            )
+            jclass = {
+                "name": class_name["value"],
+                "nodes": nodes
+            }
+            jclass["constructors"] = self.constructors_in_class(jclass)
+            jclass["fields"] = self.fields_in_class(jclass)
+            jclass["methods"] = self.methods_in_class(jclass)
+            classes.append(jclass)
+        return classes
+
     def package_declarations_in_file(self, file_path):
         if not JavaUtils().is_java_file(file_path):
             return []
         try:
-            parser = GrammarParser(sublime.decode_value(sublime.load_resource(
-                "Packages/Javatar/grammars/Java8.javatar-grammar"
-            )))
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            structure = self.get_cached_structure(
+                file_path, (stat.st_mtime, stat.st_size)
+            )
+            if structure:
+                if structure["success"]:
+                    return list(structure["package_nodes"])
+                return None
 
             java_file = open(file_path, "r")
             source_code = java_file.read()
             java_file.close()
-            parse_output = parser.parse_grammar(source_code)
+            # Only the regions before type declarations have to be parsed
+            package_declaration_selector = Settings().get(
+                "package_declaration_selector"
+            )
+            parser = GrammarManager().get_parser("Java8")
+            parse_output = parser.parse_grammar(
+                source_code, targets=package_declaration_selector
+            )
             if parse_output["success"]:
-                return parser.find_by_selectors(
-                    Settings().get("package_declaration_selector")
-                )
+                return list(parser.find_by_selectors(
+                    package_declaration_selector
+                ))
         except Exception as e:
             ActionHistory().add_action(
                 "javatar.core.java_structure.classes_in_file",
@@ -124,39 +328,9 @@ class _JavaStructure:
             "types": []
         }
         try:
-            parser = GrammarParser(sublime.decode_value(sublime.load_resource(
-                "Packages/Javatar/grammars/Java8.javatar-grammar"
-            )))
-
-            java_file = open(file_path, "r")
-            source_code = java_file.read()
-            java_file.close()
-            parse_output = parser.parse_grammar(source_code)
-            if parse_output["success"]:
-                type_declarations = parser.find_by_selectors(
-                    Settings().get("type_selectors")
-                )
-                for type_declaration in type_declarations:
-                    imports_and_types["types"].append(
-                        type_declaration["value"]
-                    )
-
-                declarations = parser.find_by_selectors(
-                    Settings().get("declarations_selector")
-                )
-                imports_and_types["import_nodes"] = parser.find_by_selectors(
-                    Settings().get("import_declaration_selector"),
-                    declarations
-                )
-                import_declarations = parser.find_by_selectors(
-                    Settings().get("import_declaration_package_selector"),
-                    declarations
-                )
-                for import_declaration in import_declarations:
-                    class_path = JavaClassPath(import_declaration["value"])
-                    imports_and_types["imports"].append(
-                        class_path
-                    )
+            structure = self.structure_in_file(file_path)
+            for key in imports_and_types:
+                imports_and_types[key] = list(structure[key])
         except Exception as e:
             ActionHistory().add_action(
                 "javatar.core.java_structure.classes_in_file",
@@ -170,38 +344,63 @@ class _JavaStructure:
             return []
         classes = []
         try:
-            parser = GrammarParser(sublime.decode_value(sublime.load_resource(
-                "Packages/Javatar/grammars/Java8.javatar-grammar"
-            )))
+            structure = self.structure_in_file(file_path)
+            classes = list(structure["classes"])
+        except Exception as e:
+            ActionHistory().add_action(
+                "javatar.core.java_structure.classes_in_file",
+                "Error while parsing",
+                e
+            )
+
+        return classes
+
+    def iter_classes_in_file(self, file_path):
+        """
+        Yields classes of specified Java file as soon as each top-level
+            type declaration is parsed, so the parsing can be stopped before
+            the next declaration once the wanted class is found
+
+        Each declaration (including its nested classes) is parsed in full
+            before it is yielded, so a file with one top-level class is
+            parsed completely either way
+
+        The classes are the same as classes_in_file but without their
+            nodes (since regions are not kept)
+
+        @param file_path: a path to Java file
+        """
+        if not JavaUtils().is_java_file(file_path):
+            return
+        try:
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            structure = self.get_cached_structure(
+                file_path, (stat.st_mtime, stat.st_size)
+            )
+            if structure:
+                for jclass in structure["classes"]:
+                    yield jclass
+                return
 
             java_file = open(file_path, "r")
             source_code = java_file.read()
             java_file.close()
-            parse_output = parser.parse_grammar(source_code)
-            if parse_output["success"]:
-                class_names = parser.find_by_selectors(
-                    Settings().get("class_declaration_name_selector"),
-                )
-                for class_name in class_names:
-                    nodes = parser.find_by_selectors(
-                        Settings().get("class_members_filter_selector") % (
-                            class_name["value"]
-                        )
-                    )
-                    classes.append({
-                        "name": class_name["value"],
-                        "nodes": nodes
-                    })
+            parser = GrammarManager().get_parser("Java8", recover=True)
+            for regions in parser.iter_steps(source_code):
+                for jclass in self.parse_classes(parser):
+                    del jclass["nodes"]
+                    yield jclass
         except Exception as e:
             ActionHistory().add_action(
-                "javatar.core.java_structure.classes_in_file",
+                "javatar.core.java_structure.iter_classes_in_file",
                 "Error while parsing",
                 e
             )
 
-        return classes
-
     def constructors_in_class(self, jclass):
+        if "constructors" in jclass:
+            return jclass["constructors"]
         constructors = []
 
         ctors = GrammarParser.filter_by_selectors(
@@ -210,10 +409,7 @@ class _JavaStructure:
         )
 
         for ctor in ctors:
-            ctor_child = GrammarParser.filter_inside_region(
-                [ctor["begin"], ctor["end"]],
-                jclass["nodes"]
-            )
+            ctor_child = ctor.get_descendants()
             ctor_name = GrammarParser.filter_by_selectors(
                 Settings().get("class_constructor_name_selector"),
                 ctor_child
@@ -227,10 +423,7 @@ class _JavaStructure:
                 )
 
                 for param in param_list:
-                    param_child = GrammarParser.filter_inside_region(
-                        [param["begin"], param["end"]],
-                        ctor_child
-                    )
+                    param_child = param.get_descendants()
                     param_type = GrammarParser.filter_by_selectors(
                         Settings().get("parameter_type_selector"),
                         param_child
@@ -253,6 +446,8 @@ class _JavaStructure:
         return constructors
 
     def fields_in_class(self, jclass):
+        if "fields" in jclass:
+            return jclass["fields"]
         field_list = []
 
         fields = GrammarParser.filter_by_selectors(
@@ -261,10 +456,7 @@ class _JavaStructure:
         )
 
         for field in fields:
-            field_child = GrammarParser.filter_inside_region(
-                [field["begin"], field["end"]],
-                jclass["nodes"]
-            )
+            field_child = field.get_descendants()
             field_type = GrammarParser.filter_by_selectors(
                 Settings().get("class_field_type_selector"),
                 field_child
@@ -282,6 +474,8 @@ class _JavaStructure:
         return field_list
 
     def methods_in_class(self, jclass):
+        if "methods" in jclass:
+            return jclass["methods"]
         method_list = []
 
         methods = GrammarParser.filter_by_selectors(
@@ -290,10 +484,7 @@ class _JavaStructure:
         )
 
         for method in methods:
-            method_child = GrammarParser.filter_inside_region(
-                [method["begin"], method["end"]],
-                jclass["nodes"]
-            )
+            method_child = method.get_descendants()
             method_return_type = GrammarParser.filter_by_selectors(
                 Settings().get("class_method_type_selector"),
                 method_child
@@ -311,10 +502,7 @@ class _JavaStructure:
                 )
 
                 for param in param_list:
-                    param_child = GrammarParser.filter_inside_region(
-                        [param["begin"], param["end"]],
-                        method_child
-                    )
+                    param_child = param.get_descendants()
                     param_type = GrammarParser.filter_by_selectors(
                         Settings().get("parameter_type_selector"),
                         param_child
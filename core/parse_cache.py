@@ -0,0 +1,204 @@
+import os
+import threading
+import zlib
+from .action_history import ActionHistory
+from .settings import Settings
+
+
+class _ParseCache:
+
+    """
+    Persistent parse results of unchanged files (keyed by grammar and
+        content hashes) in a folder next to the cache file
+    """
+
+    @classmethod
+    def instance(cls):
+        if not hasattr(cls, "_instance"):
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Cache folder => total size of its entries
+        self.cache_sizes = {}
+
+    def get_cache_path(self):
+        """
+        Returns a path to the parse cache folder or None if the cache is
+            disabled or the cache location is not exists
+        """
+        from .macro import Macro
+        if Settings().get("parse_cache_size", 50) <= 0:
+            return None
+        cache_location = Macro().parse(Settings().get(
+            "cache_file_location"
+        ))
+        if not cache_location or not os.path.isdir(cache_location):
+            return None
+        return os.path.join(cache_location, ".javatar-parse-cache")
+
+    def get_entry_path(self, cache_path, parser, content_hash):
+        """
+        Returns a path to the parse result of specified parser and content
+
+        @param cache_path: a path to the parse cache folder
+        @param parser: a parser of the content
+        @param content_hash: a hash of the content
+        """
+        # Recovered parses contain error regions so they are stored apart
+        return os.path.join(
+            cache_path,
+            "%s%s-%s.jtpr" % (
+                parser.compiled_grammar.get_signature()[:16],
+                "r" if parser.recover else "",
+                content_hash
+            )
+        )
+
+    def load_parse(self, parser, data, content_hash):
+        """
+        Restores the parse result of specified data to the parser, returns
+            a parse output or None if the data is not in the cache
+
+        @param parser: a parser to restore the result to
+        @param data: a parsed data
+        @param content_hash: a hash of the data
+        """
+        cache_path = self.get_cache_path()
+        if not cache_path:
+            return None
+        entry_path = self.get_entry_path(cache_path, parser, content_hash)
+        try:
+            entry_file = open(entry_path, "rb")
+            dumped = entry_file.read()
+            entry_file.close()
+            parse_output = parser.load_parse(data, zlib.decompress(dumped))
+            if parse_output is not None:
+                # Recently used entries are evicted last
+                os.utime(entry_path, None)
+            return parse_output
+        except (OSError, zlib.error):
+            return None
+
+    def store_parse(self, parser, parse_output, content_hash):
+        """
+        Stores the last parse result of the parser
+
+        @param parser: a parser contains the parse result
+        @param parse_output: an output of the parse
+        @param content_hash: a hash of the parsed data
+        """
+        cache_path = self.get_cache_path()
+        if not cache_path:
+            return
+        entry_path = self.get_entry_path(cache_path, parser, content_hash)
+        dumped = zlib.compress(parser.dump_parse(parse_output), 1)
+        with self.lock:
+            # Folder is scanned before the entry is written, so the entry
+            #   is not counted twice
+            self.get_cache_size(cache_path)
+        try:
+            if not os.path.isdir(cache_path):
+                os.makedirs(cache_path)
+            temp_path = "%s.%s.tmp" % (entry_path, threading.get_ident())
+            entry_file = open(temp_path, "wb")
+            entry_file.write(dumped)
+            entry_file.close()
+            old_size = 0
+            if os.path.exists(entry_path):
+                old_size = os.path.getsize(entry_path)
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            ActionHistory().add_action(
+                "javatar.core.parse_cache.store_parse",
+                "Error while storing parse result",
+                e
+            )
+            return
+        with self.lock:
+            cache_size = self.get_cache_size(cache_path)
+            cache_size += len(dumped) - old_size
+            self.cache_sizes[cache_path] = cache_size
+        self.evict(cache_path)
+
+    def get_cache_size(self, cache_path):
+        """
+        Returns a total size of the entries in the parse cache folder,
+            the folder is only scanned on first use
+
+        @param cache_path: a path to the parse cache folder
+        """
+        if cache_path not in self.cache_sizes:
+            cache_size = 0
+            for entry in self.get_entries(cache_path):
+                cache_size += entry[1]
+            self.cache_sizes[cache_path] = cache_size
+        return self.cache_sizes[cache_path]
+
+    def get_entries(self, cache_path):
+        """
+        Returns a list of (access time, size, path) of the entries in
+            the parse cache folder
+
+        @param cache_path: a path to the parse cache folder
+        """
+        entries = []
+        if not os.path.isdir(cache_path):
+            return entries
+        for file_name in os.listdir(cache_path):
+            if not file_name.endswith(".jtpr"):
+                continue
+            entry_path = os.path.join(cache_path, file_name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return entries
+
+    def evict(self, cache_path):
+        """
+        Removes least recently used entries until the cache is smaller than
+            its maximum size
+
+        @param cache_path: a path to the parse cache folder
+        """
+        max_size = Settings().get("parse_cache_size", 50) * 1024 * 1024
+        with self.lock:
+            if self.get_cache_size(cache_path) <= max_size:
+                return
+            entries = self.get_entries(cache_path)
+            entries.sort()
+            cache_size = sum(entry[1] for entry in entries)
+            # Leave some room so eviction does not happen on every store
+            while entries and cache_size > max_size * 0.8:
+                _, entry_size, entry_path = entries.pop(0)
+                try:
+                    os.remove(entry_path)
+                    cache_size -= entry_size
+                except OSError:
+                    pass
+            self.cache_sizes[cache_path] = cache_size
+
+    def reset(self):
+        """
+        Removes all entries from the parse cache folder
+        """
+        cache_path = self.get_cache_path()
+        if not cache_path:
+            return
+        ActionHistory().add_action(
+            "javatar.core.parse_cache.reset", "Reset parse cache"
+        )
+        with self.lock:
+            for entry in self.get_entries(cache_path):
+                try:
+                    os.remove(entry[2])
+                except OSError:
+                    pass
+            self.cache_sizes[cache_path] = 0
+
+
+def ParseCache():
+    return _ParseCache.instance()
@@ -1,6 +1,7 @@
 import sublime
 import os
 import time
+from .file_walker import FileWalker
 from .settings import Settings
 
 
@@ -77,17 +78,17 @@ class _StateProperty:
         @param can_empty: a boolean specified whether the empty folder will
             consider as a source folder
         """
-        empty = True
-        for name in os.listdir(path):
-            empty = False
-            path_name = os.path.join(path, name)
-            if can_empty:
-                if os.path.isdir(path_name):
-                    if self.is_source_folder(path_name, can_empty):
-                        return True
-            if os.path.isfile(path_name) and self.is_java(path_name):
+        if not os.path.isdir(path):
+            return False
+        dir_names, file_names = FileWalker().list_dir(path)
+        for name in file_names:
+            if self.is_java(os.path.join(path, name)):
                 return True
-        return can_empty and empty
+        if can_empty:
+            for name in dir_names:
+                if self.is_source_folder(os.path.join(path, name), can_empty):
+                    return True
+        return can_empty and not dir_names and not file_names
 
     def load_cache(self):
         from .macro import Macro
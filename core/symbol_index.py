@@ -0,0 +1,813 @@
+import sublime
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from .action_history import ActionHistory
+from .event_handler import EventHandler
+from .file_walker import FileWalker
+from .java_utils import JavaUtils
+from .settings import Settings
+from .state_property import StateProperty
+from .thread_progress import ThreadProgress
+
+
+INDEX_VERSION = 1
+# Files without a match cannot declare a main method, so they are not parsed
+MAIN_METHOD_PATTERN = re.compile("\\bstatic\\b[^;{}]*\\bvoid\\s+main\\s*\\(")
+
+
+class _SymbolIndex:
+
+    """
+    Persistent index of classes (and optionally their methods and fields)
+        in the source folders, stored next to the cache file of the project
+
+    The index is built and kept up to date in the background as Java files
+        are saved, loaded or closed, queries made while the index is not
+        ready are answered from the source folders
+    """
+
+    @classmethod
+    def instance(cls):
+        if not hasattr(cls, "_instance"):
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Only one index is built at a time
+        self.build_lock = threading.Lock()
+        # (index path, source folders) => loaded index
+        self.indexes = {}
+        self.queue_lock = threading.Lock()
+        # File path => None, in the queued order
+        self.queue = OrderedDict()
+        self.reconcile_queued = False
+        # Index key => whether the index is being built
+        self.builds = OrderedDict()
+        # Index key => (modification time, members) of the index file which
+        #   cannot be used
+        self.unusable_loads = {}
+        # Index path => modified index
+        self.modified_indexes = {}
+        self.indexer = None
+        self.indexer_scheduled = False
+        EventHandler().register_handler(
+            self,
+            EventHandler().ON_POST_SAVE_ASYNC |
+            EventHandler().ON_LOAD_ASYNC |
+            EventHandler().ON_CLOSE
+        )
+
+    def startup(self):
+        """
+        Updates the index of current project with the files changed while
+            Sublime Text is closed
+        """
+        self.queue_reconcile()
+
+    def on_post_save_async(self, view):
+        """
+        Saving event handler
+        """
+        self.queue_file(view.file_name())
+
+    def on_load_async(self, view):
+        """
+        Loading event handler
+        """
+        self.queue_file(view.file_name())
+
+    def on_close(self, view):
+        """
+        Closing event handler
+        """
+        self.queue_file(view.file_name())
+
+    def get_index_path(self):
+        """
+        Returns a path to the symbol index file or None if the cache location
+            is not exists
+        """
+        from .macro import Macro
+        cache_location = Macro().parse(Settings().get(
+            "cache_file_location"
+        ))
+        if not cache_location or not os.path.isdir(cache_location):
+            return None
+        return os.path.join(cache_location, ".javatar-symbol-index")
+
+    def get_index_key(self):
+        """
+        Returns a key of the index of the current source folders
+        """
+        source_folders = sorted(
+            os.path.abspath(source_folder)
+            for source_folder in StateProperty().get_source_folders()
+        )
+        return (self.get_index_path(), tuple(source_folders))
+
+    def get_index(self, build=True, wait=False):
+        """
+        Returns an index of the current source folders or None if the index
+            is not ready, the index will be loaded from the disk on first use
+
+        @param build: a boolean specified whether the index will be built
+            by the indexer if it is not exists
+        @param wait: a boolean specified whether the index will be built
+            in the current thread instead, must not be used on the main thread
+        """
+        key = self.get_index_key()
+        members = Settings().get("symbol_index_members", False)
+        with self.queue_lock:
+            building = key in self.builds
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None and self.is_valid(index, members):
+                return index
+            unusable = self.unusable_loads.get(key)
+        if not building:
+            try:
+                signature = (os.path.getmtime(key[0]), members)
+            except (OSError, TypeError):
+                signature = None
+            # Index file is only read again once it is changed
+            if signature is not None and signature != unusable:
+                index = self.load_index(key[0])
+                with self.lock:
+                    if self.is_valid(index, members, list(key[1])):
+                        # Index might be built while it is loaded
+                        current = self.indexes.get(key)
+                        if (current is None or
+                                not self.is_valid(current, members)):
+                            self.indexes[key] = index
+                        return self.indexes[key]
+                    self.unusable_loads[key] = signature
+        if wait:
+            return self.build_key(key)
+        if build:
+            self.queue_build(key)
+        return None
+
+    def build_key(self, key, on_progress=None):
+        """
+        Builds, stores and returns an index of specified key, or returns the
+            index if it is already built
+
+        @param key: a key of the index to build
+        @param on_progress: a callback with a number of processed files and
+            a number of all files
+        """
+        members = Settings().get("symbol_index_members", False)
+        with self.build_lock:
+            with self.lock:
+                index = self.indexes.get(key)
+                if index is not None and self.is_valid(index, members):
+                    return index
+            # Index is built outside the lock so queries are not blocked
+            index = self.build_index(list(key[1]), members, on_progress)
+            with self.lock:
+                self.indexes[key] = index
+            self.store_index(key[0], index)
+        return index
+
+    def is_valid(self, index, members, source_folders=None):
+        """
+        Returns whether specified index can be used
+
+        @param index: an index to validate
+        @param members: a boolean specified whether the index must contains
+            methods and fields
+        @param source_folders: a list of source folders of the index
+        """
+        if index is None or index["members"] != members:
+            return False
+        return (
+            source_folders is None or
+            index["source_folders"] == source_folders
+        )
+
+    def build_index(self, source_folders, members, on_progress=None):
+        """
+        Returns a new index of Java files in specified source folders
+
+        @param source_folders: a list of source folders to index
+        @param members: a boolean specified whether methods and fields
+            will be indexed
+        @param on_progress: a callback with a number of processed files and
+            a number of all files
+        """
+        ActionHistory().add_action(
+            "javatar.core.symbol_index.build_index",
+            "Build symbol index [source_folders=%s]" % (source_folders)
+        )
+        index = self.create_index(source_folders, members)
+        packages = self.get_packages(source_folders)
+        done = 0
+        for file_path, package in packages.items():
+            entry = self.get_file_entry(file_path, package, members)
+            if entry:
+                self.add_entry(index, file_path, entry)
+            done += 1
+            if on_progress:
+                on_progress(done, len(packages))
+        return index
+
+    def get_packages(self, source_folders):
+        """
+        Returns a dict of Java files in specified source folders and their
+            packages
+
+        @param source_folders: a list of source folders
+        """
+        packages = {}
+        # Directory path => package
+        dir_packages = {}
+        for file_path in FileWalker().get_files(
+                source_folders, JavaUtils().is_java_file):
+            dir_path = os.path.dirname(file_path)
+            if dir_path not in dir_packages:
+                dir_packages[dir_path] = JavaUtils().to_package(
+                    dir_path
+                ).as_class_path()
+            packages[file_path] = dir_packages[dir_path]
+        return packages
+
+    def create_index(self, source_folders, members, creation_time=None):
+        """
+        Returns an empty index
+
+        @param source_folders: a list of source folders of the index
+        @param members: a boolean specified whether the index contains
+            methods and fields
+        @param creation_time: a time when the index is created
+        """
+        return {
+            "creation_time": creation_time or int(time.time()),
+            "source_folders": source_folders,
+            "members": members,
+            # File path => file entry
+            "files": {},
+            # Class name => class paths
+            "classes": {},
+            # Class path => file paths
+            "class_files": {},
+            # Method or field name => class paths
+            "methods": {},
+            "fields": {}
+        }
+
+    def get_file_entry(self, file_path, package, members, main=False):
+        """
+        Returns an index entry of specified Java file or None if the file
+            cannot be read
+
+        The file name is always indexed as a class (as the public class),
+            other classes are only indexed with the members
+
+        @param file_path: a path to Java file
+        @param package: a package of the file
+        @param members: a boolean specified whether methods and fields
+            will be indexed
+        @param main: a boolean specified whether the file will be checked
+            for a main method, otherwise it is checked on first use
+        """
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        class_name = os.path.splitext(os.path.basename(file_path))[0]
+        entry = {
+            "mtime": mtime,
+            "package": package,
+            "classes": [class_name]
+        }
+        if main:
+            entry["main"] = self.has_main_method(file_path)
+        if members:
+            from .java_structure import JavaStructure
+            entry["methods"] = {}
+            entry["fields"] = {}
+            for jclass in JavaStructure().iter_classes_in_file(file_path):
+                if jclass["name"] not in entry["classes"]:
+                    entry["classes"].append(jclass["name"])
+                entry["methods"][jclass["name"]] = sorted(set(
+                    method["name"] for method in jclass["methods"]
+                ))
+                entry["fields"][jclass["name"]] = sorted(set(
+                    field["name"] for field in jclass["fields"]
+                ))
+        return entry
+
+    def has_main_method(self, file_path):
+        """
+        Returns whether specified Java file declares a main method
+
+        @param file_path: a path to Java file
+        """
+        from .java_structure import JavaStructure
+        from .regex import RE
+        try:
+            java_file = open(file_path, "r")
+            source_code = java_file.read()
+            java_file.close()
+        except (OSError, ValueError):
+            return False
+        if not MAIN_METHOD_PATTERN.search(source_code):
+            return False
+        for jclass in JavaStructure().classes_in_file(file_path):
+            for method in JavaStructure().methods_in_class(jclass):
+                if method["name"] != "main":
+                    continue
+                elif len(method["params"]) != 1:
+                    continue
+                elif not RE().get("string_type_match", "^String\\b").search(
+                        method["params"][0]["type"]):
+                    continue
+                return True
+        return False
+
+    def get_class_path(self, package, class_name):
+        """
+        Returns a class path of specified class in the package
+
+        @param package: a package of the class
+        @param class_name: a class name
+        """
+        if package:
+            return package + "." + class_name
+        return class_name
+
+    def add_entry(self, index, file_path, entry):
+        """
+        Adds a file entry and its symbols to the index
+
+        @param index: an index to add to
+        @param file_path: a path to Java file
+        @param entry: an entry of the file
+        """
+        self.remove_entry(index, file_path)
+        index["files"][file_path] = entry
+        for class_name in entry["classes"]:
+            class_path = self.get_class_path(entry["package"], class_name)
+            index["classes"].setdefault(class_name, []).append(class_path)
+            index["class_files"].setdefault(class_path, []).append(file_path)
+        for key in ("methods", "fields"):
+            for class_name, names in entry.get(key, {}).items():
+                class_path = self.get_class_path(entry["package"], class_name)
+                for name in names:
+                    index[key].setdefault(name, []).append(class_path)
+
+    def remove_entry(self, index, file_path):
+        """
+        Removes a file entry and its symbols from the index
+
+        @param index: an index to remove from
+        @param file_path: a path to Java file
+        """
+        entry = index["files"].pop(file_path, None)
+        if entry is None:
+            return
+        for class_name in entry["classes"]:
+            class_path = self.get_class_path(entry["package"], class_name)
+            self.remove_symbol(index["classes"], class_name, class_path)
+            self.remove_symbol(index["class_files"], class_path, file_path)
+        for key in ("methods", "fields"):
+            for class_name, names in entry.get(key, {}).items():
+                class_path = self.get_class_path(entry["package"], class_name)
+                for name in names:
+                    self.remove_symbol(index[key], name, class_path)
+
+    def remove_symbol(self, symbols, name, value):
+        values = symbols.get(name)
+        if values and value in values:
+            values.remove(value)
+            if not values:
+                del symbols[name]
+
+    def load_index(self, index_path):
+        """
+        Returns an index stored in specified file or None if the file is not
+            a valid index
+
+        @param index_path: a path to the symbol index file
+        """
+        if not index_path or not os.path.exists(index_path):
+            return None
+        try:
+            index_file = open(index_path, "r")
+            stored = json.loads(index_file.read())
+            index_file.close()
+            if stored.get("version") != INDEX_VERSION:
+                return None
+            index = self.create_index(
+                stored["source_folders"],
+                stored["members"],
+                stored["creation_time"]
+            )
+            for file_path, entry in stored["files"].items():
+                self.add_entry(index, file_path, entry)
+            return index
+        except (OSError, ValueError, KeyError, TypeError,
+                AttributeError) as e:
+            ActionHistory().add_action(
+                "javatar.core.symbol_index.load_index",
+                "Error while loading symbol index",
+                e
+            )
+            return None
+
+    def store_index(self, index_path, index):
+        """
+        Stores specified index to the file
+
+        @param index_path: a path to the symbol index file
+        @param index: an index to store
+        """
+        if not index_path:
+            return
+        stored = {
+            "version": INDEX_VERSION,
+            "creation_time": index["creation_time"],
+            "source_folders": index["source_folders"],
+            "members": index["members"],
+            "files": index["files"]
+        }
+        with self.lock:
+            data = json.dumps(stored, separators=(",", ":"))
+        temp_path = "%s.%s.tmp" % (index_path, threading.get_ident())
+        try:
+            index_file = open(temp_path, "w")
+            index_file.write(data)
+            index_file.close()
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            ActionHistory().add_action(
+                "javatar.core.symbol_index.store_index",
+                "Error while storing symbol index",
+                e
+            )
+
+    def contains_file(self, index, file_path):
+        """
+        Returns whether specified file is in the source folders of the index
+
+        @param index: an index to check
+        @param file_path: a file path to check
+        """
+        return any(
+            file_path.startswith(os.path.join(source_folder, ""))
+            for source_folder in index["source_folders"]
+        )
+
+    def update_file(self, index, file_path, package=None):
+        """
+        Updates an entry of specified file if the file is added, modified
+            or removed and returns whether the index is changed
+
+        @param index: an index to update
+        @param file_path: a path to Java file
+        @param package: a package of the file
+        """
+        with self.lock:
+            entry = index["files"].get(file_path)
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            mtime = None
+        if mtime is None:
+            if entry is None:
+                return False
+            with self.lock:
+                self.remove_entry(index, file_path)
+            return True
+        if entry is not None and entry["mtime"] == mtime:
+            return False
+        if package is None:
+            package = JavaUtils().to_package(
+                os.path.dirname(file_path)
+            ).as_class_path()
+        # File is parsed outside the lock so queries are not blocked
+        entry = self.get_file_entry(
+            file_path, package, index["members"], main=True
+        )
+        with self.lock:
+            if entry:
+                self.add_entry(index, file_path, entry)
+            else:
+                self.remove_entry(index, file_path)
+        return True
+
+    def reconcile_index(self, index, on_progress=None):
+        """
+        Updates the index with the files which are added, modified or removed
+            since the index is updated and returns whether the index is changed
+
+        @param index: an index to update
+        @param on_progress: a callback with a number of processed files and
+            a number of all files
+        """
+        ActionHistory().add_action(
+            "javatar.core.symbol_index.reconcile_index",
+            "Reconcile symbol index [source_folders=%s]" % (
+                index["source_folders"]
+            )
+        )
+        packages = self.get_packages(index["source_folders"])
+        changed = False
+        with self.lock:
+            for file_path in list(index["files"]):
+                if file_path not in packages:
+                    self.remove_entry(index, file_path)
+                    changed = True
+        done = 0
+        for file_path, package in packages.items():
+            if self.update_file(index, file_path, package):
+                changed = True
+            done += 1
+            if on_progress:
+                on_progress(done, len(packages))
+        return changed
+
+    def queue_file(self, file_path):
+        """
+        Queues specified file to be updated in the index
+
+        @param file_path: a path to Java file
+        """
+        if not file_path or not JavaUtils().is_java_file(file_path):
+            return
+        with self.queue_lock:
+            if not self.reconcile_queued:
+                self.queue[os.path.abspath(file_path)] = None
+                if len(self.queue) > Settings().get(
+                        "symbol_index_queue_size", 1000):
+                    # Too many files, reconcile the whole index instead
+                    self.queue.clear()
+                    self.reconcile_queued = True
+        self.schedule_indexer()
+
+    def queue_build(self, key):
+        """
+        Queues an index of specified key to be built
+
+        @param key: a key of the index to build
+        """
+        with self.queue_lock:
+            if key in self.builds:
+                return
+            self.builds[key] = False
+        self.schedule_indexer()
+
+    def queue_reconcile(self):
+        """
+        Queues the index of current project to be reconciled with the files
+        """
+        with self.queue_lock:
+            self.queue.clear()
+            self.reconcile_queued = True
+        self.schedule_indexer()
+
+    def get_queue_size(self):
+        """
+        Returns a number of queued files
+        """
+        with self.queue_lock:
+            return len(self.queue)
+
+    def schedule_indexer(self):
+        """
+        Schedules the indexer to run after a short delay, so the files saved
+            together are indexed at once
+        """
+        with self.queue_lock:
+            if self.indexer is not None or self.indexer_scheduled:
+                return
+            self.indexer_scheduled = True
+        sublime.set_timeout(self.start_indexer, 500)
+
+    def start_indexer(self):
+        """
+        Starts the indexer if there are queued tasks
+        """
+        from ..threads import SymbolIndexerThread
+        with self.queue_lock:
+            self.indexer_scheduled = False
+            if self.indexer is not None:
+                return
+            if (not self.queue and not self.reconcile_queued and
+                    not self.builds):
+                return
+            self.indexer = SymbolIndexerThread(self)
+            indexer = self.indexer
+        ThreadProgress(indexer, "Updating symbol index")
+
+    def next_task(self):
+        """
+        Returns the next task of the indexer or None if there is no task left
+        """
+        with self.queue_lock:
+            for key, building in self.builds.items():
+                if not building:
+                    self.builds[key] = True
+                    return ("build", key)
+            if self.reconcile_queued:
+                self.reconcile_queued = False
+                return ("reconcile", None)
+            if self.queue:
+                return ("file", self.queue.popitem(last=False)[0])
+            if self.modified_indexes:
+                index_path, index = self.modified_indexes.popitem()
+                return ("store", (index_path, index))
+            # Indexer is stopped within the lock, so newly queued tasks
+            #   will schedule another indexer
+            self.indexer = None
+            return None
+
+    def run_task(self, task, on_progress=None):
+        """
+        Runs an indexer task
+
+        @param task: a task to run
+        @param on_progress: a callback with a number of processed files and
+            a number of all files
+        """
+        task_type, argument = task
+        try:
+            if task_type == "store":
+                self.store_index(*argument)
+                return
+            if task_type == "build":
+                try:
+                    self.build_key(argument, on_progress)
+                finally:
+                    with self.queue_lock:
+                        self.builds.pop(argument, None)
+                return
+            index = self.get_index(build=False)
+            if index is None:
+                # Index will be built on first use
+                return
+            if task_type == "reconcile":
+                changed = self.reconcile_index(index, on_progress)
+            elif self.contains_file(index, argument):
+                changed = self.update_file(index, argument)
+            else:
+                changed = False
+            if changed:
+                with self.queue_lock:
+                    self.modified_indexes[self.get_index_path()] = index
+        except Exception as e:
+            ActionHistory().add_action(
+                "javatar.core.symbol_index.run_task",
+                "Error while updating symbol index [task=%s]" % (task_type),
+                e
+            )
+
+    def get_class_paths(self, class_name):
+        """
+        Returns a list of class paths of specified class name in the source
+            folders
+
+        @param class_name: a class name
+        """
+        return self.get_class_paths_for_classes([class_name]).get(
+            class_name, []
+        )
+
+    def get_class_paths_for_classes(self, class_names):
+        """
+        Returns a dict of class names and their class paths in the source
+            folders, class names without any class path are not included
+
+        While the index is not ready, only the files named after the classes
+            are found
+
+        @param class_names: a list of class names
+        """
+        index = self.get_index()
+        class_paths = {}
+        if index is not None:
+            # Index is read within the lock, so it is not read while the
+            #   indexer is updating it
+            with self.lock:
+                for class_name in class_names:
+                    if class_name in index["classes"]:
+                        class_paths[class_name] = sorted(set(
+                            index["classes"][class_name]
+                        ))
+            return class_paths
+        class_names = set(class_names)
+        for file_path, package in self.get_packages(
+                StateProperty().get_source_folders()).items():
+            class_name = os.path.splitext(os.path.basename(file_path))[0]
+            if class_name in class_names:
+                class_paths.setdefault(class_name, set()).add(
+                    self.get_class_path(package, class_name)
+                )
+        return {
+            class_name: sorted(paths)
+            for class_name, paths in class_paths.items()
+        }
+
+    def get_class_file(self, class_path):
+        """
+        Returns a path to Java file declares specified class path or None
+            if the class is not indexed or the index is not ready
+
+        @param class_path: a class path
+        """
+        index = self.get_index()
+        if index is None:
+            return None
+        with self.lock:
+            file_paths = index["class_files"].get(class_path)
+            if file_paths:
+                return file_paths[0]
+        return None
+
+    def get_main_files(self):
+        """
+        Returns a list of Java files which declare a main method in the
+            source folders
+
+        Files which are not checked yet are checked, removed files are
+            dropped and the index is stored with the results, so this must
+            not be used on the main thread
+        """
+        index = self.get_index(wait=True)
+        main_files = []
+        changed = False
+        with self.lock:
+            entries = list(index["files"].items())
+        for file_path, entry in entries:
+            if not os.path.isfile(file_path):
+                # File is removed before the indexer is notified
+                with self.lock:
+                    self.remove_entry(index, file_path)
+                changed = True
+                continue
+            if "main" not in entry:
+                main = self.has_main_method(file_path)
+                with self.lock:
+                    entry["main"] = main
+                changed = True
+            if entry["main"]:
+                main_files.append(file_path)
+        if changed:
+            self.store_index(self.get_index_path(), index)
+        return sorted(main_files)
+
+    def find_methods(self, method_name):
+        """
+        Returns a list of class paths which declare specified method, only
+            available when members are indexed and the index is ready
+
+        @param method_name: a method name
+        """
+        index = self.get_index()
+        if index is None:
+            return []
+        with self.lock:
+            return sorted(set(index["methods"].get(method_name, [])))
+
+    def find_fields(self, field_name):
+        """
+        Returns a list of class paths which declare specified field, only
+            available when members are indexed and the index is ready
+
+        @param field_name: a field name
+        """
+        index = self.get_index()
+        if index is None:
+            return []
+        with self.lock:
+            return sorted(set(index["fields"].get(field_name, [])))
+
+    def reset(self):
+        """
+        Removes all loaded indexes and the index file of current project
+        """
+        ActionHistory().add_action(
+            "javatar.core.symbol_index.reset", "Reset symbol index"
+        )
+        index_path = self.get_index_path()
+        with self.queue_lock:
+            self.modified_indexes = {}
+        with self.lock:
+            self.indexes = {}
+            self.unusable_loads = {}
+            if index_path and os.path.exists(index_path):
+                try:
+                    os.remove(index_path)
+                except OSError:
+                    pass
+
+
+def SymbolIndex():
+    return _SymbolIndex.instance()
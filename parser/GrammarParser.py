@@ -24,21 +24,1578 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import copy
+import hashlib
+import json
 import re
-from time import clock
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping, Sequence
+from time import perf_counter as clock
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
 
+# How far a pattern may look behind its starting position
+CONTEXT_NONE = 0
+CONTEXT_WORD_BOUNDARY = 1
+CONTEXT_ANY = 2
 
-class GrammarParser():
-    def __init__(self, grammar, printer=None):
+# Kinds of compiled grammar rule
+RULE_EMPTY = 0
+RULE_MATCH = 1
+RULE_PARSE = 2
+RULE_PARSE_ANY = 3
+RULE_INCLUDE = 4
+
+# States of a rule call in the parser stack
+STATE_ENTER = 0
+STATE_EXCLUDE = 1
+STATE_BODY = 2
+STATE_MATCH = 3
+STATE_MATCH_END = 4
+STATE_PARSE = 5
+STATE_PARSE_ANY = 6
+STATE_PACKRAT = 7
+STATE_RULE_END = 8
+STATE_END = 9
+STATE_FAIL = 10
+STATE_PROFILE = 11
+STATE_RECOVER = 12
+
+# Kinds of position in the token stream
+KIND_NONE = 0
+KIND_TOKEN = 1
+KIND_SEPARATOR = 2
+
+# Maximum number of nested rule calls (left recursive grammar never stops)
+MAX_DEPTH = 100000
+
+# Leading characters of a rule (ASCII characters, any other character and
+#   the end of data) for lookahead dispatch of alternatives
+FIRST_OTHER = 128
+FIRST_END = 129
+FIRST_ALL = (1 << 129) - 1
+FIRST_ASCII = (1 << 128) - 1
+
+# Header of dumped parse results (magic, version, size of column item,
+#   success, begin, end, number of names, paths and regions)
+DUMP_MAGIC = b"JTPR"
+DUMP_VERSION = 1
+DUMP_HEADER = struct.Struct("<4sHBBqqIII")
+
+WORD_PATTERN = re.compile("\\w")
+
+CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: re.compile("\\d"),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile("\\D"),
+    sre_constants.CATEGORY_SPACE: re.compile("\\s"),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile("\\S"),
+    sre_constants.CATEGORY_WORD: re.compile("\\w"),
+    sre_constants.CATEGORY_NOT_WORD: re.compile("\\W")
+}
+
+
+def pattern_context(pattern):
+    context = CONTEXT_NONE
+    index = 0
+    in_class = False
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            if not in_class and pattern[index+1:index+2] in ("b", "B"):
+                context = max(context, CONTEXT_WORD_BOUNDARY)
+            elif not in_class and pattern[index+1:index+2] == "A":
+                return CONTEXT_ANY
+            index += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            # Negation and leading "]" are part of the class
+            if pattern[index+1:index+2] == "^":
+                index += 1
+            if pattern[index+1:index+2] == "]":
+                index += 1
+        elif char == "^" or pattern.startswith("(?<=", index) or pattern.startswith("(?<!", index):
+            return CONTEXT_ANY
+        index += 1
+    return context
+
+
+def char_first(char):
+    if char < FIRST_OTHER:
+        return 1 << char
+    return 1 << FIRST_OTHER
+
+
+def set_first(items):
+    mask = 0
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            mask |= char_first(av)
+        elif op == sre_constants.RANGE:
+            for char in range(av[0], min(av[1], FIRST_OTHER-1)+1):
+                mask |= 1 << char
+            if av[1] >= FIRST_OTHER:
+                mask |= 1 << FIRST_OTHER
+        elif op == sre_constants.CATEGORY and av in CATEGORY_PATTERNS:
+            category = CATEGORY_PATTERNS[av]
+            for char in range(FIRST_OTHER):
+                if category.match(chr(char)) is not None:
+                    mask |= 1 << char
+            mask |= 1 << FIRST_OTHER
+        else:
+            return FIRST_ALL
+    if negate:
+        mask = (FIRST_ASCII & ~mask) | (1 << FIRST_OTHER)
+    return mask
+
+
+# Returns a tuple of (leading characters, can be empty) of parsed pattern
+#   items, unknown items may start with any character
+def items_first(items):
+    mask = 0
+    for op, av in items:
+        nullable = False
+        if op == sre_constants.LITERAL:
+            mask |= char_first(av)
+        elif op == sre_constants.NOT_LITERAL:
+            mask |= FIRST_ALL & ~char_first(av) | (1 << FIRST_OTHER)
+        elif op == sre_constants.ANY:
+            mask |= FIRST_ALL
+        elif op == sre_constants.IN:
+            mask |= set_first(av)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                branch_mask, branch_nullable = items_first(branch)
+                mask |= branch_mask
+                nullable = nullable or branch_nullable
+        elif op == sre_constants.SUBPATTERN:
+            if av[1] & sre_constants.SRE_FLAG_IGNORECASE:
+                return (FIRST_ALL, True)
+            sub_mask, nullable = items_first(av[-1])
+            mask |= sub_mask
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or op == getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+            if av[1] != 0:
+                sub_mask, nullable = items_first(av[2])
+                mask |= sub_mask
+            nullable = nullable or av[0] == 0 or av[1] == 0
+        elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+            sub_mask, nullable = items_first(av)
+            mask |= sub_mask
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            # Assertions only restrict the match
+            nullable = True
+        else:
+            return (FIRST_ALL, True)
+        if not nullable:
+            return (mask, False)
+    return (mask, True)
+
+
+def pattern_first(regex):
+    if regex.flags & re.IGNORECASE:
+        return (FIRST_ALL, True)
+    try:
+        return items_first(sre_parse.parse(regex.pattern, regex.flags))
+    except Exception:
+        return (FIRST_ALL, True)
+
+
+class GrammarRule():
+    __slots__ = (
+        "kind", "name", "exclude", "optional", "multiple", "before_separator",
+        "after_separator", "pattern", "regex", "context", "rules", "include",
+        "target", "direct", "first", "lookahead", "recover"
+    )
+
+
+class GrammarOptimizer():
+    # Rewrites a grammar (without modifying it) into a grammar which adds the
+    #   same regions with fewer rules to parse, rules are only rewritten if
+    #   the separator adds no region (so where it is parsed is not matter)
+    FLAGS = ("name", "exclude", "optional", "multiple", "recover")
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.stats = None
+
+    def optimize(self):
+        grammar = copy.deepcopy(self.grammar)
+        self.repository = grammar.get("repository", {})
+        self.stats = {
+            "rules": [len(self.repository), 0],
+            "nodes": [self.count_nodes(grammar), 0],
+            "inlined": 0,
+            "hoisted": 0,
+            "collapsed": 0,
+            "merged": 0
+        }
+        separator = grammar.get("separator")
+        if separator is None or not self.has_name(separator, set()):
+            self.inline_rules(grammar)
+            # Rules parsed as separator have no separator between matches
+            separator_rules = set()
+            if separator is not None:
+                self.find_reachable_rules(separator, separator_rules)
+            separator_pattern = None
+            if separator is not None and "tokenizer" in grammar:
+                separator_pattern = grammar["tokenizer"]["separator"]
+            for mode in ("hoist", "collapse", "merge"):
+                pattern = separator_pattern if mode == "merge" else None
+                if separator is not None:
+                    grammar["separator"] = self.simplify_rule(separator, mode, None)
+                    separator = grammar["separator"]
+                if "compilation_unit" in grammar:
+                    # Compilation unit is kept as is (it is parsed in steps)
+                    self.simplify_children(grammar["compilation_unit"], mode, pattern)
+                for rule_name in self.repository:
+                    self.repository[rule_name] = self.simplify_rule(
+                        self.repository[rule_name], mode,
+                        None if rule_name in separator_rules else pattern
+                    )
+        self.stats["rules"][1] = len(self.repository)
+        self.stats["nodes"][1] = self.count_nodes(grammar)
+        return grammar
+
+    def get_stats(self):
+        return self.stats
+
+    def count_nodes(self, grammar):
+        rules = [grammar.get(key) for key in ("separator", "compilation_unit")]
+        rules.extend(grammar.get("repository", {}).values())
+        count = 0
+        while rules:
+            rule = rules.pop()
+            if rule is None:
+                continue
+            count += 1
+            rules.extend(self.get_children(rule))
+        return count
+
+    def get_children(self, rule):
+        children = list(rule.get("parse", rule.get("parse_any", [])))
+        for key in ("exclude", "recover"):
+            if key in rule:
+                children.append(rule[key])
+        return children
+
+    def get_flags(self, rule):
+        return [flag for flag in self.FLAGS if rule.get(flag) not in (None, False)]
+
+    # Returns True if the options can be moved from a rule to the only rule
+    #   it parses, multiple match continues after its separator while
+    #   other multiple rules continue right after the match
+    def can_move_flags(self, flags, rule):
+        return not self.get_flags(rule) and not ("multiple" in flags and "match" in rule)
+
+    def has_name(self, rule, visited):
+        if rule.get("name") is not None:
+            return True
+        if "include" in rule:
+            if rule["include"] in visited or rule["include"] not in self.repository:
+                return False
+            visited.add(rule["include"])
+            return self.has_name(self.repository[rule["include"]], visited)
+        for child in self.get_children(rule):
+            if self.has_name(child, visited):
+                return True
+        return False
+
+    def find_reachable_rules(self, rule, rule_names):
+        if "include" in rule and rule["include"] in self.repository and rule["include"] not in rule_names:
+            rule_names.add(rule["include"])
+            self.find_reachable_rules(self.repository[rule["include"]], rule_names)
+        for child in self.get_children(rule):
+            self.find_reachable_rules(child, rule_names)
+
+    def count_uses(self, rule, uses):
+        if "include" in rule:
+            uses[rule["include"]] = uses.get(rule["include"], 0) + 1
+        for child in self.get_children(rule):
+            self.count_uses(child, uses)
+
+    # Returns True if the rule only includes another rule (or matches) and
+    #   does not include itself
+    def is_trivial(self, rule_name):
+        visited = set()
+        while rule_name in self.repository and rule_name not in visited:
+            visited.add(rule_name)
+            rule = self.repository[rule_name]
+            if "match" in rule:
+                return True
+            if "include" not in rule or "exclude" in rule:
+                return False
+            rule_name = rule["include"]
+        return rule_name not in visited and rule_name not in self.repository
+
+    # Returns a copy of the included rule with the include options or None
+    #   if the options cannot be moved to the included rule
+    def get_inlined_rule(self, rule):
+        target = self.repository[rule["include"]]
+        flags = self.get_flags(rule)
+        if flags and not self.can_move_flags(flags, target):
+            return None
+        inlined_rule = copy.deepcopy(target)
+        for flag in flags:
+            inlined_rule[flag] = copy.deepcopy(rule[flag])
+        return inlined_rule
+
+    # Single-use and trivial rules are copied into their includes, rules
+    #   which are no longer included are removed
+    def inline_rules(self, grammar):
+        roots = [("", grammar.get("separator")), ("", grammar.get("compilation_unit"))]
+        changed = True
+        while changed:
+            changed = False
+            uses = {}
+            rules = [rule for _, rule in roots if rule is not None]
+            rules.extend(self.repository.values())
+            for rule in rules:
+                self.count_uses(rule, uses)
+            for owner, rule in roots + list(self.repository.items()):
+                if rule is not None and self.inline_children(owner, rule, uses):
+                    changed = True
+            if "compilation_unit" in grammar:
+                reachable_rules = set()
+                for _, rule in roots:
+                    if rule is not None:
+                        self.find_reachable_rules(rule, reachable_rules)
+                for rule_name in list(self.repository):
+                    if rule_name not in reachable_rules:
+                        del self.repository[rule_name]
+
+    def inline_children(self, owner, rule, uses):
+        changed = False
+        for key in ("parse", "parse_any"):
+            children = rule.get(key, [])
+            for index, child in enumerate(children):
+                target_name = child.get("include")
+                if target_name in self.repository and target_name != owner and (uses[target_name] == 1 or self.is_trivial(target_name)):
+                    inlined_rule = self.get_inlined_rule(child)
+                    if inlined_rule is not None:
+                        children[index] = inlined_rule
+                        self.stats["inlined"] += 1
+                        # Inlined rule is no longer single-use
+                        uses[target_name] += 1
+                        changed = True
+                        continue
+                if self.inline_children(owner, child, uses):
+                    changed = True
+        for key in ("exclude", "recover"):
+            if key in rule and self.inline_children(owner, rule[key], uses):
+                changed = True
+        return changed
+
+    def simplify_children(self, rule, mode, separator_pattern):
+        for key in ("exclude", "recover"):
+            if key in rule:
+                rule[key] = self.simplify_rule(rule[key], mode, separator_pattern)
+        if "parse" in rule:
+            children = [self.simplify_rule(child, mode, separator_pattern) for child in rule["parse"]]
+            if mode == "merge" and separator_pattern is not None:
+                children = self.merge_matches(children, separator_pattern)
+            rule["parse"] = children
+        elif "parse_any" in rule:
+            alternatives = [self.simplify_rule(child, mode, separator_pattern) for child in rule["parse_any"]]
+            if mode == "hoist":
+                alternatives = self.hoist_prefixes(alternatives, mode, separator_pattern)
+            elif mode == "collapse":
+                alternatives = self.collapse_matches(alternatives)
+            rule["parse_any"] = alternatives
+
+    # Returns a simplified rule, a rule list or alternatives with only one
+    #   rule is replaced by the rule (if its options can be combined)
+    def simplify_rule(self, rule, mode, separator_pattern):
+        self.simplify_children(rule, mode, separator_pattern)
+        children = rule.get("parse", rule.get("parse_any"))
+        if children is None or len(children) != 1:
+            return rule
+        flags = self.get_flags(rule)
+        if not flags:
+            return children[0]
+        if not self.can_move_flags(flags, children[0]):
+            return rule
+        for flag in flags:
+            children[0][flag] = rule[flag]
+        return children[0]
+
+    def is_plain(self, rule):
+        return not self.get_flags(rule) and "before_separator" not in rule and "after_separator" not in rule
+
+    def is_literal(self, rule):
+        if "match" not in rule or not self.is_plain(rule):
+            return False
+        try:
+            items = sre_parse.parse(rule["match"])
+        except Exception:
+            return False
+        return len(items) > 0 and all(op == sre_constants.LITERAL for op, av in items)
+
+    # Adjacent alternatives which start with the same rule are parsed as
+    #   the rule followed by alternatives of their remaining rules, so the
+    #   rule is only parsed once
+    def hoist_prefixes(self, alternatives, mode, separator_pattern):
+        hoisted = []
+        index = 0
+        while index < len(alternatives):
+            alternative = alternatives[index]
+            end = index + 1
+            if "parse" in alternative and self.is_plain(alternative) and len(alternative["parse"]) > 1:
+                prefix = alternative["parse"][0]
+                while end < len(alternatives) and "parse" in alternatives[end] and self.is_plain(alternatives[end]) and len(alternatives[end]["parse"]) > 1 and alternatives[end]["parse"][0] == prefix:
+                    end += 1
+            if end - index < 2:
+                hoisted.append(alternative)
+                index += 1
+                continue
+            remains = []
+            for alternative in alternatives[index:end]:
+                remains.append({"parse": alternative["parse"][1:]})
+            self.stats["hoisted"] += end - index - 1
+            hoisted.append(self.simplify_rule({
+                "parse": [prefix, self.simplify_rule({"parse_any": remains}, mode, separator_pattern)]
+            }, mode, separator_pattern))
+            index = end
+        return hoisted
+
+    # Adjacent literal alternatives are matched by one pattern
+    def collapse_matches(self, alternatives):
+        collapsed = []
+        run = []
+        for alternative in alternatives + [None]:
+            if alternative is not None and self.is_literal(alternative):
+                run.append(alternative["match"])
+                continue
+            if len(run) > 1:
+                collapsed.append({"match": "|".join(run)})
+                self.stats["collapsed"] += len(run) - 1
+            elif run:
+                collapsed.append({"match": run[0]})
+            run = []
+            if alternative is not None:
+                collapsed.append(alternative)
+        return collapsed
+
+    # Adjacent literal matches are matched by one pattern, separator
+    #   between them is matched atomically (like the separator rule which
+    #   never gives back what it is matched)
+    def merge_matches(self, children, separator_pattern):
+        groups = re.compile(separator_pattern).groups + 1
+        merged = []
+        run = []
+        for child in children + [None]:
+            if child is not None and self.is_literal(child):
+                run.append(child["match"])
+                continue
+            if len(run) > 1:
+                pattern = run[0]
+                for index, literal in enumerate(run[1:]):
+                    pattern += "(?=((?:%s)?))(?:\\%s)%s" % (separator_pattern, index*groups+1, literal)
+                merged.append({"match": pattern})
+                self.stats["merged"] += len(run) - 1
+            elif run:
+                merged.append({"match": run[0]})
+            run = []
+            if child is not None:
+                merged.append(child)
+        return merged
+
+
+class CompiledGrammar():
+    # Compiled grammar is never modified after compilation, so it can be
+    #   shared between parsers (and threads)
+    def __init__(self, grammar, optimize=False):
+        self.optimizer = None
+        if optimize:
+            self.optimizer = GrammarOptimizer(grammar)
+            grammar = self.optimizer.optimize()
         self.grammar = grammar
+        self.signature = None
+        self.patterns = {}
+        self.firsts = {}
+        self.rules = []
+        self.recover_rules = []
+        self.repository = {}
+        repository = grammar.get("repository", {})
+        for rule_name in repository:
+            self.repository[rule_name] = GrammarRule()
+        for rule_name in repository:
+            self.compile_rule(repository[rule_name], self.repository[rule_name])
+        # Rules which only include each other are never parsed directly
+        #   (so they are nested until the maximum depth is reached)
+        for rule_name in repository:
+            rule = self.repository[rule_name]
+            chain = []
+            while rule.direct and rule not in chain:
+                chain.append(rule)
+                rule = rule.target
+            if rule.direct:
+                for cycle_rule in chain[chain.index(rule):]:
+                    cycle_rule.direct = False
+        self.separator = None
+        if "separator" in grammar:
+            self.separator = self.compile_rule(grammar["separator"])
+        self.compilation_unit = None
+        self.unit_rules = None
+        if "compilation_unit" in grammar:
+            self.compilation_unit = self.compile_rule(grammar["compilation_unit"])
+            self.unit_rules = self.compile_unit_rules(grammar["compilation_unit"])
+        self.unit_names = None
+        if self.unit_rules is not None:
+            self.unit_names = tuple(
+                frozenset(self.get_rule_names(rule, set(), set()))
+                for rule, single_rule in self.unit_rules
+            )
+        # Regions added by recover rules are error regions
+        error_names = set()
+        for rule in self.recover_rules:
+            visited = set()
+            while rule is not None and rule.name is None and rule.kind == RULE_INCLUDE and id(rule) not in visited:
+                visited.add(id(rule))
+                rule = rule.target
+            if rule is not None and rule.name is not None:
+                error_names.add(rule.name)
+        self.error_names = frozenset(error_names)
+        self.tokenizer = None
+        if "tokenizer" in grammar and self.separator is not None and not self.has_named_rule(self.separator, set()):
+            self.tokenizer = Tokenizer(
+                grammar["tokenizer"]["separator"],
+                grammar["tokenizer"].get("tokens", "[\\s\\S]")
+            )
+        self.compile_lookahead()
+
+    # Returns a hash of the grammar, parse results are only valid for the
+    #   same grammar
+    def get_signature(self):
+        if self.signature is None:
+            self.signature = hashlib.sha1(
+                json.dumps(self.grammar, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+        return self.signature
+
+    # Returns names of all regions the rule may add (regions of excluding
+    #   rules are always removed)
+    def get_rule_names(self, rule, names, visited):
+        if rule is None or id(rule) in visited:
+            return names
+        visited.add(id(rule))
+        if rule.name is not None:
+            names.add(rule.name)
+        for child in (rule.target, rule.recover) + rule.rules:
+            self.get_rule_names(child, names, visited)
+        return names
+
+    # Returns True if the rule (or any rule it may parse) adds a region
+    def has_named_rule(self, rule, visited):
+        if rule is None or id(rule) in visited:
+            return False
+        visited.add(id(rule))
+        if rule.name is not None:
+            return True
+        for child in (rule.exclude, rule.target, rule.recover) + rule.rules:
+            if self.has_named_rule(child, visited):
+                return True
+        return False
+
+    # Compilation unit is parsed step by step (one step per child rule or per
+    #   occurrence of a multiple child rule), returns a tuple of
+    #   (rule, single occurrence rule or None) for each child rule or None
+    #   if the compilation unit cannot be parsed that way
+    def compile_unit_rules(self, rule):
+        compilation_unit = self.compilation_unit
+        if compilation_unit.kind != RULE_PARSE or compilation_unit.exclude is not None or compilation_unit.optional or compilation_unit.multiple:
+            return None
+        unit_rules = []
+        for index, child in enumerate(rule["parse"]):
+            child_rule = compilation_unit.rules[index]
+            single_rule = None
+            # Failed match keeps its separator regions, so it is not a step
+            if child_rule.multiple and child_rule.name is None and child_rule.exclude is None and child_rule.kind in (RULE_PARSE, RULE_PARSE_ANY, RULE_INCLUDE):
+                single_rule = dict(child)
+                single_rule.pop("multiple", None)
+                single_rule.pop("optional", None)
+                single_rule.pop("recover", None)
+                single_rule = self.compile_rule(single_rule)
+            unit_rules.append((child_rule, single_rule))
+        return tuple(unit_rules)
+
+    # Leading characters of each rule are computed until nothing is changed
+    #   (since rules can include each other), then alternatives which can
+    #   start with each character are stored in their parse_any rules
+    def compile_lookahead(self):
+        for rule in self.rules:
+            rule.first = (0, False)
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                first = self.get_rule_first(rule)
+                if first != rule.first:
+                    rule.first = first
+                    changed = True
+        alternatives = {}
+        for rule in self.rules:
+            rule.lookahead = None
+            if rule.kind != RULE_PARSE_ANY:
+                continue
+            lookahead = []
+            for index in range(FIRST_END+1):
+                candidates = tuple(
+                    child for child in rule.rules
+                    if child.first[1] or (index < FIRST_END and child.first[0] >> index & 1)
+                )
+                lookahead.append(alternatives.setdefault(candidates, candidates))
+            if any(len(candidates) < len(rule.rules) for candidates in lookahead):
+                rule.lookahead = tuple(lookahead)
+
+    # Returns a tuple of (leading characters, can be matched without any
+    #   character) of the rule, excluding rules are ignored since they can
+    #   only make the rule fail
+    def get_rule_first(self, rule):
+        mask = 0
+        nullable = rule.optional or rule.multiple
+        kind = rule.kind
+        if kind == RULE_MATCH:
+            if not rule.before_separator:
+                # Separator is not skipped, so any character can be read
+                return (FIRST_ALL, True)
+            pattern_mask, pattern_nullable = self.compile_first(rule.pattern)
+            mask = pattern_mask
+            nullable = nullable or pattern_nullable
+        elif kind == RULE_PARSE:
+            sequence_nullable = True
+            for child in rule.rules:
+                mask |= child.first[0]
+                if not child.first[1]:
+                    sequence_nullable = False
+                    break
+            nullable = nullable or sequence_nullable
+        elif kind == RULE_PARSE_ANY:
+            for child in rule.rules:
+                mask |= child.first[0]
+                nullable = nullable or child.first[1]
+        elif kind == RULE_INCLUDE and rule.target is not None:
+            mask = rule.target.first[0]
+            nullable = nullable or rule.target.first[1]
+        if rule.recover is not None:
+            mask |= rule.recover.first[0]
+            nullable = nullable or rule.recover.first[1]
+        return (mask, nullable)
+
+    def compile_first(self, pattern):
+        if pattern not in self.firsts:
+            self.firsts[pattern] = pattern_first(self.compile_pattern(pattern)[0])
+        return self.firsts[pattern]
+
+    # Returns a list of alternatives which have to be tried at any position
+    #   (can start with any character or can be matched without any
+    #   character) in the grammar
+    def get_unpredictable_rules(self):
+        unpredictable_rules = []
+        rules = [("separator", self.separator), ("compilation_unit", self.compilation_unit)]
+        for rule_name in sorted(self.repository):
+            rules.append((rule_name, self.repository[rule_name]))
+        visited = set()
+        while rules:
+            rule_name, rule = rules.pop(0)
+            if rule is None or id(rule) in visited:
+                continue
+            visited.add(id(rule))
+            children = list(rule.rules)
+            if rule.exclude is not None:
+                children.append(rule.exclude)
+            rules[0:0] = [(rule_name, child) for child in children]
+            if rule.kind != RULE_PARSE_ANY:
+                continue
+            for index, child in enumerate(rule.rules):
+                if child.first[1] or child.first[0] == FIRST_ALL:
+                    unpredictable_rules.append("%s [%s/%s] %s" % (
+                        rule_name, index+1, len(rule.rules),
+                        self.describe_rule(child)
+                    ))
+        return unpredictable_rules
+
+    def describe_rule(self, rule):
+        if rule.name is not None:
+            return "name: " + rule.name
+        if rule.kind == RULE_MATCH:
+            return "match: " + rule.pattern
+        if rule.kind == RULE_INCLUDE:
+            return "include: " + rule.include
+        if rule.kind == RULE_PARSE:
+            return "parse: %s rules" % (len(rule.rules))
+        if rule.kind == RULE_PARSE_ANY:
+            return "parse_any: %s rules" % (len(rule.rules))
+        return "empty"
+
+    def compile_pattern(self, pattern):
+        if pattern not in self.patterns:
+            regex = re.compile(pattern)
+            context = pattern_context(pattern)
+            if context == CONTEXT_WORD_BOUNDARY and regex.flags & re.ASCII:
+                context = CONTEXT_ANY
+            self.patterns[pattern] = (regex, context)
+        return self.patterns[pattern]
+
+    def compile_rule(self, rule, compiled_rule=None):
+        compiled_rule = compiled_rule or GrammarRule()
+        self.rules.append(compiled_rule)
+        compiled_rule.kind = RULE_EMPTY
+        compiled_rule.name = rule.get("name")
+        compiled_rule.exclude = None
+        if "exclude" in rule:
+            compiled_rule.exclude = self.compile_rule(rule["exclude"])
+        compiled_rule.optional = bool(rule.get("optional", False))
+        compiled_rule.multiple = bool(rule.get("multiple", False))
+        compiled_rule.recover = None
+        if "recover" in rule:
+            compiled_rule.recover = self.compile_rule(rule["recover"])
+            self.recover_rules.append(compiled_rule.recover)
+        compiled_rule.before_separator = bool(rule.get("before_separator", True))
+        compiled_rule.after_separator = bool(rule.get("after_separator", True))
+        compiled_rule.pattern = None
+        compiled_rule.regex = None
+        compiled_rule.context = CONTEXT_NONE
+        compiled_rule.rules = ()
+        compiled_rule.include = None
+        compiled_rule.target = None
+        if "match" in rule:
+            compiled_rule.kind = RULE_MATCH
+            compiled_rule.pattern = rule["match"]
+            compiled_rule.regex, compiled_rule.context = self.compile_pattern(rule["match"])
+        elif "parse" in rule:
+            compiled_rule.kind = RULE_PARSE
+            compiled_rule.rules = tuple(self.compile_rule(child) for child in rule["parse"])
+        elif "parse_any" in rule:
+            compiled_rule.kind = RULE_PARSE_ANY
+            compiled_rule.rules = tuple(self.compile_rule(child) for child in rule["parse_any"])
+        elif "include" in rule:
+            compiled_rule.kind = RULE_INCLUDE
+            compiled_rule.include = rule["include"]
+            compiled_rule.target = self.repository.get(rule["include"])
+        # Include without any option is the same as its target
+        compiled_rule.direct = (
+            compiled_rule.kind == RULE_INCLUDE and
+            compiled_rule.target is not None and
+            compiled_rule.name is None and
+            compiled_rule.exclude is None and
+            compiled_rule.recover is None and
+            not compiled_rule.optional and
+            not compiled_rule.multiple
+        )
+        return compiled_rule
+
+
+class TokenStream():
+    # Tokens (without separator) in their original positions, separator
+    #   can be skipped by looking up from where tokenizer has been started
+    #   each token or separator
+    def __init__(self, data):
+        self.begins = array("l")
+        self.ends = array("l")
+        self.kinds = bytearray(len(data)+1)
+        self.kinds[len(data)] = KIND_TOKEN
+        self.separator_ends = {}
+
+    # Returns a list of (begin, end) of each token
+    def get_tokens(self):
+        return list(zip(self.begins, self.ends))
+
+    # Returns a list of end positions of top-level blocks (enclosed by the
+    #   open and close tokens) after the position
+    def get_block_ends(self, data, begin, open_token="{", close_token="}"):
+        block_ends = []
+        begins = self.begins
+        ends = self.ends
+        depth = 0
+        for index in range(bisect_left(begins, begin), len(begins)):
+            token_begin = begins[index]
+            token_end = ends[index]
+            if token_end-token_begin != 1:
+                continue
+            token = data[token_begin]
+            if token == open_token:
+                depth += 1
+            elif token == close_token and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    block_ends.append(token_end)
+        return block_ends
+
+    def __len__(self):
+        return len(self.begins)
+
+
+class Tokenizer():
+    # Tokenize the data once with a combined pattern of the separator and
+    #   tokens, separator pattern is tried first so the separator rule will
+    #   not match at any token beginning
+    def __init__(self, separator, tokens):
+        self.pattern = re.compile("(" + separator + ")|(?:" + tokens + ")")
+
+    def tokenize(self, data):
+        tokens = TokenStream(data)
+        pattern = self.pattern
+        kinds = tokens.kinds
+        begins = tokens.begins
+        ends = tokens.ends
+        separator_ends = tokens.separator_ends
+        position = 0
+        size = len(data)
+        while position < size:
+            matches = pattern.match(data, position)
+            if matches is None:
+                end = position+1
+                kinds[position] = KIND_TOKEN
+            elif matches.end() == position:
+                # Empty match is not a token (separator will be parsed)
+                end = position+1
+            else:
+                end = matches.end()
+                if matches.start(1) >= 0:
+                    kinds[position] = KIND_SEPARATOR
+                    separator_ends[position] = end
+                    position = end
+                    continue
+                kinds[position] = KIND_TOKEN
+            begins.append(position)
+            ends.append(end)
+            position = end
+        return tokens
+
+
+class Region(Mapping):
+    # A dict-like view of a region in the region store, the value is only
+    #   sliced from the data when it is needed
+    __slots__ = ("store", "index")
+
+    KEYS = ("begin", "end", "value", "parent", "name")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        store = self.store
+        if key == "begin":
+            return store.begins[self.index]
+        elif key == "end":
+            return store.ends[self.index]
+        elif key == "value":
+            return store.data[store.begins[self.index]:store.ends[self.index]]
+        elif key == "parent":
+            return store.paths[store.parent_ids[self.index]]
+        elif key == "name":
+            return store.names[store.name_ids[self.index]]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(Region.KEYS)
+
+    def __len__(self):
+        return len(Region.KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    # Returns the region which this region is its child (or None)
+    def get_parent(self):
+        parent = self.store.get_tree().parents[self.index]
+        if parent < 0:
+            return None
+        return Region(self.store, parent)
+
+    def get_children(self):
+        return RegionList(self.store, self.store.get_tree().get_children(self.index))
+
+    # Returns all regions under this region
+    def get_descendants(self):
+        return RegionList(self.store, self.store.get_tree().get_descendants(self.index))
+
+
+class RegionStore(Sequence):
+    # Regions are stored in columns of begin, end, name id and parent id
+    #   Rule names and parent paths are interned and can be shared with
+    #   another store (so their ids are the same)
+    def __init__(self, data="", store=None):
+        self.data = data
+        self.begins = array("l")
+        self.ends = array("l")
+        self.name_ids = array("l")
+        self.parent_ids = array("l")
+        if store is None:
+            self.names = []
+            self.name_index = {}
+            # Path 0 is an empty path (no parent)
+            self.paths = [""]
+            self.path_names = [-1]
+            self.path_parents = [-1]
+            self.path_index = {}
+            self.rebase_index = {}
+            # Selector key => (number of checked paths, matched path ids)
+            self.selector_paths = {}
+        else:
+            self.names = store.names
+            self.name_index = store.name_index
+            self.paths = store.paths
+            self.path_names = store.path_names
+            self.path_parents = store.path_parents
+            self.path_index = store.path_index
+            self.rebase_index = store.rebase_index
+            self.selector_paths = store.selector_paths
+        self.index = None
+        self.tree = None
+
+    def get_name_id(self, name):
+        name_id = self.name_index.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_index[name] = name_id
+        return name_id
+
+    # Returns an id of the parent path with the name appended
+    def get_path_id(self, parent_id, name):
+        key = (parent_id, name)
+        path_id = self.path_index.get(key)
+        if path_id is None:
+            path_id = len(self.paths)
+            if parent_id == 0:
+                self.paths.append(name)
+            else:
+                self.paths.append(self.paths[parent_id] + ">" + name)
+            self.path_names.append(self.get_name_id(name))
+            self.path_parents.append(parent_id)
+            self.path_index[key] = path_id
+        return path_id
+
+    # Returns an id of the path with its old parent replaced by new parent
+    def rebase_path_id(self, path_id, old_parent_id, new_parent_id):
+        if path_id == old_parent_id:
+            return new_parent_id
+        key = (path_id, old_parent_id, new_parent_id)
+        rebased_id = self.rebase_index.get(key)
+        if rebased_id is None:
+            rebased_id = self.get_path_id(
+                self.rebase_path_id(self.path_parents[path_id], old_parent_id, new_parent_id),
+                self.names[self.path_names[path_id]]
+            )
+            self.rebase_index[key] = rebased_id
+        return rebased_id
+
+    # Add a region with the parent path id (which is included its name)
+    #   and returns its index
+    def add(self, begin, end, parent_id):
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.name_ids.append(self.path_names[parent_id])
+        self.parent_ids.append(parent_id)
+        return len(self.begins)-1
+
+    def update(self, index, begin, end):
+        self.begins[index] = begin
+        self.ends[index] = end
+
+    def truncate(self, size):
+        if len(self.begins) > size:
+            del self.begins[size:]
+            del self.ends[size:]
+            del self.name_ids[size:]
+            del self.parent_ids[size:]
+            # Index and tree might have the same size after new regions
+            #   are added
+            self.index = None
+            self.tree = None
+
+    def get_rows(self, begin, end=None):
+        if end is None:
+            end = len(self.begins)
+        return (self.begins[begin:end], self.ends[begin:end], self.name_ids[begin:end], self.parent_ids[begin:end])
+
+    # Add rows from get_rows, optionally with parent path replaced
+    def add_rows(self, rows, old_parent_id=None, new_parent_id=None):
+        self.begins.extend(rows[0])
+        self.ends.extend(rows[1])
+        self.name_ids.extend(rows[2])
+        if old_parent_id == new_parent_id:
+            self.parent_ids.extend(rows[3])
+        else:
+            for parent_id in rows[3]:
+                self.parent_ids.append(self.rebase_path_id(parent_id, old_parent_id, new_parent_id))
+
+    # Add regions from another store (which shared the same names and paths)
+    #   with positions shifted by delta
+    def add_regions(self, store, begin, end, delta=0):
+        begins, ends, name_ids, parent_ids = store.get_rows(begin, end)
+        if delta != 0:
+            begins = array("l", [position+delta for position in begins])
+            ends = array("l", [position+delta for position in ends])
+        self.add_rows((begins, ends, name_ids, parent_ids))
+
+    # Returns regions as bytes, paths are stored by their names since path
+    #   ids are only valid in the stores which shared the same paths
+    def dump(self):
+        path_ids = {0: 0}
+        dump_paths = array("l")
+        dump_names = []
+        name_ids = {}
+        for parent_id in sorted(set(self.parent_ids)):
+            # Ancestors of the path are stored before the path
+            chain = []
+            while parent_id not in path_ids:
+                chain.append(parent_id)
+                parent_id = self.path_parents[parent_id]
+            for path_id in reversed(chain):
+                name = self.names[self.path_names[path_id]]
+                if name not in name_ids:
+                    name_ids[name] = len(dump_names)
+                    dump_names.append(name)
+                dump_paths.append(path_ids[self.path_parents[path_id]])
+                dump_paths.append(name_ids[name])
+                path_ids[path_id] = len(path_ids)
+        parent_ids = array("l", [path_ids[parent_id] for parent_id in self.parent_ids])
+        names = "\0".join(dump_names).encode("utf-8")
+        return (
+            struct.pack("<I", len(names)) + names + dump_paths.tobytes() +
+            self.begins.tobytes() + self.ends.tobytes() + parent_ids.tobytes()
+        ), len(dump_names), len(path_ids)-1
+
+    # Add regions from dump with positions shifted by delta, returns False
+    #   if the dump is invalid
+    def load(self, dumped, offset, name_count, path_count, region_count, delta=0):
+        item_size = self.begins.itemsize
+        names_size = struct.unpack_from("<I", dumped, offset)[0]
+        offset += 4
+        names = []
+        if name_count > 0:
+            names = dumped[offset:offset+names_size].decode("utf-8").split("\0")
+        offset += names_size
+        columns_size = item_size * (path_count*2 + region_count*3)
+        if len(names) != name_count or len(dumped) != offset + columns_size:
+            return False
+        dump_paths = array("l")
+        dump_paths.frombytes(dumped[offset:offset+item_size*path_count*2])
+        offset += item_size*path_count*2
+        path_ids = [0]
+        for index in range(path_count):
+            parent_id = dump_paths[index*2]
+            name_id = dump_paths[index*2+1]
+            if parent_id > index or name_id >= name_count:
+                return False
+            path_ids.append(self.get_path_id(path_ids[parent_id], names[name_id]))
+        columns = []
+        for column in range(3):
+            values = array("l")
+            values.frombytes(dumped[offset:offset+item_size*region_count])
+            offset += item_size*region_count
+            columns.append(values)
+        try:
+            parent_ids = array("l", [path_ids[parent_id] for parent_id in columns[2]])
+        except IndexError:
+            return False
+        if delta != 0:
+            columns[0] = array("l", [position+delta for position in columns[0]])
+            columns[1] = array("l", [position+delta for position in columns[1]])
+        path_names = self.path_names
+        self.begins.extend(columns[0])
+        self.ends.extend(columns[1])
+        self.name_ids.extend([path_names[parent_id] for parent_id in parent_ids])
+        self.parent_ids.extend(parent_ids)
+        return True
+
+    # Returns ids of all paths which regions on them are selected by the
+    #   selector, new paths are checked only once
+    def get_selector_paths(self, selector):
+        checked_count, path_ids = self.selector_paths.get(selector.key, (1, frozenset()))
+        if checked_count < len(self.paths):
+            path_ids = set(path_ids)
+            for path_id in range(checked_count, len(self.paths)):
+                if selector.match(self.names[self.path_names[path_id]], self.paths[path_id]):
+                    path_ids.add(path_id)
+            path_ids = frozenset(path_ids)
+            self.selector_paths[selector.key] = (len(self.paths), path_ids)
+        return path_ids
+
+    # Regions must not be modified after the index is built
+    def get_index(self):
+        if self.index is None or self.index.size != len(self.begins):
+            self.index = RegionIndex(self)
+        return self.index
+
+    # Regions must not be modified after the tree is built
+    def get_tree(self):
+        if self.tree is None or self.tree.size != len(self.begins):
+            self.tree = RegionTree(self)
+        return self.tree
+
+    # Returns regions which have no parent region
+    def get_roots(self):
+        return RegionList(self, self.get_tree().roots)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Region(self, region_index) for region_index in range(*index.indices(len(self.begins)))]
+        if index < 0:
+            index += len(self.begins)
+        if index < 0 or index >= len(self.begins):
+            raise IndexError("region index out of range")
+        return Region(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.begins)):
+            yield Region(self, index)
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __eq__(self, other):
+        if not isinstance(other, (RegionStore, list)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+class Selector():
+    # A selector is parsed only once and shared by all queries
+    __slots__ = (
+        "key", "selector", "find_name", "find_any", "find_child",
+        "filter_any", "filter_selector", "filter_value"
+    )
+
+    FILTER_PATTERN = re.compile("(\\[(?P<FilterAny>>)?(?P<Filter>[\\w-]+)=(?P<Value>[^\\]]*)\\])")
+    CACHE_LIMIT = 1000
+    cache = {}
+
+    @classmethod
+    def get(cls, selector):
+        compiled_selector = cls.cache.get(selector)
+        if compiled_selector is None:
+            if len(cls.cache) >= cls.CACHE_LIMIT:
+                cls.cache.clear()
+            compiled_selector = cls(selector)
+            cls.cache[selector] = compiled_selector
+        return compiled_selector
+
+    def __init__(self, selector):
+        self.filter_any = False
+        self.filter_selector = None
+        self.filter_value = None
+        filter_match = Selector.FILTER_PATTERN.search(selector)
+        if filter_match:
+            selector = selector[:-len(filter_match.group(0))]
+            self.filter_any = bool(filter_match.group("FilterAny"))
+            self.filter_selector = filter_match.group("Filter")
+            self.filter_value = filter_match.group("Value")
+        self.find_name = selector.startswith("@")
+        if self.find_name:
+            selector = selector[1:]
+        self.find_any = selector.startswith(">")
+        if self.find_any:
+            selector = selector[1:]
+        self.find_child = selector.endswith(">")
+        if self.find_child:
+            selector = selector[:-1]
+        self.selector = selector
+        # Selectors with the same key select the same paths
+        self.key = (self.find_name, self.find_any, selector)
+
+    # Returns True if the selector may select a region which it and its
+    #   ancestors are named with the names
+    def may_match(self, names):
+        parts = self.selector.split(">")
+        if self.find_name:
+            if self.find_any:
+                return any(name.endswith(self.selector) for name in names)
+            return any(name.startswith(self.selector) for name in names)
+        if self.find_any:
+            if len(parts) == 1:
+                return any(name.endswith(parts[0]) for name in names)
+            return (
+                all(part in names for part in parts[1:]) and
+                any(name.endswith(parts[0]) for name in names)
+            )
+        # Descendants of the selected path are also selected
+        return (
+            all(part in names for part in parts[:-1]) and
+            any(name.startswith(parts[-1]) for name in names)
+        )
+
+    def match(self, name, parent):
+        if self.selector + ">" in parent:
+            return False
+        if self.find_name:
+            text = name
+        else:
+            text = parent
+        if self.find_any:
+            return text.endswith(self.selector)
+        return text.startswith(self.selector)
+
+
+class RegionIndex():
+    # Regions grouped by parent path and ordered by begin position
+    def __init__(self, store):
+        self.store = store
+        self.size = len(store.begins)
+        path_regions = {}
+        for index, parent_id in enumerate(store.parent_ids):
+            if parent_id in path_regions:
+                path_regions[parent_id].append(index)
+            else:
+                path_regions[parent_id] = [index]
+        self.path_regions = path_regions
+        begins = store.begins
+        self.begin_order = sorted(range(self.size), key=begins.__getitem__)
+        self.sorted_begins = [begins[index] for index in self.begin_order]
+
+    # Returns regions inside the range (ordered by index)
+    def inside(self, begin, end):
+        ends = self.store.ends
+        indices = [
+            index for index in self.begin_order[
+                bisect_left(self.sorted_begins, begin):
+                bisect_right(self.sorted_begins, end)
+            ] if ends[index] <= end
+        ]
+        indices.sort()
+        return indices
+
+    # Returns regions cover the range (ordered by index)
+    def covering(self, begin, end):
+        ends = self.store.ends
+        indices = [
+            index for index in self.begin_order[
+                :bisect_right(self.sorted_begins, begin)
+            ] if ends[index] >= end
+        ]
+        indices.sort()
+        return indices
+
+    # Returns regions with specified parent paths (ordered by index)
+    def with_paths(self, path_ids):
+        indices = []
+        for path_id in path_ids:
+            if path_id in self.path_regions:
+                indices += self.path_regions[path_id]
+        indices.sort()
+        return indices
+
+
+class RegionTree():
+    # Parent and children of each region, the parent is the last region on
+    #   the parent path which contains the region (regions on the same path
+    #   never contain each other)
+    def __init__(self, store):
+        self.store = store
+        self.size = len(store.begins)
+        begins = store.begins
+        ends = store.ends
+        path_parents = store.path_parents
+        parents = array("l", [-1]) * self.size
+        child_counts = array("l", [0]) * (self.size + 1)
+        last_regions = {}
+        for index, path_id in enumerate(store.parent_ids):
+            parent = last_regions.get(path_parents[path_id], -1)
+            if parent >= 0 and begins[parent] <= begins[index] and ends[parent] >= ends[index]:
+                parents[index] = parent
+                child_counts[parent] += 1
+            last_regions[path_id] = index
+        # Children are kept in one array, ordered by their parent
+        self.child_offsets = array("l", [0]) * (self.size + 1)
+        offset = 0
+        for index in range(self.size):
+            self.child_offsets[index] = offset
+            offset += child_counts[index]
+        self.child_offsets[self.size] = offset
+        self.child_indices = array("l", [0]) * offset
+        self.roots = []
+        for index, parent in enumerate(parents):
+            if parent < 0:
+                self.roots.append(index)
+            else:
+                self.child_indices[self.child_offsets[parent]] = index
+                self.child_offsets[parent] += 1
+        for index in range(self.size - 1, 0, -1):
+            self.child_offsets[index] = self.child_offsets[index - 1]
+        if self.size > 0:
+            self.child_offsets[0] = 0
+        self.parents = parents
+        # Regions are usually added before their descendants, so the
+        #   descendants are the regions up to the end of its subtree
+        self.subtree_ends = array("l", range(1, self.size + 1))
+        self.subtree_sizes = array("l", [0]) * self.size
+        for index in range(self.size - 1, -1, -1):
+            parent = parents[index]
+            if parent >= 0:
+                self.subtree_ends[parent] = max(self.subtree_ends[parent], self.subtree_ends[index])
+                self.subtree_sizes[parent] += self.subtree_sizes[index] + 1
+
+    def get_children(self, index):
+        return self.child_indices[self.child_offsets[index]:self.child_offsets[index + 1]]
+
+    # Returns all regions under the region (ordered by index)
+    def get_descendants(self, index):
+        if self.subtree_ends[index] - index - 1 == self.subtree_sizes[index]:
+            return range(index + 1, self.subtree_ends[index])
+        indices = []
+        pending = [index]
+        while pending:
+            children = self.get_children(pending.pop())
+            indices += children
+            pending += children
+        indices.sort()
+        return indices
+
+
+class RegionQuery():
+    # Query on all regions in the store or on a list of regions in the store
+    def __init__(self, store, indices=None):
+        self.store = store
+        self.index = None
+        self.indices = indices
+        self.members = None
+        if indices is None:
+            self.index = store.get_index()
+        else:
+            # Regions in index order can use the store index
+            ordered = True
+            for position in range(1, len(indices)):
+                if indices[position-1] >= indices[position]:
+                    ordered = False
+                    break
+            if ordered:
+                self.index = store.get_index()
+                self.members = set(indices)
+
+    # Returns a query for the regions or None if regions are not from a store
+    @staticmethod
+    def get(search_regions):
+        if isinstance(search_regions, RegionStore):
+            return RegionQuery(search_regions)
+        if isinstance(search_regions, RegionList):
+            query = search_regions.get_query()
+            if query is not None:
+                return query
+        store = None
+        indices = []
+        for region in search_regions:
+            if not isinstance(region, Region) or (store is not None and region.store is not store):
+                return None
+            store = region.store
+            indices.append(region.index)
+        if store is None:
+            return None
+        return RegionQuery(store, indices)
+
+    def filter_indices(self, indices):
+        if self.indices is None:
+            return indices
+        return [index for index in indices if index in self.members]
+
+    def inside(self, begin, end):
+        if self.indices is not None and self.members is None:
+            begins = self.store.begins
+            ends = self.store.ends
+            return [index for index in self.indices if begins[index] >= begin and ends[index] <= end]
+        return self.filter_indices(self.index.inside(begin, end))
+
+    def covering(self, begin, end):
+        if self.indices is not None and self.members is None:
+            begins = self.store.begins
+            ends = self.store.ends
+            return [index for index in self.indices if begins[index] <= begin and ends[index] >= end]
+        return self.filter_indices(self.index.covering(begin, end))
+
+    def with_paths(self, path_ids):
+        if self.indices is None:
+            return self.index.with_paths(path_ids)
+        parent_ids = self.store.parent_ids
+        return [index for index in self.indices if parent_ids[index] in path_ids]
+
+    def select(self, selector):
+        store = self.store
+        indices = []
+        for index in self.with_paths(store.get_selector_paths(selector)):
+            if selector.filter_selector and not self.has_filter_value(index, selector):
+                continue
+            if selector.find_child:
+                indices += self.inside(store.begins[index], store.ends[index])
+            else:
+                indices.append(index)
+        return RegionList(store, indices)
+
+    # Same as GrammarParser.filter_region
+    def has_filter_value(self, index, selector):
+        store = self.store
+        if selector.filter_any:
+            filter_selector = Selector.get(">" + selector.filter_selector)
+        else:
+            filter_selector = Selector.get(store.paths[store.parent_ids[index]] + ">" + selector.filter_selector)
+        path_ids = store.get_selector_paths(filter_selector)
+        value = selector.filter_value
+        for node in self.inside(store.begins[index], store.ends[index]):
+            if store.parent_ids[node] in path_ids and store.ends[node]-store.begins[node] == len(value) and store.data.startswith(value, store.begins[node]):
+                return True
+        return False
+
+
+class RegionList(list):
+    # A list of regions from a store, the query on its regions is only
+    #   created when it is searched again
+    def __init__(self, store, indices):
+        self.store = store
+        self.indices = list(indices)
+        list.__init__(self, [Region(store, index) for index in self.indices])
+        self.query = None
+
+    # Concatenates lists and keeps the result searchable by its query
+    @staticmethod
+    def join(region_lists):
+        store = None
+        indices = []
+        for region_list in region_lists:
+            if not isinstance(region_list, RegionList) or not region_list.is_unchanged() or (store is not None and region_list.store is not store):
+                return [region for region_list in region_lists for region in region_list]
+            store = region_list.store
+            indices += region_list.indices
+        if store is None:
+            return []
+        return RegionList(store, indices)
+
+    def is_unchanged(self):
+        if len(self) != len(self.indices):
+            return False
+        return not self or (getattr(self[0], "index", None) == self.indices[0] and getattr(self[-1], "index", None) == self.indices[-1])
+
+    # Returns None if the list has been modified
+    def get_query(self):
+        if not self.is_unchanged():
+            return None
+        if self.query is None:
+            self.query = RegionQuery(self.store, self.indices)
+        return self.query
+
+
+class GrammarParser():
+    def __init__(self, grammar, printer=None, packrat=False,
+                 packrat_limit=500000, tokenize=True, profile=False,
+                 optimize=False, recover=False):
+        if isinstance(grammar, CompiledGrammar):
+            self.compiled_grammar = grammar
+        else:
+            self.compiled_grammar = CompiledGrammar(grammar, optimize)
+        self.grammar = self.compiled_grammar.grammar
         self.printer = None
         if printer is not None:
             self.printer = printer
-        self.re_cache = {}
-        self.regions = []
+        self.regions = RegionStore()
         self.data = None
+        self.unit_steps = None
+        self.unit_begin = 0
+        self.unit_mark = 0
+        self.unit_region = None
+        self.unit_first = None
+        self.prefix = False
         self.unused_rules = []
         self.unexists_rules = []
+        # Packrat memoization of repository rules (rule, offset) => output
+        #   packrat_limit is a maximum number of cached entries and regions
+        self.packrat = packrat
+        self.packrat_limit = packrat_limit
+        self.reset_packrat()
+        # Separator is skipped by using tokens if grammar has a tokenizer
+        self.tokenize = tokenize
+        self.tokens = None
+        # Per rule statistics of included rules (not used with printer)
+        self.profile = profile
+        self.reset_profile()
+        # Data which cannot be parsed is skipped by recover rules
+        self.recover = recover
+
+    def reset_packrat(self):
+        self.packrat_cache = {}
+        self.packrat_size = 0
+        self.packrat_hits = 0
+        self.packrat_misses = 0
+
+    def reset_profile(self):
+        # Rule name => [attempts, successes, backtracks, consumed bytes,
+        #   time, self time]
+        self.profile_stats = {}
+        self.profile_starts = []
+        self.profile_depths = {}
+        self.profile_data = None
+        self.profile_offsets = None
+
+    # Returns UTF-8 byte offsets of each character in the data or None if
+    #   every character is a single byte
+    def get_profile_offsets(self):
+        if self.profile_data is not self.data:
+            self.profile_data = self.data
+            self.profile_offsets = None
+            if len(self.data.encode("utf-8", "surrogatepass")) != len(self.data):
+                offsets = array("L", [0])
+                total = 0
+                for char in self.data:
+                    code = ord(char)
+                    if code < 0x80:
+                        total += 1
+                    elif code < 0x800:
+                        total += 2
+                    elif code < 0x10000:
+                        total += 3
+                    else:
+                        total += 4
+                    offsets.append(total)
+                self.profile_offsets = offsets
+        return self.profile_offsets
+
+    # Starts the profiling of an included rule call
+    def enter_profile(self, rule_name):
+        # Starting time and time of included rule calls
+        self.profile_starts.append([clock(), 0.0])
+        self.profile_depths[rule_name] = self.profile_depths.get(rule_name, 0) + 1
+
+    # Ends the profiling of an included rule call, time of recursive calls
+    #   is only counted once (in the outermost call)
+    def exit_profile(self, rule_name, begin, output):
+        start_time, child_time = self.profile_starts.pop()
+        elapse_time = clock() - start_time
+        if self.profile_starts:
+            self.profile_starts[-1][1] += elapse_time
+        depth = self.profile_depths[rule_name] - 1
+        self.profile_depths[rule_name] = depth
+        if rule_name not in self.profile_stats:
+            self.profile_stats[rule_name] = [0, 0, 0, 0, 0.0, 0.0]
+        stats = self.profile_stats[rule_name]
+        stats[0] += 1
+        if output is None:
+            stats[2] += 1
+        else:
+            stats[1] += 1
+            offsets = self.get_profile_offsets()
+            if offsets is None:
+                stats[3] += output[1] - begin
+            else:
+                stats[3] += offsets[output[1]] - offsets[begin]
+        if depth == 0:
+            stats[4] += elapse_time
+        stats[5] += elapse_time - child_time
 
     def contain_rule(self, rule_name):
         return "repository" in self.grammar and rule_name in self.grammar["repository"]
@@ -76,219 +1633,1000 @@ class GrammarParser():
             self.validate_rule(self.grammar["compilation_unit"])
         self.unexists_rules.sort()
         self.unused_rules.sort()
-        return {"unused_rules": self.unused_rules, "unexists_rules": self.unexists_rules}
+        return {
+            "unused_rules": self.unused_rules,
+            "unexists_rules": self.unexists_rules,
+            "unpredictable_rules": self.compiled_grammar.get_unpredictable_rules()
+        }
 
-    def parse_grammar(self, data):
-        if self.data is None or self.data != data:
+    # Parse the data, if targets (selectors) are specified, parsing will be
+    #   stopped once no more region can be selected by them
+    def parse_grammar(self, data, targets=None):
+        if self.data is None or self.data != data or self.prefix or targets is not None:
             self.data = data
-            self.regions = []
+            self.regions = RegionStore(data, self.regions)
         else:
             if self.printer is not None:
                 self.printer(0, "Already parse")
             return True
+        self.reset_packrat()
         starttime = clock()
-        if "compilation_unit" in self.grammar:
-            if self.printer is not None:
-                self.printer(0, "== Compilation unit ==")
-            begin = 0
-            # Pre separator (for beginning correction)
-            if ("before_separator" not in self.grammar["compilation_unit"] or self.grammar["compilation_unit"]["before_separator"]):
-                separator_output = self.parse_rule(self.grammar["separator"], True, "", 0, 0)
-                if separator_output["successive_match"]:
-                    begin = separator_output["end"]
-                    self.regions += separator_output["regions"]
-            parse_output = self.parse_rule(self.grammar["compilation_unit"], False, "", 0, begin)
-            if parse_output["successive_match"]:
-                self.regions += parse_output["regions"]
-            # Post separator (for ending correction)
-            if ("after_separator" not in self.grammar["compilation_unit"] or self.grammar["compilation_unit"]["after_separator"]):
-                separator_output = self.parse_rule(self.grammar["separator"], True, "", 0, parse_output["end"])
-                if separator_output["successive_match"]:
-                    parse_output["end"] = separator_output["end"]
-                    self.regions += separator_output["regions"]
+        self.tokens = self.tokenize_data(data)
+        stop = None
+        if targets is not None:
+            stop = self.get_unit_stop(targets)
+        parse_output = self.parse_document(None, 0, [], None, stop)
         self.elapse_time = clock()-starttime
-        return {"success": parse_output["successive_match"], "begin": parse_output["begin"], "end": parse_output["end"]}
+        return parse_output
 
-    def parse_rule_list(self, rules, is_separator, parent, level, begin):
-        regions = []
-        if self.printer is not None and not is_separator:
+    # Returns a number of compilation unit child rules to parse for regions
+    #   selected by the targets or None if all of them have to be parsed
+    def get_unit_stop(self, targets):
+        unit_names = self.compiled_grammar.unit_names
+        if unit_names is None or self.printer is not None:
+            return None
+        if isinstance(targets, str):
+            targets = targets.split("|")
+        selectors = [Selector.get(target) for target in targets]
+        compilation_unit = self.compiled_grammar.compilation_unit
+        stop = 0
+        for index, names in enumerate(unit_names):
+            if compilation_unit.name is not None:
+                names = names | frozenset([compilation_unit.name])
+            for selector in selectors:
+                if selector.may_match(names):
+                    stop = index+1
+                    break
+        if stop == len(unit_names):
+            return None
+        return stop
+
+    # Parse the data and yield regions of each compilation unit child rule
+    #   (as a region store) as soon as it is parsed, regions are removed when
+    #   the next one is parsed. Each part (such as a whole top-level
+    #   declaration) is parsed and kept in full before it is yielded, so
+    #   memory is bounded by the largest part rather than the data and
+    #   parsing can only be stopped between parts. The compilation unit
+    #   region is yielded last and the parse output is returned when the
+    #   iteration is finished
+    def iter_steps(self, data, targets=None):
+        compilation_unit = self.compiled_grammar.compilation_unit
+        unit_rules = self.compiled_grammar.unit_rules
+        if compilation_unit is None or unit_rules is None or self.printer is not None:
+            self.data = None
+            parse_output = self.parse_grammar(data)
+            yield self.regions
+            return parse_output
+
+        stop = None
+        if targets is not None:
+            stop = self.get_unit_stop(targets)
+        if stop is None:
+            stop = len(unit_rules)
+        self.data = data
+        self.regions = regions = RegionStore(data, self.regions)
+        self.reset_packrat()
+        starttime = clock()
+        self.tokens = self.tokenize_data(data)
+        # Regions are not kept, so there is nothing to query or reuse
+        self.unit_steps = None
+        self.prefix = True
+        self.elapse_time = 0
+        try:
+            parse_rule = self.get_document_parse_rule()
+            unit_begin = begin = self.begin_document(parse_rule)
+            # Compilation unit region is added after all steps are parsed,
+            #   so the regions of each step can be removed
+            self.unit_region = None
+            steps = []
+            step_end = begin
+            for step in self.parse_steps(begin, 0, steps, None, stop):
+                if step is None:
+                    self.elapse_time += clock()-starttime
+                    return self.end_document(parse_rule, None)
+                begin = step[2][1]
+                step_end = step[2][2]
+                self.elapse_time += clock()-starttime
+                # Regions before the step (such as separator regions) are
+                #   yielded with the step
+                yield self.regions
+                starttime = clock()
+                # Parsed steps are never parsed again
+                del steps[:]
+                regions.truncate(0)
+                self.unit_mark = 0
+                self.reset_packrat()
+            self.begin_unit(unit_begin)
+            parse_output = self.end_document(parse_rule, self.end_unit(begin, step_end, stop))
+            if stop == len(unit_rules):
+                del parse_output["prefix"]
+            self.elapse_time += clock()-starttime
+            yield self.regions
+            return parse_output
+        finally:
+            regions.truncate(0)
+
+    # Same as iter_steps but yield each region (as a dict) selected by the
+    #   selectors (or all regions)
+    def iter_regions(self, data, selectors=None):
+        if isinstance(selectors, str):
+            selectors = selectors.split("|")
+        step_iterator = self.iter_steps(data, selectors)
+        try:
+            while True:
+                try:
+                    step_regions = next(step_iterator)
+                except StopIteration as stop_iteration:
+                    return stop_iteration.value
+                if selectors is not None:
+                    step_regions = self.find_by_selectors(selectors, step_regions)
+                # Regions in the store are removed on the next step
+                for region in [dict(region) for region in step_regions]:
+                    yield region
+        finally:
+            step_iterator.close()
+
+    # Same as parse_grammar but the last compilation unit child rule (such
+    #   as type declarations) is parsed in chunks split at the end of
+    #   top-level blocks, map_chunks is a function (such as a map of process
+    #   pool) which maps a list of chunk data to a list of parse_chunk
+    #   results and chunk_count is a number of chunks to split into
+    def parse_parallel(self, data, map_chunks, chunk_count):
+        unit_rules = self.compiled_grammar.unit_rules
+        tokenizer = self.compiled_grammar.tokenizer
+        if self.compiled_grammar.compilation_unit is None or unit_rules is None or not unit_rules or unit_rules[-1][1] is None or tokenizer is None or self.printer is not None:
+            self.data = None
+            return self.parse_grammar(data)
+        self.data = data
+        self.regions = regions = RegionStore(data, self.regions)
+        self.reset_packrat()
+        starttime = clock()
+        self.tokens = self.tokenize_data(data)
+        self.unit_steps = None
+        self.prefix = False
+        parse_rule = self.get_document_parse_rule()
+        begin = self.begin_document(parse_rule)
+        self.begin_unit(begin)
+        index = len(unit_rules)-1
+        steps = []
+        # Child rules before the last one are parsed sequentially
+        for step in self.parse_steps(begin, 0, steps, None, index):
+            if step is None:
+                parse_output = self.end_document(parse_rule, None)
+                if self.recover:
+                    parse_output["errors"] = self.get_errors()
+                self.elapse_time = clock()-starttime
+                return parse_output
+            begin = step[2][1]
+        chunks = self.get_chunks(self.tokens or tokenizer.tokenize(data), begin, chunk_count)
+        results = []
+        if len(chunks) > 1:
+            results = map_chunks([data[chunk_begin:chunk_end] for chunk_begin, chunk_end in chunks])
+        for (chunk_begin, chunk_end), result in zip(chunks, results):
+            # The rest is parsed sequentially once a chunk is not entirely
+            #   parsed, so the output is always the same as parse_grammar
+            if result is None:
+                break
+            chunk_steps, dumped, name_count, path_count, region_count = result
+            offset = len(regions)
+            if not regions.load(dumped, 0, name_count, path_count, region_count, chunk_begin):
+                regions.truncate(offset)
+                break
+            for step in chunk_steps:
+                parse_output = step[2]
+                steps.append((step[0], step[1]+chunk_begin, (parse_output[0]+chunk_begin, parse_output[1]+chunk_begin, parse_output[2]+chunk_begin), step[3]+offset, step[4]+offset))
+            begin = steps[-1][2][1]
+        for step in self.parse_steps(begin, index, steps, None, len(unit_rules)):
+            pass
+        if steps:
+            begin = steps[-1][2][1]
+        self.unit_steps = steps
+        parse_output = self.end_document(parse_rule, self.end_unit(begin, steps[-1][2][2] if steps else begin, len(unit_rules)))
+        if self.recover:
+            parse_output["errors"] = self.get_errors()
+        self.elapse_time = clock()-starttime
+        return parse_output
+
+    # Returns a list of (begin, end) of at most chunk_count chunks of
+    #   similar size from the position, each chunk ends at the end of a
+    #   top-level block (the separator after it is parsed with the next
+    #   occurrence like parse_grammar does) and the last chunk ends at the
+    #   end of the data
+    def get_chunks(self, tokens, begin, chunk_count):
+        size = len(self.data)
+        chunk_size = (size-begin) // max(chunk_count, 1)
+        chunks = []
+        chunk_begin = begin
+        for end in tokens.get_block_ends(self.data, begin):
+            if end-chunk_begin >= chunk_size and end < size and len(chunks) < chunk_count-1:
+                chunks.append((chunk_begin, end))
+                chunk_begin = end
+        if chunk_begin < size or not chunks:
+            chunks.append((chunk_begin, size))
+        return chunks
+
+    # Parse the data (a chunk from parse_parallel) as occurrences of the
+    #   last compilation unit child rule, returns a tuple of
+    #   (steps, dumped regions, name count, path count, region count) or
+    #   None if the data is not entirely parsed
+    def parse_chunk(self, data):
+        unit_rules = self.compiled_grammar.unit_rules
+        self.data = data
+        self.regions = RegionStore(data, self.regions)
+        self.reset_packrat()
+        self.tokens = self.tokenize_data(data)
+        # Regions are not the whole compilation unit, so the data has to be
+        #   parsed again by parse_grammar
+        self.unit_steps = None
+        self.prefix = True
+        self.unit_mark = 0
+        steps = []
+        index = len(unit_rules)-1
+        for step in self.parse_steps(0, index, steps, None, len(unit_rules)):
+            pass
+        if not steps:
+            return None
+        end = steps[-1][2][1]
+        separator = self.compiled_grammar.separator
+        # Last chunk might end with a separator
+        if end < len(data) and separator is not None:
+            mark = len(self.regions)
+            separator_output = self.get_document_parse_rule()(separator, True, end)
+            self.regions.truncate(mark)
+            if separator_output is not None:
+                end = separator_output[1]
+        # Recovered errors might be caused by the end of the chunk
+        if end != len(data) or (self.recover and self.get_errors()):
+            return None
+        dumped, name_count, path_count = self.regions.dump()
+        return (steps, dumped, name_count, path_count, len(self.regions))
+
+    # Reparse the data after edits, each edit is a tuple of
+    #   (begin, end, new_end) where data between begin and end is replaced
+    #   by data between begin and new_end (positions are in the data after
+    #   previous edits)
+    def parse_incremental(self, data, edits):
+        old_data = self.data
+        damage = self.get_edit_damage(edits)
+        if old_data is None or self.unit_steps is None or self.printer is not None or damage is None:
+            return self.parse_grammar(data)
+        damage_begin, damage_end, delta = damage
+        old_damage_end = damage_end-delta
+        # Make sure that the edits are really describe the changes
+        if len(data) != len(old_data)+delta or data[:damage_begin] != old_data[:damage_begin] or data[damage_end:] != old_data[old_damage_end:]:
+            return self.parse_grammar(data)
+        old_regions = self.regions
+        self.data = data
+        self.regions = RegionStore(data, old_regions)
+        self.reset_packrat()
+        starttime = clock()
+        self.tokens = self.tokenize_data(data)
+        old_steps = self.unit_steps
+        reuse = 0
+        while reuse < len(old_steps) and old_steps[reuse][2][1] < damage_begin:
+            reuse += 1
+        # Step before the edits might look ahead into the edits
+        reuse = max(reuse-1, 0)
+        # Steps after the edits are the same once parsing reach their begin
+        sync_steps = {}
+        for step_index in range(len(old_steps)-1, reuse-1, -1):
+            step = old_steps[step_index]
+            if step[1] < old_damage_end:
+                break
+            sync_steps[(step[0], step[1]+delta)] = step_index
+        sync = (old_regions, old_steps, sync_steps, delta)
+        if reuse == 0:
+            parse_output = self.parse_document(None, 0, [], sync)
+        else:
+            index, begin, step_output, region_begin, region_end = old_steps[reuse]
+            self.regions.add_regions(old_regions, 0, region_begin)
+            parse_output = self.parse_document(begin, index, old_steps[:reuse], sync)
+        self.elapse_time = clock()-starttime
+        return parse_output
+
+    # Returns a tuple of (begin, end, delta) of edited data or None
+    def get_edit_damage(self, edits):
+        damage = None
+        delta = 0
+        for begin, end, new_end in edits:
+            if damage is None:
+                damage = (begin, new_end)
+            else:
+                damage_begin, damage_end = damage
+                if damage_end >= end:
+                    damage_end += new_end-end
+                elif damage_end > begin:
+                    damage_end = new_end
+                damage = (min(damage_begin, begin), max(damage_end, new_end))
+            delta += new_end-end
+        if damage is None:
+            return None
+        return (damage[0], damage[1], delta)
+
+    # Parse the whole data when begin is None, otherwise, continue parsing
+    #   the compilation unit at the specified child rule index and position
+    #   with the parsed steps
+    def parse_document(self, begin, index, steps, sync, stop=None):
+        parse_rule = self.get_document_parse_rule()
+        parse_output = (0, 0, 0)
+        success = False
+        compilation_unit = self.compiled_grammar.compilation_unit
+        self.unit_steps = None
+        self.prefix = stop is not None
+        if compilation_unit is not None:
+            if begin is None:
+                begin = self.begin_document(parse_rule)
+            if self.compiled_grammar.unit_rules is not None and self.printer is None:
+                parse_output = self.parse_unit(begin, index, steps, sync, stop)
+            else:
+                parse_output = parse_rule(compilation_unit, False, begin)
+            parse_output = self.end_document(parse_rule, parse_output)
+        else:
+            parse_output = {"success": success, "begin": parse_output[0], "end": parse_output[2]}
+        if self.recover:
+            parse_output["errors"] = self.get_errors()
+        return parse_output
+
+    # Returns a function to parse the compilation unit (or its separator)
+    #   at the specified position
+    def get_document_parse_rule(self):
+        if self.printer is not None:
+            return lambda rule, is_separator, begin: self.trace_rule(rule, is_separator, 0, 0, begin)
+        elif self.tokens is not None:
+            return lambda rule, is_separator, begin: (is_separator and self.skip_separator(begin)) or self.parse_rule(rule, is_separator, 0, begin)
+        return lambda rule, is_separator, begin: self.parse_rule(rule, is_separator, 0, begin)
+
+    # Skip the separator before the compilation unit, returns a position
+    #   to start parsing the compilation unit
+    def begin_document(self, parse_rule):
+        compilation_unit = self.compiled_grammar.compilation_unit
+        separator = self.compiled_grammar.separator
+        if self.printer is not None:
+            self.printer(0, "== Compilation unit ==")
+        begin = 0
+        # Pre separator (for beginning correction)
+        if separator is not None and compilation_unit.before_separator:
+            separator_output = parse_rule(separator, True, 0)
+            if separator_output is not None:
+                begin = separator_output[2]
+        self.unit_begin = begin
+        self.unit_mark = len(self.regions)
+        return begin
+
+    # Returns the document parse output from the compilation unit output
+    def end_document(self, parse_rule, parse_output):
+        compilation_unit = self.compiled_grammar.compilation_unit
+        separator = self.compiled_grammar.separator
+        success = parse_output is not None
+        if not success:
+            parse_output = (self.unit_begin, self.unit_begin, self.unit_begin)
+        # Post separator (for ending correction)
+        if separator is not None and compilation_unit.after_separator:
+            separator_output = parse_rule(separator, True, parse_output[2])
+            if separator_output is not None:
+                parse_output = (parse_output[0], parse_output[1], separator_output[2])
+        if self.prefix:
+            return {"success": success, "begin": parse_output[0], "end": parse_output[2], "prefix": True}
+        return {"success": success, "begin": parse_output[0], "end": parse_output[2]}
+
+    # Same as parse_rule on compilation unit but parse each step separately,
+    #   each step is a tuple of
+    #   (rule index, begin, parse output, region begin, region end)
+    #   only stop child rules are parsed if stop is specified
+    def parse_unit(self, begin, index, steps, sync, stop=None):
+        unit_rules = self.compiled_grammar.unit_rules
+        if not steps:
+            self.begin_unit(begin)
+        if stop is None:
+            stop = len(unit_rules)
+        for step in self.parse_steps(begin, index, steps, sync, stop):
+            if step is None:
+                return None
+        if steps:
+            begin = steps[-1][2][1]
+        # Steps of partially parsed compilation unit cannot be reused
+        if stop == len(unit_rules):
+            self.unit_steps = steps
+        return self.end_unit(begin, steps[-1][2][2] if steps else begin, stop)
+
+    # Add the compilation unit region (if it is named)
+    def begin_unit(self, begin):
+        compilation_unit = self.compiled_grammar.compilation_unit
+        self.unit_region = None
+        if compilation_unit.name is not None:
+            self.unit_region = self.regions.add(begin, begin, self.get_unit_parent())
+
+    def get_unit_parent(self):
+        compilation_unit = self.compiled_grammar.compilation_unit
+        if compilation_unit.name is None:
+            return 0
+        return self.regions.get_path_id(0, compilation_unit.name)
+
+    # Returns the compilation unit output from the position after the last
+    #   step and the end of the last step (including its separator) and
+    #   updates the compilation unit region
+    def end_unit(self, begin, step_end, stop):
+        unit_rules = self.compiled_grammar.unit_rules
+        root_begin = self.unit_begin
+        if self.unit_first is not None:
+            root_begin = self.unit_first
+        end = begin
+        if stop == len(unit_rules) and unit_rules and unit_rules[-1][1] is None:
+            end = step_end
+        if self.unit_region is not None:
+            self.regions.update(self.unit_region, root_begin, end)
+        return (root_begin, begin, end)
+
+    # Parse the compilation unit child rules from the index until stop and
+    #   yield each new step once it is parsed, None is yielded when the
+    #   compilation unit is not matched
+    def parse_steps(self, begin, index, steps, sync, stop):
+        unit_rules = self.compiled_grammar.unit_rules
+        regions = self.regions
+        parent = self.get_unit_parent()
+        self.unit_first = None
+        if steps and steps[0][0] == 0:
+            self.unit_first = steps[0][2][0]
+        while index < stop:
+            if sync is not None and (index, begin) in sync[2]:
+                old_regions, old_steps, sync_steps, delta = sync
+                step_index = sync_steps[(index, begin)]
+                offset = len(regions)-old_steps[step_index][3]
+                regions.add_regions(old_regions, old_steps[step_index][3], old_steps[-1][4], delta)
+                for step in old_steps[step_index:]:
+                    parse_output = step[2]
+                    steps.append((step[0], step[1]+delta, (parse_output[0]+delta, parse_output[1]+delta, parse_output[2]+delta), step[3]+offset, step[4]+offset))
+                    if self.unit_first is None and step[0] == 0:
+                        self.unit_first = steps[-1][2][0]
+                    yield steps[-1]
+                return
+            rule, single_rule = unit_rules[index]
+            region_begin = len(regions)
+            if single_rule is None:
+                parse_output = self.parse_rule(rule, False, parent, begin)
+                if parse_output is None:
+                    regions.truncate(self.unit_mark)
+                    yield None
+                    return
+            else:
+                parse_output = self.parse_rule(single_rule, False, parent, begin)
+                if parse_output is None and self.recover and rule.recover is not None:
+                    # Skipped data is a step (like an occurrence)
+                    parse_output = self.parse_rule(rule.recover, False, parent, begin)
+                    if parse_output is not None and parse_output[1] == begin:
+                        regions.truncate(region_begin)
+                        parse_output = None
+                if parse_output is None:
+                    index += 1
+                    continue
+            steps.append((index, begin, parse_output, region_begin, len(regions)))
+            if self.unit_first is None and index == 0:
+                self.unit_first = parse_output[0]
+            if single_rule is None or parse_output[1] == begin:
+                index += 1
+            begin = parse_output[1]
+            yield steps[-1]
+
+    # Returns the separator output from tokens or None if the separator has
+    #   to be parsed
+    def skip_separator(self, begin):
+        kind = self.tokens.kinds[begin]
+        if kind == KIND_TOKEN:
+            return (begin, begin, begin)
+        elif kind == KIND_SEPARATOR:
+            end = self.tokens.separator_ends[begin]
+            return (begin, end, end)
+        return None
+
+    def tokenize_data(self, data):
+        tokenizer = self.compiled_grammar.tokenizer
+        if tokenizer is None or not self.tokenize or self.printer is not None:
+            return None
+        return tokenizer.tokenize(data)
+
+    # Match the pattern in place, returns an ending position or None
+    def match_rule(self, rule, begin):
+        # Patterns that look behind its starting position must see the data
+        #   as if the data is starting at the begin position
+        context = rule.context
+        if begin > 0 and context != CONTEXT_NONE and (context == CONTEXT_ANY or WORD_PATTERN.match(self.data, begin-1) is not None):
+            matches = rule.regex.match(self.data[begin:])
+            if matches is None:
+                return None
+            return begin+matches.end()
+        matches = rule.regex.match(self.data, begin)
+        if matches is None:
+            return None
+        return matches.end()
+
+    # Parse output is a tuple of (begin, new_begin, end) or None if the rule
+    #   is not matched, regions are added to the region store while parsing
+    #   and removed if the rule is not matched
+    #
+    # Rules are parsed with an explicit stack instead of Python recursion,
+    #   each rule call saves the state of its caller and the state to resume
+    #   on the stack. Multiple occurrences are parsed in a loop but they are
+    #   still nested (so as their regions).
+    def parse_rule(self, rule, is_separator, parent, begin):
+        regions = self.regions
+        data = self.data
+        separator = self.compiled_grammar.separator
+        packrat = self.packrat
+        profile = self.profile and self.printer is None
+        recover = self.recover
+        kinds = None
+        separator_ends = None
+        if self.tokens is not None:
+            kinds = self.tokens.kinds
+            separator_ends = self.tokens.separator_ends
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        state = STATE_ENTER
+        output = None
+        rule_begin = None
+        rule_output = None
+        mark = None
+        region = None
+        child = 0
+        root_begin = None
+        alternatives = None
+        chain = None
+        while True:
+            if state == STATE_ENTER:
+                if len(stack) > MAX_DEPTH:
+                    # RecursionError is not available on Python 3.3
+                    raise RuntimeError("maximum rule call depth exceeded")
+                while rule.direct and not packrat and not profile:
+                    rule = rule.target
+                if rule.name is not None:
+                    parent = regions.get_path_id(parent, rule.name)
+                rule_begin = begin
+                if rule.exclude is not None:
+                    mark = len(regions.begins)
+                    push((STATE_EXCLUDE, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                    rule = rule.exclude
+                    chain = None
+                    continue
+                state = STATE_BODY
+            elif state == STATE_EXCLUDE:
+                if output is not None:
+                    regions.truncate(mark)
+                    state = STATE_FAIL
+                else:
+                    state = STATE_BODY
+
+            if state == STATE_BODY:
+                kind = rule.kind
+                if kind == RULE_MATCH:
+                    mark = None
+                    if not is_separator and separator is not None and rule.before_separator and (kinds is None or kinds[begin] == KIND_NONE):
+                        mark = len(regions.begins)
+                        push((STATE_MATCH, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                        rule = separator
+                        is_separator = True
+                        chain = None
+                        state = STATE_ENTER
+                        continue
+                    output = None
+                    if kinds is not None and kinds[begin] == KIND_SEPARATOR:
+                        begin = separator_ends[begin]
+                    state = STATE_MATCH
+                elif kind == RULE_PARSE:
+                    region = None
+                    if rule.name is not None:
+                        region = regions.add(begin, begin, parent)
+                    if not rule.rules:
+                        output = (begin, begin, begin)
+                        state = STATE_RULE_END
+                    else:
+                        mark = len(regions.begins)
+                        root_begin = None
+                        child = 0
+                        push((STATE_PARSE, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                        rule = rule.rules[0]
+                        chain = None
+                        state = STATE_ENTER
+                        continue
+                elif kind == RULE_PARSE_ANY:
+                    region = None
+                    if rule.name is not None:
+                        region = regions.add(begin, begin, parent)
+                    alternatives = rule.rules
+                    # Only alternatives which can start with the next token
+                    #   character are parsed
+                    if rule.lookahead is not None and kinds is not None and not is_separator and kinds[begin] != KIND_NONE:
+                        position = begin
+                        if kinds[begin] == KIND_SEPARATOR:
+                            position = separator_ends[begin]
+                        if position < len(data):
+                            alternatives = rule.lookahead[min(ord(data[position]), FIRST_OTHER)]
+                        else:
+                            alternatives = rule.lookahead[FIRST_END]
+                    if not alternatives:
+                        output = None
+                        state = STATE_RULE_END
+                    else:
+                        child = 0
+                        push((STATE_PARSE_ANY, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                        rule = alternatives[0]
+                        chain = None
+                        state = STATE_ENTER
+                        continue
+                elif kind == RULE_INCLUDE:
+                    region = None
+                    if rule.name is not None:
+                        region = regions.add(begin, begin, parent)
+                    output = None
+                    state = STATE_RULE_END
+                    if rule.target is not None:
+                        if packrat:
+                            # Parent call tree only affects the region paths,
+                            #   so the cached regions are rebased on the new
+                            #   parent instead of reparsing
+                            key = (rule.target, is_separator, begin)
+                            if key in self.packrat_cache:
+                                self.packrat_hits += 1
+                                cached_parent, output, rows = self.packrat_cache[key]
+                                if output is not None:
+                                    regions.add_rows(rows, cached_parent, parent)
+                                if profile:
+                                    self.enter_profile(rule.include)
+                                    self.exit_profile(rule.include, begin, output)
+                            else:
+                                self.packrat_misses += 1
+                                if profile:
+                                    self.enter_profile(rule.include)
+                                mark = len(regions.begins)
+                                push((STATE_PACKRAT, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                                rule = rule.target
+                                chain = None
+                                state = STATE_ENTER
+                                continue
+                        else:
+                            if profile:
+                                self.enter_profile(rule.include)
+                                push((STATE_PROFILE, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                            else:
+                                push((STATE_RULE_END, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                            rule = rule.target
+                            chain = None
+                            state = STATE_ENTER
+                            continue
+                else:
+                    state = STATE_FAIL
+
+            if state == STATE_MATCH:
+                # Separator output (if any) is the output
+                if output is not None:
+                    begin = output[1]
+                if rule.context == CONTEXT_NONE:
+                    matches = rule.regex.match(data, begin)
+                    match_end = None
+                    if matches is not None:
+                        match_end = matches.end()
+                else:
+                    match_end = self.match_rule(rule, begin)
+                if match_end is None:
+                    # Failed optional match keeps its separator regions
+                    if mark is not None and not (rule.optional or rule.multiple):
+                        regions.truncate(mark)
+                    state = STATE_FAIL
+                else:
+                    rule_output = (begin, match_end, match_end)
+                    if rule.name is not None:
+                        regions.add(begin, match_end, parent)
+                    begin = match_end
+                    if not is_separator and separator is not None and rule.after_separator:
+                        if kinds is None or kinds[begin] == KIND_NONE:
+                            push((STATE_MATCH_END, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                            rule = separator
+                            is_separator = True
+                            chain = None
+                            state = STATE_ENTER
+                            continue
+                        if kinds[begin] == KIND_SEPARATOR:
+                            begin = separator_ends[begin]
+                    state = STATE_END
+            elif state == STATE_MATCH_END:
+                if output is not None:
+                    begin = output[1]
+                state = STATE_END
+            elif state == STATE_PARSE:
+                if output is None:
+                    if root_begin is not None:
+                        regions.truncate(mark)
+                    state = STATE_RULE_END
+                else:
+                    if root_begin is None:
+                        root_begin = output[0]
+                    child += 1
+                    if child < len(rule.rules):
+                        begin = output[1]
+                        push((STATE_PARSE, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                        rule = rule.rules[child]
+                        chain = None
+                        state = STATE_ENTER
+                        continue
+                    output = (root_begin, output[1], output[2])
+                    state = STATE_RULE_END
+            elif state == STATE_PARSE_ANY:
+                if output is None:
+                    child += 1
+                    if child < len(alternatives):
+                        push((STATE_PARSE_ANY, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain))
+                        rule = alternatives[child]
+                        chain = None
+                        state = STATE_ENTER
+                        continue
+                state = STATE_RULE_END
+            elif state == STATE_PACKRAT:
+                size = 1
+                rows = None
+                if output is not None:
+                    rows = regions.get_rows(mark)
+                    size += len(rows[0])
+                if self.packrat_size + size <= self.packrat_limit:
+                    self.packrat_cache[(rule.target, is_separator, begin)] = (parent, output, rows)
+                    self.packrat_size += size
+                if profile:
+                    self.exit_profile(rule.include, begin, output)
+                state = STATE_RULE_END
+            elif state == STATE_PROFILE:
+                self.exit_profile(rule.include, begin, output)
+                state = STATE_RULE_END
+
+            if state == STATE_RULE_END:
+                # Output of the rule list, alternatives or included rule
+                if output is None:
+                    if region is not None:
+                        regions.truncate(region)
+                    state = STATE_FAIL
+                else:
+                    if region is not None:
+                        regions.update(region, output[0], output[2])
+                    begin = output[1]
+                    rule_output = output
+                    state = STATE_END
+
+            if state == STATE_END:
+                if not rule.multiple:
+                    output = rule_output
+                else:
+                    # Next occurrence is nested in this occurrence
+                    if chain is None:
+                        chain = ([], [])
+                    chain[0].append(rule_output[0])
+                    if begin != rule_begin:
+                        if rule.name is not None:
+                            chain[1].append(regions.add(begin, begin, parent))
+                        else:
+                            chain[1].append(None)
+                        state = STATE_ENTER
+                        continue
+                    # Occurrence without any progress will be repeated forever
+                    output = self.end_occurrences(chain, begin)
+            elif state == STATE_FAIL and recover and rule.recover is not None:
+                # Parse the recover rule instead, multiple rule continues
+                #   with the next occurrence after the skipped data
+                push((STATE_RECOVER, rule, is_separator, parent, rule_begin, rule_begin, rule_output, len(regions.begins), region, child, root_begin, alternatives, chain))
+                rule = rule.recover
+                begin = rule_begin
+                chain = None
+                state = STATE_ENTER
+                continue
+            elif state == STATE_RECOVER and output is not None and not (rule.multiple and output[1] == rule_begin):
+                # Recover rule output is the rule output
+                if rule.multiple:
+                    if chain is None:
+                        chain = ([], [])
+                    chain[0].append(rule_begin)
+                    begin = output[1]
+                    if rule.name is not None:
+                        chain[1].append(regions.add(begin, begin, parent))
+                    else:
+                        chain[1].append(None)
+                    state = STATE_ENTER
+                    continue
+            elif state == STATE_FAIL or state == STATE_RECOVER:
+                if state == STATE_RECOVER:
+                    regions.truncate(mark)
+                if chain is not None:
+                    output = self.end_occurrences(chain, rule_begin)
+                elif rule.optional or rule.multiple:
+                    output = (rule_begin, rule_begin, rule_begin)
+                else:
+                    output = None
+
+            # Return to the caller
+            if not stack:
+                return output
+            state, rule, is_separator, parent, begin, rule_begin, rule_output, mark, region, child, root_begin, alternatives, chain = pop()
+
+    # Update regions of multiple occurrences and returns their output, each
+    #   occurrence region is covered the next occurrences
+    def end_occurrences(self, chain, end):
+        begins, occurrence_regions = chain
+        for index in range(len(occurrence_regions)-1, -1, -1):
+            if occurrence_regions[index] is not None:
+                if index+1 < len(begins):
+                    self.regions.update(occurrence_regions[index], begins[index+1], end)
+                else:
+                    self.regions.update(occurrence_regions[index], end, end)
+        return (begins[0], end, end)
+
+    # Same as parse_rule on rule list but with rule calls printing
+    def trace_rule_list(self, rules, is_separator, parent, level, begin):
+        if not is_separator:
             self.printer(level, "== Rule list [" + str(len(rules)) + "] ==")
         index = 0
         root_begin = None
+        parse_output = None
+        mark = len(self.regions.begins)
         for rule in rules:
             index += 1
-            if self.printer is not None and not is_separator:
+            if not is_separator:
                 self.printer(level, "> Rule ["+str(index)+"/"+str(len(rules))+"] " + str(begin))
-            parse_output = self.parse_rule(rule, is_separator, parent, level+1, begin)
-            if parse_output["successive_match"]:
-                if root_begin is None:
-                    root_begin = parse_output["begin"]
-                begin = parse_output["new_begin"]
-                regions += parse_output["regions"]
-            else:
-                if self.printer is not None and not is_separator:
+            parse_output = self.trace_rule(rule, is_separator, parent, level+1, begin)
+            if parse_output is None:
+                if not is_separator:
                     self.printer(level, "> Failed")
-                break
-        if root_begin is None:
-            root_begin = begin
-        parse_output["begin"] = root_begin
-        parse_output["regions"] = regions
-        return parse_output
+                self.regions.truncate(mark)
+                return None
+            if root_begin is None:
+                root_begin = parse_output[0]
+            begin = parse_output[1]
+        if parse_output is None:
+            return (begin, begin, begin)
+        return (root_begin, parse_output[1], parse_output[2])
 
-    def parse_rule_list_any(self, rules, is_separator, parent, level, begin):
-        if self.printer is not None and not is_separator:
+    # Same as parse_rule on alternatives but with rule calls printing
+    def trace_rule_list_any(self, rules, is_separator, parent, level, begin):
+        if not is_separator:
             self.printer(level, "== Rule list once [" + str(len(rules)) + "] ==")
         index = 0
         for rule in rules:
             index += 1
-            if self.printer is not None and not is_separator:
+            if not is_separator:
                 self.printer(level, "> Once ["+str(index)+"/"+str(len(rules))+"] " + str(begin))
-            parse_output = self.parse_rule(rule, is_separator, parent, level+1, begin)
-            if parse_output["successive_match"]:
-                if self.printer is not None and not is_separator:
+            parse_output = self.trace_rule(rule, is_separator, parent, level+1, begin)
+            if parse_output is not None:
+                if not is_separator:
                     self.printer(level, "> Once Success")
                 return parse_output
-        if self.printer is not None and not is_separator:
+        if not is_separator:
             self.printer(level, "> Once Failed")
-        return parse_output
+        return None
 
-    def parse_rule(self, rule, is_separator, parent, level, begin):
-        regions = []
-        if self.printer is not None and not is_separator:
-            if "name" in rule:
-                self.printer(level, "== Rule " + rule["name"] + " [" + str(begin) + "] ==")
-            else:
-                self.printer(level, "== Rule [" + str(begin) + "] ==")
-        rule_output = {"successive_match": False, "match": False, "begin": begin, "new_begin": begin, "end": begin, "regions": []}
-        if "name" in rule:
-            if parent != "":
-                parent += ">"
-            parent += rule["name"]
-        good = True
-        if "exclude" in rule:
-            exclude_output = self.parse_rule(rule["exclude"], is_separator, parent, level+1, begin)
-            if exclude_output["successive_match"]:
-                good = False
-        if good:
-            if "match" in rule:
-                if rule["match"] in self.re_cache:
-                    re_pattern = self.re_cache[rule["match"]]
+    # Same as parse_rule but with rule calls printing
+    def trace_rule(self, rule, is_separator, parent, level, begin):
+        printer = self.printer
+        if is_separator:
+            printer = lambda level, message: None
+        regions = self.regions
+        mark = len(regions.begins)
+        name = rule.name
+        if name is not None:
+            printer(level, "== Rule " + name + " [" + str(begin) + "] ==")
+            parent = regions.get_path_id(parent, name)
+        else:
+            printer(level, "== Rule [" + str(begin) + "] ==")
+        rule_begin = begin
+        rule_output = None
+        kind = rule.kind
+        if rule.exclude is not None and self.trace_rule(rule.exclude, is_separator, parent, level+1, begin) is not None:
+            regions.truncate(mark)
+            kind = None
+        if kind == RULE_MATCH:
+            separator = self.compiled_grammar.separator
+            if not is_separator and separator is not None and rule.before_separator:
+                printer(level, "> Separator Before: " + str(begin))
+                separator_output = self.trace_rule(separator, True, parent, level+1, begin)
+                if separator_output is not None:
+                    begin = separator_output[1]
+                    printer(level, "> Match before sep")
+            printer(level, "> Matching at [" + str(begin) + "]: " + rule.pattern)
+            match_end = self.match_rule(rule, begin)
+            if match_end is not None:
+                rule_output = (begin, match_end, match_end)
+                if name is not None:
+                    regions.add(begin, match_end, parent)
+                    printer(level, "> Adding " + str(begin) + ":" + str(match_end))
                 else:
-                    re_pattern = re.compile(rule["match"])
-                if not is_separator and "separator" in self.grammar and ("before_separator" not in rule or rule["before_separator"]):
-                    if self.printer is not None and not is_separator:
-                        self.printer(level, "> Separator Before: " + str(begin))
-                    separator_output = self.parse_rule(self.grammar["separator"], True, parent, level+1, begin)
-                    if separator_output["successive_match"]:
-                        begin = separator_output["new_begin"]
-                        regions += separator_output["regions"]
-                        if self.printer is not None and not is_separator:
-                            self.printer(level, "> Match before sep")
-                if self.printer is not None and not is_separator:
-                    self.printer(level, "> Matching at [" + str(begin) + "]: " + rule["match"])
-                matches = re_pattern.search(self.data[begin:len(self.data)])
-                if matches is not None and matches.start() == 0:
-                    rule_output["successive_match"] = True
-                    rule_output["match"] = True
-                    rule_output["begin"] = begin
-                    rule_output["end"] = begin+matches.end()
-                    rule_output["new_begin"] = rule_output["end"]
-                    begin = rule_output["end"]
-                    if "name" in rule:
-                        regions.append({"begin": rule_output["begin"], "end": rule_output["end"], "value": self.data[rule_output["begin"]:rule_output["end"]], "parent": parent, "name": rule["name"]})
-                        if self.printer is not None and not is_separator:
-                            self.printer(level, "> Adding " + str(rule_output["begin"]) + ":" + str(rule_output["end"]))
-                    else:
-                        if self.printer is not None and not is_separator:
-                            self.printer(level, "> Skip: " + str(rule_output["end"]))
-                if not is_separator and rule_output["successive_match"] and "separator" in self.grammar and ("after_separator" not in rule or rule["after_separator"]):
-                    if self.printer is not None and not is_separator:
-                        self.printer(level, "> Separator After: " + str(rule_output["end"]))
-                    separator_output = self.parse_rule(self.grammar["separator"], True, parent, level+1, begin)
-                    if separator_output["successive_match"]:
-                        begin = separator_output["new_begin"]
-                        regions += separator_output["regions"]
-                        if self.printer is not None and not is_separator:
-                            self.printer(level, "> Match after sep")
-            elif "parse" in rule:
-                parse_output = self.parse_rule_list(rule["parse"], is_separator, parent, level+1, begin)
-                if parse_output["successive_match"]:
-                    if "name" in rule:
-                        regions.append({"begin": parse_output["begin"], "end": parse_output["end"], "value": self.data[parse_output["begin"]:parse_output["end"]], "parent": parent, "name": rule["name"]})
-                    if parse_output["match"]:
-                        rule_output["match"] = parse_output["match"]
-                    begin = parse_output["new_begin"]
-                    rule_output["new_begin"] = parse_output["new_begin"]
-                    rule_output["begin"] = parse_output["begin"]
-                    rule_output["end"] = parse_output["end"]
-                    rule_output["successive_match"] = parse_output["successive_match"]
-                    regions += parse_output["regions"]
-            elif "parse_any" in rule:
-                parse_output = self.parse_rule_list_any(rule["parse_any"], is_separator, parent, level+1, begin)
-                if parse_output["successive_match"]:
-                    if "name" in rule:
-                        regions.append({"begin": parse_output["begin"], "end": parse_output["end"], "value": self.data[parse_output["begin"]:parse_output["end"]], "parent": parent, "name": rule["name"]})
-                    if parse_output["match"]:
-                        rule_output["match"] = parse_output["match"]
-                    begin = parse_output["new_begin"]
-                    rule_output["new_begin"] = parse_output["new_begin"]
-                    rule_output["begin"] = parse_output["begin"]
-                    rule_output["end"] = parse_output["end"]
-                    rule_output["successive_match"] = parse_output["successive_match"]
-                    regions += parse_output["regions"]
-            elif "include" in rule:
-                if "repository" in self.grammar and rule["include"] in self.grammar["repository"]:
-                    if self.printer is not None and not is_separator:
-                        self.printer(level, "> Include " + rule["include"])
-                    parse_output = self.parse_rule(self.grammar["repository"][rule["include"]], is_separator, parent, level+1, begin)
-                    if parse_output["successive_match"]:
-                        if "name" in rule:
-                            regions.append({"begin": parse_output["begin"], "end": parse_output["end"], "value": self.data[parse_output["begin"]:parse_output["end"]], "parent": parent, "name": rule["name"]})
-                        if parse_output["match"]:
-                            rule_output["match"] = parse_output["match"]
-                        begin = parse_output["new_begin"]
-                        rule_output["new_begin"] = parse_output["new_begin"]
-                        rule_output["begin"] = parse_output["begin"]
-                        rule_output["end"] = parse_output["end"]
-                        rule_output["successive_match"] = parse_output["successive_match"]
-                        regions += parse_output["regions"]
+                    printer(level, "> Skip: " + str(match_end))
+                begin = match_end
+                if not is_separator and separator is not None and rule.after_separator:
+                    printer(level, "> Separator After: " + str(match_end))
+                    separator_output = self.trace_rule(separator, True, parent, level+1, begin)
+                    if separator_output is not None:
+                        begin = separator_output[1]
+                        printer(level, "> Match after sep")
+        elif kind is not None and kind != RULE_EMPTY:
+            if name is not None:
+                regions.add(begin, begin, parent)
+            if kind == RULE_PARSE:
+                parse_output = self.trace_rule_list(rule.rules, is_separator, parent, level+1, begin)
+            elif kind == RULE_PARSE_ANY:
+                parse_output = self.trace_rule_list_any(rule.rules, is_separator, parent, level+1, begin)
+            elif rule.target is None:
+                parse_output = None
+            else:
+                printer(level, "> Include " + rule.include)
+                # Profiled time also includes the printing
+                if self.profile:
+                    self.enter_profile(rule.include)
+                if self.packrat:
+                    parse_output = self.parse_include(rule, is_separator, parent, begin, level+1)
                 else:
-                    rule_output["successive_match"] = False
-
-            if "multiple" in rule and rule["multiple"] and rule_output["successive_match"]:
-                if self.printer is not None and not is_separator:
-                    self.printer(level, "Multiple: " + str(begin))
-                parse_output = self.parse_rule(rule, is_separator, parent, level+1, begin)
-                if parse_output["successive_match"]:
-                    if "name" in rule:
-                        regions.append({"begin": parse_output["begin"], "end": parse_output["end"], "value": self.data[parse_output["begin"]:parse_output["end"]], "parent": parent, "name": rule["name"]})
-                    if parse_output["match"]:
-                        rule_output["match"] = parse_output["match"]
-                    begin = parse_output["new_begin"]
-                    rule_output["end"] = parse_output["end"]
-                    rule_output["new_begin"] = parse_output["new_begin"]
-                    regions += parse_output["regions"]
-
-        if rule_output["successive_match"]:
-            if "name" in rule:
-                if self.printer is not None and not is_separator:
-                    self.printer(level, "> Matched")
-        elif ("optional" in rule and rule["optional"]) or ("multiple" in rule and rule["multiple"]):
-            rule_output["successive_match"] = True
-            if self.printer is not None and not is_separator:
-                self.printer(level, "> Optional")
-        if "name" in rule:
-            if self.printer is not None and not is_separator:
-                self.printer(level, "== EndRule " + rule["name"] + " [" + str(begin) + "] ==")
+                    parse_output = self.trace_rule(rule.target, is_separator, parent, level+1, begin)
+                if self.profile:
+                    self.exit_profile(rule.include, begin, parse_output)
+            if parse_output is not None:
+                if name is not None:
+                    regions.update(mark, parse_output[0], parse_output[2])
+                begin = parse_output[1]
+                rule_output = parse_output
+            elif name is not None:
+                regions.truncate(mark)
+
+        if rule_output is not None and rule.multiple:
+            printer(level, "Multiple: " + str(begin))
+            index = None
+            if name is not None:
+                index = regions.add(begin, begin, parent)
+            parse_output = self.trace_rule(rule, is_separator, parent, level+1, begin)
+            if index is not None:
+                regions.update(index, parse_output[0], parse_output[2])
+            begin = parse_output[1]
+            rule_output = (rule_output[0], parse_output[1], parse_output[2])
+
+        if rule_output is not None:
+            if name is not None:
+                printer(level, "> Matched")
+        elif rule.optional or rule.multiple:
+            rule_output = (rule_begin, rule_begin, rule_begin)
+            printer(level, "> Optional")
+        if name is not None:
+            printer(level, "== EndRule " + name + " [" + str(begin) + "] ==")
         else:
-            if self.printer is not None and not is_separator:
-                self.printer(level, "== EndRule [" + str(begin) + "] ==")
-        rule_output["regions"] = regions
-        return rule_output
+            printer(level, "== EndRule [" + str(begin) + "] ==")
+        if rule_output is None:
+            regions.truncate(mark)
+            return None
+        return (rule_output[0], rule_output[1], rule_output[2])
+
+    def parse_include(self, rule, is_separator, parent, begin, level=None):
+        # Parent call tree only affects the region paths, so the cached
+        #   regions are rebased on the new parent instead of reparsing
+        key = (rule.target, is_separator, begin)
+        regions = self.regions
+        if key in self.packrat_cache:
+            self.packrat_hits += 1
+            if level is not None and not is_separator:
+                self.printer(level, "> Packrat hit " + rule.include + " [" + str(begin) + "]")
+            cached_parent, parse_output, rows = self.packrat_cache[key]
+            if parse_output is not None:
+                regions.add_rows(rows, cached_parent, parent)
+            return parse_output
+        self.packrat_misses += 1
+        mark = len(regions.begins)
+        if level is not None:
+            parse_output = self.trace_rule(rule.target, is_separator, parent, level, begin)
+        else:
+            parse_output = self.parse_rule(rule.target, is_separator, parent, begin)
+        size = 1
+        rows = None
+        if parse_output is not None:
+            rows = regions.get_rows(mark)
+            size += len(rows[0])
+        if self.packrat_size + size <= self.packrat_limit:
+            self.packrat_cache[key] = (parent, parse_output, rows)
+            self.packrat_size += size
+        return parse_output
 
     # Find all (return all)
     def find_all(self):
-        return self.regions
+        return RegionList(self.regions, range(len(self.regions)))
 
     # Find by RegEx
     def find_by_regex(self, regex, search_regions=None):
@@ -298,6 +2636,19 @@ class GrammarParser():
         if find_by_name:
             regex = regex[1:]
         re_pattern = re.compile(regex)
+        query = RegionQuery.get(search_regions)
+        if query is not None:
+            # Match each path once instead of each region
+            store = query.store
+            path_ids = set()
+            for path_id in range(1, len(store.paths)):
+                if find_by_name:
+                    name = store.names[store.path_names[path_id]]
+                else:
+                    name = store.paths[path_id]
+                if re_pattern.match(name) is not None:
+                    path_ids.add(path_id)
+            return RegionList(store, query.with_paths(path_ids))
         regions = []
         for region in search_regions:
             if find_by_name:
@@ -323,58 +2674,24 @@ class GrammarParser():
     # Find by selector
     @staticmethod
     def filter_by_selector(selector, search_regions):
-        regions = []
-        filter_pattern = re.compile("(\\[(?P<FilterAny>>)?(?P<Filter>[\\w-]+)=(?P<Value>[^\\]]*)\\])")
-        filter_match = filter_pattern.search(selector)
-
-        filter_selector = None
-        if filter_match:
-            selector = selector[:-len(filter_match.group(0))]
-            filter_any = filter_match.group("FilterAny") and filter_match.group("FilterAny") is not ""
-            filter_selector = filter_match.group("Filter")
-            filter_value = filter_match.group("Value")
-
-        find_name = selector.startswith("@")
-        if find_name:
-            selector = selector[1:]
-        find_any = selector.startswith(">")
-        if find_any:
-            selector = selector[1:]
-        find_child = selector.endswith(">")
-        if find_child:
-            selector = selector[:-1]
+        compiled_selector = Selector.get(selector)
+        query = RegionQuery.get(search_regions)
+        if query is not None:
+            return query.select(compiled_selector)
 
+        selector = compiled_selector.selector
+        find_child = compiled_selector.find_child
+        filter_selector = compiled_selector.filter_selector
+        regions = []
         for region in search_regions:
-            key = "parent"
-            if find_name:
-                key = "name"
-
-            is_child = selector + ">" in region["parent"]
-            child_filtered = not filter_selector or GrammarParser.filter_region(region, selector, filter_any, filter_selector, filter_value, search_regions)
-
-            if find_any:
-                if region[key].endswith(selector) and not is_child:
-                    if not child_filtered:
-                        continue
-                    if find_child:
-                        regions += GrammarParser.filter_inside_region([region["begin"], region["end"]], search_regions)
-                    else:
-                        regions.append(region)
+            if not compiled_selector.match(region["name"], region["parent"]):
+                continue
+            if filter_selector and not GrammarParser.filter_region(region, selector, compiled_selector.filter_any, filter_selector, compiled_selector.filter_value, search_regions):
+                continue
+            if find_child:
+                regions += GrammarParser.filter_inside_region([region["begin"], region["end"]], search_regions)
             else:
-                if key is "name" and region[key] is selector and not is_child:
-                    if not child_filtered:
-                        continue
-                    if find_child:
-                        regions += GrammarParser.filter_inside_region([region["begin"], region["end"]], search_regions)
-                    else:
-                        regions.append(region)
-                elif region[key].startswith(selector) and not is_child:
-                    if not child_filtered:
-                        continue
-                    if find_child:
-                        regions += GrammarParser.filter_inside_region([region["begin"], region["end"]], search_regions)
-                    else:
-                        regions.append(region)
+                regions.append(region)
         return regions
 
     def find_by_selector(self, selector, search_regions=None):
@@ -390,10 +2707,10 @@ class GrammarParser():
             for selector in selectors:
                 new_selectors.append(selector)
             return GrammarParser.filter_by_selectors(new_selectors, search_regions)
-        regions = []
-        for selector in selector_list:
-            regions += GrammarParser.filter_by_selector(selector, search_regions)
-        return regions
+        results = [GrammarParser.filter_by_selector(selector, search_regions) for selector in selector_list]
+        if len(results) == 1:
+            return results[0]
+        return RegionList.join(results)
 
     def find_by_selectors(self, selector_list, search_regions=None):
         search_regions = search_regions or self.regions
@@ -404,6 +2721,9 @@ class GrammarParser():
     def filter_by_region(region, search_regions):
         if type(region) is int:
             return GrammarParser.filter_by_region([region, region], search_regions)
+        query = RegionQuery.get(search_regions)
+        if query is not None:
+            return RegionList(query.store, query.covering(region[0], region[1]))
         regions = []
         for node in search_regions:
             if node["begin"] <= region[0] and node["end"] >= region[1]:
@@ -422,6 +2742,9 @@ class GrammarParser():
             return GrammarParser.filter_inside_region(
                 [region, region], search_regions
             )
+        query = RegionQuery.get(search_regions)
+        if query is not None:
+            return RegionList(query.store, query.inside(region[0], region[1]))
         regions = []
         for node in search_regions:
             if node["begin"] >= region[0] and node["end"] <= region[1]:
@@ -433,6 +2756,86 @@ class GrammarParser():
         search_regions = search_regions or self.regions
         return GrammarParser.filter_inside_region(region, search_regions)
 
+    # Returns the last parse output and its regions as bytes which can be
+    #   loaded by load_parse (for the same grammar and data) instead of
+    #   parsing the data again
+    def dump_parse(self, parse_output):
+        regions, name_count, path_count = self.regions.dump()
+        return DUMP_HEADER.pack(
+            DUMP_MAGIC, DUMP_VERSION, self.regions.begins.itemsize,
+            int(bool(parse_output["success"])), parse_output["begin"],
+            parse_output["end"], name_count, path_count, len(self.regions)
+        ) + regions
+
+    # Restores the parse of the data from dump_parse, returns the parse
+    #   output or None if the dump is invalid
+    def load_parse(self, data, dumped):
+        try:
+            magic, version, item_size, success, begin, end, name_count, path_count, region_count = DUMP_HEADER.unpack_from(dumped)
+        except struct.error:
+            return None
+        if magic != DUMP_MAGIC or version != DUMP_VERSION or item_size != array("l").itemsize or end > len(data):
+            return None
+        regions = RegionStore(data, self.regions)
+        try:
+            if not regions.load(dumped, DUMP_HEADER.size, name_count, path_count, region_count):
+                return None
+        except (struct.error, ValueError):
+            return None
+        self.data = data
+        self.regions = regions
+        self.tokens = None
+        self.unit_steps = None
+        self.prefix = False
+        self.elapse_time = 0
+        parse_output = {"success": bool(success), "begin": begin, "end": end}
+        if self.recover:
+            parse_output["errors"] = self.get_errors()
+        return parse_output
+
+    # Returns a list of (begin, end) of data skipped by recover rules (error
+    #   regions) ordered by their positions
+    def get_errors(self):
+        regions = self.regions
+        name_ids = set(
+            regions.name_index[name]
+            for name in self.compiled_grammar.error_names
+            if name in regions.name_index
+        )
+        errors = []
+        if name_ids:
+            for index in range(len(regions)):
+                if regions.name_ids[index] in name_ids:
+                    errors.append((regions.begins[index], regions.ends[index]))
+            errors.sort()
+        return errors
+
     # Get parse time
     def get_elapse_time(self):
         return self.elapse_time
+
+    # Get per rule statistics of included rules, sorted by time
+    def get_profile(self):
+        profile = []
+        for rule_name in self.profile_stats:
+            attempts, successes, backtracks, consumed, elapse_time, self_time = self.profile_stats[rule_name]
+            profile.append({
+                "rule": rule_name,
+                "attempts": attempts,
+                "successes": successes,
+                "backtracks": backtracks,
+                "consumed": consumed,
+                "time": elapse_time,
+                "self_time": self_time
+            })
+        profile.sort(key=lambda stats: (-stats["time"], stats["rule"]))
+        return profile
+
+    # Get packrat cache statistics
+    def get_packrat_stats(self):
+        return {
+            "hits": self.packrat_hits,
+            "misses": self.packrat_misses,
+            "entries": len(self.packrat_cache),
+            "size": self.packrat_size
+        }
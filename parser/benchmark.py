@@ -0,0 +1,195 @@
+from GrammarParser import *
+from run import load_grammar
+import argparse
+import os.path
+import tracemalloc
+
+
+def generate_source(methods, classes=1):
+    # Generate a Java source with specified number of classes and methods
+    lines = ["package benchmark;", "", "import java.util.List;", ""]
+    for class_index in range(classes):
+        lines.append("public class Benchmark" + str(class_index) + " {")
+        lines.append("    private int counter = 0;")
+        for method_index in range(methods):
+            lines.append("")
+            lines.append("    /* Method " + str(method_index) + " */")
+            lines.append("    public int method" + str(method_index) + "(int value, String name) {")
+            lines.append("        int output = value * " + str(method_index) + " + counter;")
+            lines.append("        if (output > " + str(method_index) + ") {")
+            lines.append("            output -= name.length();")
+            lines.append("        } else {")
+            lines.append("            output += 1;")
+            lines.append("        }")
+            lines.append("        for (int i = 0; i < value; i++) {")
+            lines.append("            output = output ^ i; // Mix")
+            lines.append("        }")
+            lines.append("        return output;")
+            lines.append("    }")
+        lines.append("}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def benchmark_parse(grammar, source_data, options):
+    parser = GrammarParser(grammar, packrat=options.packrat)
+    parse_output = parser.parse_grammar(source_data)
+    return parse_output, parser.get_elapse_time()
+
+
+def benchmark_memory(grammar, source_data, options):
+    # Returns the peak memory while parsing and the memory kept by the parser
+    tracemalloc.start()
+    parser = GrammarParser(grammar, packrat=options.packrat)
+    parser.parse_grammar(source_data)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, current, len(parser.regions)
+
+
+def benchmark_edit(grammar, source_data, options):
+    # Edit a statement in the middle of the source and reparse it
+    #   both incrementally and from scratch
+    begin = source_data.find("output += 1;", len(source_data) // 2)
+    if begin < 0:
+        begin = len(source_data) // 2
+    end = begin + len("output += 1;")
+    edited_data = source_data[:begin] + "output += 42;" + source_data[end:]
+    parser = GrammarParser(grammar, packrat=options.packrat)
+    parser.parse_grammar(source_data)
+    parser.parse_incremental(edited_data, [(begin, end, begin + len("output += 42;"))])
+    incremental_time = parser.get_elapse_time()
+    full_parser = GrammarParser(grammar, packrat=options.packrat)
+    full_parser.parse_grammar(edited_data)
+    return incremental_time, full_parser.get_elapse_time(), parser.regions == full_parser.regions
+
+
+def benchmark_optimize(grammar, optimized_grammar, source_data, options):
+    # Parse with the original and the optimized grammar (best of 3)
+    times = []
+    regions = []
+    for compiled_grammar in (grammar, optimized_grammar):
+        elapse_time = None
+        for attempt in range(3):
+            parser = GrammarParser(compiled_grammar, packrat=options.packrat)
+            parser.parse_grammar(source_data)
+            if elapse_time is None or parser.get_elapse_time() < elapse_time:
+                elapse_time = parser.get_elapse_time()
+        times.append(elapse_time)
+        regions.append(parser.regions)
+    return times[0], times[1], regions[0] == regions[1]
+
+
+def query_members(parser, use_tree):
+    members = 0
+    for class_name in parser.find_by_selectors(">ClassDeclaration>Identifier"):
+        class_nodes = parser.find_by_selectors(">ClassDeclaration>[Identifier=" + class_name["value"] + "]")
+        for method in GrammarParser.filter_by_selectors(">MethodDeclaration>MethodHeader", class_nodes):
+            if use_tree:
+                method_nodes = method.get_descendants()
+            else:
+                method_nodes = GrammarParser.filter_inside_region([method["begin"], method["end"]], class_nodes)
+            GrammarParser.filter_by_selectors(">MethodDeclaration>MethodHeader>Identifier", method_nodes)
+            for parameter in GrammarParser.filter_by_selectors(">FormalParameters>FormalParameterList>FormalParameter", method_nodes):
+                if use_tree:
+                    parameter_nodes = parameter.get_descendants()
+                else:
+                    parameter_nodes = GrammarParser.filter_inside_region([parameter["begin"], parameter["end"]], method_nodes)
+                GrammarParser.filter_by_selectors(">VariableDeclaratorId", parameter_nodes)
+            members += 1
+    return members
+
+
+def benchmark_query(grammar, source_data, options):
+    # Select classes, their methods and parameters the same way as
+    #   structure parsing does, by searching inside the regions and by
+    #   walking the parse tree
+    parser = GrammarParser(grammar, packrat=options.packrat)
+    parser.parse_grammar(source_data)
+    start_time = clock()
+    members = query_members(parser, False)
+    region_time = clock() - start_time
+    start_time = clock()
+    query_members(parser, True)
+    return members, region_time, clock() - start_time
+
+
+def run():
+    parser = argparse.ArgumentParser(description="GrammarParser benchmark program.", usage="%(prog)s [options] [source ...]")
+    parser.add_argument("-g", "--grammar", dest="grammar", nargs="?", default=os.path.join("..", "grammars", "Java8.javatar-grammar"), type=str, help="grammar file to use (default is Java8 grammar)")
+    parser.add_argument("-s", "--sizes", dest="sizes", nargs="?", default="10,20,40,80", type=str, help="number of methods in generated sources (default is 10,20,40,80)")
+    parser.add_argument("-c", "--classes", dest="classes", nargs="?", default=1, type=int, help="number of classes in generated sources (default is 1)")
+    parser.add_argument("-k", "--packrat", dest="packrat", action="store_true", default=False, help="enable packrat memoization")
+    parser.add_argument("-e", "--edit", dest="edit", action="store_true", default=False, help="compare incremental reparse after an edit with a full parse")
+    parser.add_argument("-q", "--query", dest="query", action="store_true", default=False, help="measure selector query time instead of parse time")
+    parser.add_argument("-O", "--optimize", dest="optimize", action="store_true", default=False, help="compare parse time of the original and the optimized grammar")
+    parser.add_argument("-m", "--memory", dest="memory", action="store_true", default=False, help="measure memory usage instead of parse time")
+    parser.add_argument("source", nargs="*", type=str, help="source files to parse instead of generated sources")
+    options = parser.parse_args()
+
+    if not os.path.exists(options.grammar):
+        print("Error: Grammar file is not found")
+        return
+    grammar = load_grammar(options.grammar)
+
+    sources = []
+    if options.source:
+        for source in options.source:
+            sources.append((source, open(source, "r").read()))
+    else:
+        for size in options.sizes.split(","):
+            sources.append((size + " methods", generate_source(int(size), options.classes)))
+
+    if options.edit:
+        print("{0:<30} {1:>10} {2:>10} {3:>10} {4:>10}".format("Source", "Size", "Full", "Edit", "Same"))
+        for name, source_data in sources:
+            incremental_time, full_time, same = benchmark_edit(grammar, source_data, options)
+            print("{0:<30} {1:>10} {2:>9.3f}s {3:>9.3f}s {4:>10}".format(
+                name, len(source_data), full_time, incremental_time, str(same)
+            ))
+        return
+
+    if options.optimize:
+        compiled_grammar = CompiledGrammar(grammar)
+        optimized_grammar = CompiledGrammar(grammar, optimize=True)
+        stats = optimized_grammar.optimizer.get_stats()
+        print("Rules: {0} => {1}, Nodes: {2} => {3}".format(
+            stats["rules"][0], stats["rules"][1], stats["nodes"][0], stats["nodes"][1]
+        ))
+        print("Inlined: {inlined}, Hoisted: {hoisted}, Collapsed: {collapsed}, Merged: {merged}".format(**stats))
+        print("{0:<30} {1:>10} {2:>10} {3:>10} {4:>10}".format("Source", "Size", "Original", "Optimized", "Same"))
+        for name, source_data in sources:
+            original_time, optimized_time, same = benchmark_optimize(compiled_grammar, optimized_grammar, source_data, options)
+            print("{0:<30} {1:>10} {2:>9.3f}s {3:>9.3f}s {4:>10}".format(
+                name, len(source_data), original_time, optimized_time, str(same)
+            ))
+        return
+
+    if options.query:
+        print("{0:<30} {1:>10} {2:>10} {3:>10} {4:>10}".format("Source", "Size", "Methods", "Region", "Tree"))
+        for name, source_data in sources:
+            members, region_time, tree_time = benchmark_query(grammar, source_data, options)
+            print("{0:<30} {1:>10} {2:>10} {3:>9.3f}s {4:>9.3f}s".format(
+                name, len(source_data), members, region_time, tree_time
+            ))
+        return
+
+    if options.memory:
+        print("{0:<30} {1:>10} {2:>10} {3:>10} {4:>10}".format("Source", "Size", "Regions", "Peak", "Kept"))
+        for name, source_data in sources:
+            peak, current, regions = benchmark_memory(grammar, source_data, options)
+            print("{0:<30} {1:>10} {2:>10} {3:>8.2f}MB {4:>8.2f}MB".format(
+                name, len(source_data), regions, peak / 1048576.0, current / 1048576.0
+            ))
+        return
+
+    print("{0:<30} {1:>10} {2:>10} {3:>10} {4:>12}".format("Source", "Size", "Ending", "Time", "KB/s"))
+    for name, source_data in sources:
+        parse_output, elapse_time = benchmark_parse(grammar, source_data, options)
+        print("{0:<30} {1:>10} {2:>10} {3:>9.3f}s {4:>12.2f}".format(
+            name, len(source_data), parse_output["end"], elapse_time,
+            len(source_data) / 1024.0 / max(elapse_time, 1e-9)
+        ))
+
+if __name__ == "__main__":
+    run()
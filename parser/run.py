@@ -1,30 +1,203 @@
 from GrammarParser import *
 import json
 import argparse
+import glob
+import multiprocessing
 import os.path
+import sys
+import time
+
+# Python 2 has raw_input for reading a line
+try:
+    input = raw_input
+except NameError:
+    pass
 
 
 def printer(level, msg):
     print((" "*level) + msg)
 
 
+PROFILE_COLUMNS = ["attempts", "successes", "backtracks", "consumed", "time", "self_time"]
+
+
+def print_profile(profile, sort_by):
+    profile = sorted(profile, key=lambda stats: (-stats[sort_by], stats["rule"]))
+    print("{0:<40} {1:>9} {2:>9} {3:>10} {4:>9} {5:>9} {6:>9}".format("Rule", "Attempts", "Successes", "Backtracks", "Consumed", "Time", "Self"))
+    for stats in profile:
+        print("{rule:<40} {attempts:>9} {successes:>9} {backtracks:>10} {consumed:>9} {time:>9.4f} {self_time:>9.4f}".format(**stats))
+
+
+def load_grammar(grammar_path):
+    grammar_data = open(grammar_path, "r").read()
+    # Remove comment since JSON does not supported it
+    # This RegEx only remove line comment (//comment)
+    return json.loads(re.sub("(?<=[\\r\\n])\\s*//[^\\r\\n]*(?=[\\r\\n])", "", grammar_data))
+
+
+def find_sources(sources, extension):
+    # Expand directories (recursively) and glob patterns into files
+    source_paths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            for dir_path, dir_names, file_names in os.walk(source):
+                for file_name in file_names:
+                    if file_name.endswith(extension):
+                        source_paths.add(os.path.join(dir_path, file_name))
+        elif glob.has_magic(source):
+            for source_path in glob.glob(source, recursive=True):
+                if os.path.isfile(source_path):
+                    source_paths.add(source_path)
+        elif os.path.isfile(source):
+            source_paths.add(source)
+    return sorted(source_paths)
+
+
+# Grammar and options of the batch worker process
+batch_worker = {}
+
+
+def init_batch_worker(grammar_path, optimize, packrat, selector):
+    # Grammar is compiled once per process
+    batch_worker["grammar"] = CompiledGrammar(load_grammar(grammar_path), optimize)
+    batch_worker["packrat"] = packrat
+    batch_worker["selector"] = selector
+
+
+def parse_batch_source(source_path):
+    record = {"file": source_path, "size": 0}
+    try:
+        source_file = open(source_path, "r", encoding="utf-8", errors="replace")
+        source_data = source_file.read()
+        source_file.close()
+        record["size"] = os.path.getsize(source_path)
+        parser = GrammarParser(batch_worker["grammar"], packrat=batch_worker["packrat"])
+        parse_output = parser.parse_grammar(source_data)
+        record["success"] = parse_output["success"]
+        record["end"] = parse_output["end"]
+        record["length"] = len(source_data)
+        record["regions"] = len(parser.regions)
+        record["time"] = parser.get_elapse_time()
+        if batch_worker["selector"] is not None:
+            record["nodes"] = [
+                {"begin": node["begin"], "end": node["end"], "name": node["name"], "value": node["value"]}
+                for node in parser.find_by_selectors(batch_worker["selector"])
+            ]
+    except Exception as e:
+        record["success"] = False
+        record["error"] = "{0}: {1}".format(type(e).__name__, e)
+    return record
+
+
+def parse_parallel_chunk(chunk_data):
+    parser = GrammarParser(batch_worker["grammar"], packrat=batch_worker["packrat"])
+    return parser.parse_chunk(chunk_data)
+
+
+def read_line(prompt):
+    # No more input (such as a pipe) is the same as an empty line
+    try:
+        return input(prompt)
+    except EOFError:
+        return ""
+
+
+def print_summary(options, parser, parse_output, source_data):
+    # Parsing position compare to data size
+    print("Ending: " + str(parse_output["end"]) + "/" + str(len(source_data)))
+    # Parsing time (filtering is not included)
+    print("Time: {elapse_time:.2f}s".format(elapse_time=parser.get_elapse_time()))
+    # Packrat cache statistics
+    if options.packrat:
+        print("Packrat: {hits} hits, {misses} misses, {entries} entries".format(**parser.get_packrat_stats()))
+    # Per rule statistics
+    if options.profile:
+        print_profile(parser.get_profile(), options.profile_sort)
+    if options.profile_json is not None:
+        profile_file = open(options.profile_json, "w")
+        json.dump({
+            "grammar": options.grammar,
+            "source": options.source,
+            "size": len(source_data),
+            "time": parser.get_elapse_time(),
+            "rules": parser.get_profile()
+        }, profile_file, indent=4)
+        profile_file.close()
+
+
+def run_batch(options):
+    source_paths = find_sources(options.source, options.extension)
+    if not os.path.exists(options.grammar):
+        print("Error: Grammar file is not found")
+        return
+    output_file = sys.stdout
+    if options.output is not None:
+        output_file = open(options.output, "w")
+    jobs = options.jobs or multiprocessing.cpu_count()
+    initargs = (options.grammar, options.optimize, options.packrat, options.selector)
+    files = 0
+    failures = 0
+    size = 0
+    starttime = time.time()
+    pool = None
+    try:
+        if jobs > 1 and len(source_paths) > 1:
+            pool = multiprocessing.Pool(jobs, init_batch_worker, initargs)
+            records = pool.imap_unordered(parse_batch_source, source_paths, chunksize=8)
+        else:
+            init_batch_worker(*initargs)
+            records = map(parse_batch_source, source_paths)
+        for record in records:
+            files += 1
+            size += record["size"]
+            # Incomplete parsing is also a failure
+            if not record["success"] or record["end"] != record["length"]:
+                failures += 1
+            output_file.write(json.dumps(record) + "\n")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if output_file is not sys.stdout:
+            output_file.close()
+    elapse_time = max(time.time() - starttime, 1e-9)
+    # Summary is not a part of JSON lines output
+    sys.stderr.write("Files: {0} ({1} failed), {2:.2f} MB in {3:.2f}s with {4} jobs\n".format(files, failures, size / 1048576.0, elapse_time, jobs))
+    sys.stderr.write("Throughput: {0:.1f} files/s, {1:.2f} MB/s\n".format(files / elapse_time, size / 1048576.0 / elapse_time))
+
+
 def run():
     # Command-line stuffs
-    parser = argparse.ArgumentParser(description="GrammarParser demo program.", usage="%(prog)s [options] source [grammar]")
+    parser = argparse.ArgumentParser(description="GrammarParser demo program.", usage="%(prog)s [options] source [source ...]")
     parser.add_argument("-v", "--validate", dest="validate", action="store_true", default=False, help="validate all rule in the grammar")
     parser.add_argument("-p", "--print", dest="print_call", action="store_true", default=False, help="print rule calls")
+    parser.add_argument("-O", "--optimize", dest="optimize", action="store_true", default=False, help="optimize the grammar before parsing")
+    parser.add_argument("-k", "--packrat", dest="packrat", action="store_true", default=False, help="enable packrat memoization")
+    parser.add_argument("--profile", dest="profile", action="store_true", default=False, help="print per rule statistics")
+    parser.add_argument("--profile-sort", dest="profile_sort", default="time", choices=PROFILE_COLUMNS, help="profile column to sort by (default is time)")
+    parser.add_argument("--profile-json", dest="profile_json", nargs="?", type=str, help="write per rule statistics to a JSON file")
     parser.add_argument("-m", "--multiple", dest="multiple", action="store_true", default=False, help="enable multiple selector")
     parser.add_argument("-g", "--grammar", dest="grammar", nargs="?", default="example.json", type=str, help="grammar file to use (default is example.json)")
     parser.add_argument("-r", "--regex", dest="regex", nargs="?", type=str, help="RegEx selector")
     parser.add_argument("-s", "--selector", dest="selector", nargs="?", type=str, help="node selectors")
-    parser.add_argument("source", nargs="?", type=str, help="source file to parse with grammar")
+    parser.add_argument("-b", "--batch", dest="batch", action="store_true", default=False, help="parse all sources (files, directories or globs) and print JSON lines")
+    parser.add_argument("-P", "--parallel", dest="parallel", action="store_true", default=False, help="parse top-level blocks of the source in parallel")
+    parser.add_argument("-j", "--jobs", dest="jobs", nargs="?", type=int, default=0, help="number of processes in batch or parallel mode (default is number of CPUs)")
+    parser.add_argument("-e", "--extension", dest="extension", nargs="?", type=str, default=".java", help="source file extension in directories (default is .java)")
+    parser.add_argument("-o", "--output", dest="output", nargs="?", type=str, help="JSON lines output file in batch mode (default is standard output)")
+    parser.add_argument("source", nargs="*", type=str, help="source file to parse with grammar")
     options = parser.parse_args()
 
     # Show help if nothing is provided
-    if options.source is None:
+    if not options.source:
         parser.print_help()
         return
 
+    if options.batch:
+        run_batch(options)
+        return
+    options.source = options.source[0]
+
     # Confirm the files
     if not os.path.exists(options.source):
         print("Error: Source file is not found")
@@ -35,19 +208,16 @@ def run():
     print("Grammar: " + options.grammar)
     print("Source: " + options.source)
     source_data = open(options.source, "r").read()
-    grammar_data = open(options.grammar, "r").read()
-
-    # Remove comment since JSON does not supported it
-    # This RegEx only remove line comment (//comment)
-    grammar = json.loads(re.sub("(?<=[\\r\\n])\\s*//[^\\r\\n]*(?=[\\r\\n])", "", grammar_data))
+    grammar = load_grammar(options.grammar)
 
     # Create a new instance of GrammarParser
+    profile = options.profile or options.profile_json is not None
     if options.print_call:
         # With printer
-        parser = GrammarParser(grammar, printer)
+        parser = GrammarParser(grammar, printer, packrat=options.packrat, profile=profile, optimize=options.optimize)
     else:
         # Without printer
-        parser = GrammarParser(grammar)
+        parser = GrammarParser(grammar, packrat=options.packrat, profile=profile, optimize=options.optimize)
 
     # Validate grammar?
     if options.validate:
@@ -71,10 +241,27 @@ def run():
                 print(str(index) + ". " + unexists)
                 index += 1
 
-        raw_input("Press enter/return to continue...")
+        # Show all alternatives which are always parsed
+        unpredictable_rules = validate_output["unpredictable_rules"]
+        if len(unpredictable_rules) > 0:
+            print("Unpredictable Grammar Rules")
+            index = 1
+            for unpredictable in unpredictable_rules:
+                print(str(index) + ". " + unpredictable)
+                index += 1
+
+        read_line("Press enter/return to continue...")
 
     # Parse a source data
-    parse_output = parser.parse_grammar(source_data)
+    if options.parallel and not options.print_call:
+        # Chunks are parsed with the same grammar and options in each process
+        jobs = options.jobs or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(jobs, init_batch_worker, (options.grammar, options.optimize, options.packrat, None))
+        parse_output = parser.parse_parallel(source_data, lambda chunks: pool.map(parse_parallel_chunk, chunks), jobs*4)
+        pool.close()
+        pool.join()
+    else:
+        parse_output = parser.parse_grammar(source_data)
     # Parsing success?
     if parse_output["success"]:
         if options.selector is not None:
@@ -89,8 +276,10 @@ def run():
             print("   => " + node["value"])
             index += 1
         print("Total: " + str(len(nodes)) + " tokens")
+    print_summary(options, parser, parse_output, source_data)
+    if parse_output["success"]:
         while True:
-            selectors = raw_input("Selectors> ")
+            selectors = read_line("Selectors> ")
             if selectors == "":
                 break
             nodes = parser.find_by_selectors(selectors, nodes)
@@ -103,10 +292,7 @@ def run():
             print("Total: " + str(len(nodes)) + " tokens")
             if not options.multiple:
                 break
-    # Parsing position compare to data size
-    print("Ending: " + str(parse_output["end"]) + "/" + str(len(source_data)))
-    # Parsing time (filtering is not included)
-    print("Time: {elapse_time:.2f}s".format(elapse_time=parser.get_elapse_time()))
+
 
 if __name__ == "__main__":
     run()
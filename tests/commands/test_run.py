@@ -0,0 +1,37 @@
+import sublime
+import unittest
+from unittest.mock import patch, MagicMock
+from Javatar.commands.builds import JavatarRunCommand
+
+
+class TestRun(unittest.TestCase):
+    @patch(
+        "sublime.set_timeout",
+        side_effect=lambda f, timeout_ms=0: f()
+    )
+    @patch(
+        "Javatar.core.symbol_index._SymbolIndex.get_main_files",
+        return_value=["Alpha.java"]
+    )
+    @patch("Javatar.core.status_manager._StatusManager.hide_status")
+    def test_find_runnable_files(self, hide_status, *_):
+        window = MagicMock(spec=sublime.Window)
+        cmd = JavatarRunCommand(window)
+        self.assertEqual(cmd.find_runnable_files(), ["Alpha.java"])
+        hide_status.assert_not_called()
+
+    @patch(
+        "sublime.set_timeout",
+        side_effect=lambda f, timeout_ms=0: f()
+    )
+    @patch(
+        "Javatar.core.symbol_index._SymbolIndex.get_main_files",
+        side_effect=OSError
+    )
+    @patch("Javatar.core.status_manager._StatusManager.hide_status")
+    def test_find_runnable_files_error(self, hide_status, *_):
+        window = MagicMock(spec=sublime.Window)
+        cmd = JavatarRunCommand(window)
+        with self.assertRaises(OSError):
+            cmd.find_runnable_files()
+        hide_status.assert_called_once_with("run_main_class")
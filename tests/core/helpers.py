@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    """
+    A test case with a temporary directory to write files in and patched
+        Javatar settings
+    """
+
+    def setUp(self):
+        self.dir_path = self.make_dir()
+
+    def make_dir(self):
+        """
+        Returns a path to a new temporary directory which is removed after
+            the test
+        """
+        dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir_path)
+        return dir_path
+
+    def start_patch(self, target, *args, **kwargs):
+        """
+        Patches specified target until the end of the test and returns
+            the mock
+
+        @param target: a target to patch, arguments are passed to patch()
+        """
+        patcher = patch(target, *args, **kwargs)
+        mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mock
+
+    def patch_settings(self, settings, sublime_settings=None):
+        """
+        Patches Javatar and Sublime Text settings with specified dicts, the
+            dicts are kept as self.settings and self.sublime_settings so
+            tests can change them
+
+        @param settings: a dict of Javatar settings
+        @param sublime_settings: a dict of Sublime Text settings
+        """
+        self.settings = settings
+        self.sublime_settings = sublime_settings or {}
+        self.start_patch(
+            "Javatar.core.settings._Settings.get",
+            side_effect=lambda key, default=None: self.settings.get(
+                key, default
+            )
+        )
+        self.start_patch(
+            "Javatar.core.settings._Settings.get_sublime",
+            side_effect=lambda key, default=None: self.sublime_settings.get(
+                key, default
+            )
+        )
+        self.start_patch(
+            "Javatar.core.settings._Settings.ready", return_value=True
+        )
+
+    def write_file(self, name, data="", mtime=None):
+        """
+        Writes a file in the temporary directory and returns its path
+
+        @param name: a path to the file relative to the temporary directory
+        @param data: a content of the file
+        @param mtime: a modification time to set to the file
+        """
+        file_path = os.path.join(self.dir_path, name)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        data_file = open(file_path, "w")
+        data_file.write(data)
+        data_file.close()
+        if mtime is not None:
+            os.utime(file_path, (mtime, mtime))
+        return file_path
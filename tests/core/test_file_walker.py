@@ -0,0 +1,163 @@
+import os
+import unittest
+from unittest.mock import patch
+from Javatar.core.file_walker import _FileWalker
+from Javatar.core.state_property import _StateProperty
+from .helpers import TempDirTestCase
+
+
+class TestFileWalker(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_settings(
+            {"java_extensions": [".java"]},
+            {"folder_exclude_patterns": []}
+        )
+
+    def write_files(self, *names):
+        return [self.write_file(name) for name in names]
+
+    def get_files(self, fw, file_filter=None):
+        return [
+            os.path.relpath(file_path, self.dir_path)
+            for file_path in fw.get_files([self.dir_path], file_filter)
+        ]
+
+    def test_get_files(self):
+        self.write_files(
+            "Alpha.java",
+            os.path.join("bravo", "Charlie.java"),
+            os.path.join("bravo", "delta.txt"),
+            *[
+                os.path.join("echo", name, "Foxtrot.java")
+                for name in "abcdef"
+            ]
+        )
+        fw = _FileWalker()
+        self.assertEqual(
+            self.get_files(fw, lambda file_path: file_path.endswith(".java")),
+            [
+                "Alpha.java",
+                os.path.join("bravo", "Charlie.java")
+            ] + [
+                os.path.join("echo", name, "Foxtrot.java")
+                for name in "abcdef"
+            ]
+        )
+        self.assertEqual(fw.get_files([os.path.join(self.dir_path, "x")]), [])
+
+    def test_exclude_patterns(self):
+        self.write_files(
+            "Alpha.java",
+            os.path.join(".git", "Bravo.java"),
+            os.path.join("build-1", "Charlie.java"),
+            os.path.join("delta", "build", "Echo.java"),
+            os.path.join("delta", "Foxtrot.java")
+        )
+        fw = _FileWalker()
+        self.sublime_settings["folder_exclude_patterns"] = [".git", "build*"]
+        self.assertEqual(self.get_files(fw), [
+            "Alpha.java",
+            os.path.join("delta", "Foxtrot.java")
+        ])
+        self.sublime_settings["folder_exclude_patterns"] = []
+        self.assertEqual(len(self.get_files(fw)), 5)
+
+    def test_exclude_patterns_case(self):
+        self.write_files(
+            "Alpha.java",
+            os.path.join("Build", "Bravo.java"),
+            os.path.join("charlie", "Charlie.java")
+        )
+        fw = _FileWalker()
+        self.sublime_settings["folder_exclude_patterns"] = [
+            "build*", "CHARLIE"
+        ]
+        for platform in ("windows", "osx"):
+            with patch("sublime.platform", return_value=platform):
+                self.assertEqual(self.get_files(fw), ["Alpha.java"])
+        with patch("sublime.platform", return_value="linux"):
+            self.assertEqual(len(self.get_files(fw)), 3)
+
+    def test_list_dir_cache(self):
+        self.write_files("Alpha.java", os.path.join("bravo", "Charlie.java"))
+        fw = _FileWalker()
+        listing = (["bravo"], ["Alpha.java"])
+        self.assertEqual(fw.list_dir(self.dir_path), listing)
+        mtime = os.path.getmtime(self.dir_path)
+
+        # Listing is reused while the modification time is the same
+        self.write_files("Delta.java")
+        os.utime(self.dir_path, (mtime, mtime))
+        self.assertEqual(fw.list_dir(self.dir_path), listing)
+
+        os.utime(self.dir_path, (mtime + 10, mtime + 10))
+        self.assertEqual(
+            fw.list_dir(self.dir_path),
+            (["bravo"], ["Alpha.java", "Delta.java"])
+        )
+
+        fw.reset()
+        self.assertEqual(fw.listings, {})
+
+    def test_unreadable_dir(self):
+        self.write_files(
+            "Alpha.java",
+            os.path.join("bravo", "Charlie.java"),
+            os.path.join("delta", "Echo.java")
+        )
+        unreadable_path = os.path.join(self.dir_path, "bravo")
+        scandir = os.scandir
+
+        def scandir_unreadable(path):
+            if path == unreadable_path:
+                raise PermissionError(path)
+            return scandir(path)
+
+        fw = _FileWalker()
+        with patch("os.scandir", side_effect=scandir_unreadable):
+            self.assertEqual(self.get_files(fw), [
+                "Alpha.java",
+                os.path.join("delta", "Echo.java")
+            ])
+        # Failed listing is not cached
+        self.assertNotIn(unreadable_path, fw.listings)
+        self.assertEqual(len(self.get_files(fw)), 3)
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "requires symbolic links")
+    def test_symlink_loop(self):
+        self.write_files(os.path.join("alpha", "Bravo.java"))
+        os.symlink(
+            self.dir_path, os.path.join(self.dir_path, "alpha", "charlie")
+        )
+        os.symlink(
+            os.path.join(self.dir_path, "alpha", "Bravo.java"),
+            os.path.join(self.dir_path, "Delta.java")
+        )
+        fw = _FileWalker()
+        self.assertEqual(self.get_files(fw), [
+            "Delta.java",
+            os.path.join("alpha", "Bravo.java")
+        ])
+
+    def test_is_source_folder(self):
+        self.write_files(os.path.join("alpha", "bravo", "Charlie.java"))
+        os.makedirs(os.path.join(self.dir_path, "delta", "echo"))
+        self.write_files(os.path.join("foxtrot", "golf.txt"))
+        sp = _StateProperty()
+        for name, source_folder in (
+            ("alpha", True),
+            ("delta", True),
+            ("foxtrot", False),
+            ("hotel", False)
+        ):
+            self.assertEqual(
+                sp.is_source_folder(os.path.join(self.dir_path, name)),
+                source_folder
+            )
+        self.assertFalse(sp.is_source_folder(
+            os.path.join(self.dir_path, "delta"), can_empty=False
+        ))
+        self.assertTrue(sp.is_source_folder(
+            os.path.join(self.dir_path, "alpha", "bravo"), can_empty=False
+        ))
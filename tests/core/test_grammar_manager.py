@@ -0,0 +1,83 @@
+import json
+import os
+import re
+import shutil
+from unittest.mock import MagicMock
+from Javatar.core.grammar_manager import _GrammarManager
+from .helpers import TempDirTestCase
+
+
+GRAMMAR_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "grammars", "Java8.javatar-grammar"
+)
+
+
+def decode_value(data):
+    return json.loads(re.sub(
+        "(?<=[\\r\\n])\\s*//[^\\r\\n]*(?=[\\r\\n])", "", data
+    ))
+
+
+class TestGrammarManager(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.packages_path = self.dir_path
+        grammars_path = os.path.join(self.packages_path, "Javatar", "grammars")
+        os.makedirs(grammars_path)
+        self.grammar_path = os.path.join(
+            grammars_path, "Java8.javatar-grammar"
+        )
+        shutil.copy(GRAMMAR_PATH, self.grammar_path)
+        self.load_resource = MagicMock(side_effect=self.read_resource)
+        self.start_patch(
+            "sublime.packages_path", return_value=self.packages_path
+        )
+        self.start_patch("sublime.load_resource", self.load_resource)
+        self.start_patch("sublime.decode_value", decode_value)
+        self.start_patch(
+            "Javatar.core.settings._Settings.ready", return_value=False
+        )
+
+    def read_resource(self, name):
+        resource_file = open(
+            os.path.join(self.packages_path, name[len("Packages/"):]), "r"
+        )
+        data = resource_file.read()
+        resource_file.close()
+        return data
+
+    def test_get_grammar(self):
+        gm = _GrammarManager()
+        grammar = gm.get_grammar("Java8")
+        self.assertIs(gm.get_grammar("Java8"), grammar)
+        self.assertEqual(self.load_resource.call_count, 1)
+
+        parser = gm.get_parser("Java8")
+        self.assertIs(parser.compiled_grammar, grammar)
+        parse_output = parser.parse_grammar("class Alpha {}")
+        self.assertTrue(parse_output["success"])
+
+    def test_grammar_changed(self):
+        gm = _GrammarManager()
+        grammar = gm.get_grammar("Java8")
+        mtime = os.path.getmtime(self.grammar_path)
+        os.utime(self.grammar_path, (mtime + 10, mtime + 10))
+        changed_grammar = gm.get_grammar("Java8")
+        self.assertIsNot(changed_grammar, grammar)
+        self.assertEqual(self.load_resource.call_count, 2)
+        self.assertIs(gm.get_grammar("Java8"), changed_grammar)
+
+    def test_grammar_saved(self):
+        gm = _GrammarManager()
+        grammar = gm.get_grammar("Java8")
+        view = MagicMock()
+        view.file_name.return_value = os.path.join(
+            self.packages_path, "Javatar", "Alpha.java"
+        )
+        gm.on_post_save_async(view)
+        self.assertIs(gm.get_grammar("Java8"), grammar)
+
+        view.file_name.return_value = self.grammar_path
+        gm.on_post_save_async(view)
+        self.assertIsNot(gm.get_grammar("Java8"), grammar)
+        self.assertEqual(self.load_resource.call_count, 2)
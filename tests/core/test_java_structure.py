@@ -0,0 +1,194 @@
+import os
+from Javatar.core.java_structure import _JavaStructure
+from Javatar.core.symbol_index import _SymbolIndex
+from .helpers import TempDirTestCase
+
+
+class TestJavaStructure(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_settings({
+            "structure_cache_size": 2,
+            "enable_action_history": False
+        })
+        self.parse_structure = self.start_patch(
+            "Javatar.core.java_structure._JavaStructure.parse_structure",
+            side_effect=lambda source_code, content_hash=None: {
+                "source": source_code
+            }
+        )
+
+    def test_structure_cache(self):
+        js = _JavaStructure()
+        file_path = self.write_file("Alpha.java", "class Alpha {}")
+        structure = js.structure_in_file(file_path)
+        self.assertEqual(structure, {"source": "class Alpha {}"})
+        self.assertIs(js.structure_in_file(file_path), structure)
+        self.assertEqual(self.parse_structure.call_count, 1)
+
+    def test_structure_cache_eviction(self):
+        js = _JavaStructure()
+        alpha = self.write_file("Alpha.java", "class Alpha {}")
+        bravo = self.write_file("Bravo.java", "class Bravo {}")
+        charlie = self.write_file("Charlie.java", "class Charlie {}")
+        js.structure_in_file(alpha)
+        js.structure_in_file(bravo)
+        # Alpha is used more recently than Bravo
+        js.structure_in_file(alpha)
+        js.structure_in_file(charlie)
+        self.assertEqual(self.parse_structure.call_count, 3)
+        self.assertEqual(list(js.structures), [alpha, charlie])
+
+        js.structure_in_file(alpha)
+        self.assertEqual(self.parse_structure.call_count, 3)
+        js.structure_in_file(bravo)
+        self.assertEqual(self.parse_structure.call_count, 4)
+        self.assertEqual(list(js.structures), [alpha, bravo])
+
+    def test_structure_cache_modified(self):
+        js = _JavaStructure()
+        file_path = self.write_file("Alpha.java", "class Alpha {}", 1000)
+        js.structure_in_file(file_path)
+
+        # Size is changed
+        self.write_file("Alpha.java", "class Alpha { int bravo; }", 1000)
+        self.assertEqual(
+            js.structure_in_file(file_path),
+            {"source": "class Alpha { int bravo; }"}
+        )
+        self.assertEqual(self.parse_structure.call_count, 2)
+
+        # Modification time is changed
+        self.write_file("Alpha.java", "class Alpha { int delta; }", 2000)
+        self.assertEqual(
+            js.structure_in_file(file_path),
+            {"source": "class Alpha { int delta; }"}
+        )
+        self.assertEqual(self.parse_structure.call_count, 3)
+
+        # File is touched but the content is not changed
+        os.utime(file_path, (3000, 3000))
+        js.structure_in_file(file_path)
+        self.assertEqual(self.parse_structure.call_count, 3)
+
+    def test_structure_cache_saved(self):
+        js = _JavaStructure()
+        file_path = self.write_file("Alpha.java", "class Alpha {}")
+        js.structure_in_file(file_path)
+        view = type("View", (), {"file_name": lambda view: file_path})()
+        js.on_post_save_async(view)
+        self.assertEqual(list(js.structures), [])
+        js.structure_in_file(file_path)
+        self.assertEqual(self.parse_structure.call_count, 2)
+
+
+class TestJavaStructureLookup(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_settings({
+            "java_extensions": [".java"],
+            "class_path_match": (
+                "^(([a-zA-Z_\\-$][a-zA-Z\\d_\\-$]*\\.)*)" +
+                "([a-zA-Z_$][a-zA-Z\\d_$]*)$"
+            ),
+            "package_path_match": (
+                "^([a-zA-Z_\\-$][a-zA-Z\\\\d_\\-$]*)" +
+                "(\\.[a-zA-Z_\\-$][a-zA-Z\\\\d_\\-$]*)*$"
+            ),
+            "symbol_index_members": False,
+            "enable_action_history": False
+        })
+        # File name => names of declared classes
+        self.declared_classes = {}
+        self.si = _SymbolIndex()
+        self.start_patch(
+            "Javatar.core.macro._Macro.parse", return_value=self.make_dir()
+        )
+        self.start_patch(
+            "Javatar.core.state_property._StateProperty.get_source_folders",
+            return_value=[self.dir_path]
+        )
+        self.start_patch(
+            "Javatar.core.symbol_index._SymbolIndex.instance",
+            return_value=self.si
+        )
+        self.start_patch(
+            "Javatar.core.helper_service._HelperService" +
+            ".get_class_paths_for_classes",
+            return_value={"List": ["java.util.List"]}
+        )
+        self.iter_classes_in_file = self.start_patch(
+            "Javatar.core.java_structure._JavaStructure.iter_classes_in_file",
+            side_effect=lambda file_path: [
+                {"name": name, "methods": [], "fields": []}
+                for name in self.declared_classes.get(
+                    os.path.basename(file_path), []
+                )
+            ]
+        )
+        self.start_patch("sublime.set_timeout")
+        self.bravo = self.write_class_file("Bravo", ["Bravo"])
+        self.charlie = self.write_class_file("Charlie", ["Charlie", "Delta"])
+
+    def write_class_file(self, class_name, declared_classes):
+        self.declared_classes[class_name + ".java"] = declared_classes
+        return self.write_file(
+            os.path.join("alpha", class_name + ".java"), "package alpha;"
+        )
+
+    def test_file_with_class_path(self):
+        js = _JavaStructure()
+        # Index is not ready, so package folders are looked up
+        self.assertEqual(js.file_with_class_path("alpha.Bravo"), self.bravo)
+        self.assertEqual(self.iter_classes_in_file.call_count, 0)
+        self.assertEqual(js.file_with_class_path("alpha.Delta"), self.charlie)
+        self.assertIsNone(js.file_with_class_path("alpha.Echo"))
+        self.assertIsNone(js.file_with_class_path("bravo.Bravo"))
+        self.assertIsNone(self.si.get_index(build=False))
+
+    def test_file_with_class_path_index(self):
+        self.settings["symbol_index_members"] = True
+        self.si.get_index(wait=True)
+        self.iter_classes_in_file.reset_mock()
+        js = _JavaStructure()
+        self.assertEqual(js.file_with_class_path("alpha.Bravo"), self.bravo)
+        self.assertEqual(js.file_with_class_path("alpha.Delta"), self.charlie)
+        self.assertEqual(self.iter_classes_in_file.call_count, 0)
+
+        # Indexed file is removed
+        os.remove(self.charlie)
+        self.assertIsNone(js.file_with_class_path("alpha.Delta"))
+
+    def test_find_class_paths_for_classes(self):
+        js = _JavaStructure()
+        classes = ["Bravo", "Delta", "List"]
+        # Index is not ready, so only files named after the classes are found
+        self.assertEqual(js.find_class_paths_for_classes(classes), {
+            "Bravo": ["alpha.Bravo"],
+            "List": ["java.util.List"]
+        })
+        self.assertEqual(
+            js.find_class_paths_for_classes(classes, include_local=False),
+            {"List": ["java.util.List"]}
+        )
+
+        self.settings["symbol_index_members"] = True
+        self.si.get_index(wait=True)
+        self.assertEqual(
+            js.find_class_paths_for_classes(
+                classes,
+                custom_filter=lambda: (True, {"List": ["alpha.List"]})
+            ),
+            {
+                "Bravo": ["alpha.Bravo"],
+                "Delta": ["alpha.Delta"],
+                "List": ["alpha.List", "java.util.List"]
+            }
+        )
+        self.assertEqual(
+            js.find_class_paths_for_classes(
+                classes,
+                custom_filter=lambda: (False, {})
+            ),
+            {"Bravo": ["alpha.Bravo"], "Delta": ["alpha.Delta"]}
+        )
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import zlib
+from Javatar.core.parse_cache import _ParseCache
+from Javatar.parser.GrammarParser import CompiledGrammar, GrammarParser
+from .helpers import TempDirTestCase
+
+
+GRAMMAR_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "grammars", "Java8.javatar-grammar"
+)
+
+JAVA_SOURCE = """package alpha;
+
+public class Bravo {
+    private int charlie;
+
+    public void delta(String echo) {
+        charlie += echo.length();
+    }
+}
+"""
+
+
+def load_grammar():
+    grammar_file = open(GRAMMAR_PATH, "r")
+    grammar_data = grammar_file.read()
+    grammar_file.close()
+    return json.loads(re.sub(
+        "(?<=[\\r\\n])\\s*//[^\\r\\n]*(?=[\\r\\n])", "", grammar_data
+    ))
+
+
+class TestParseCache(TempDirTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.grammar = CompiledGrammar(load_grammar(), optimize=True)
+
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.dir_path, ".javatar-parse-cache")
+        self.patch_settings({
+            "parse_cache_size": 50,
+            "enable_action_history": False
+        })
+        self.start_patch(
+            "Javatar.core.macro._Macro.parse", return_value=self.dir_path
+        )
+
+    def parse(self, source=JAVA_SOURCE, grammar=None):
+        parser = GrammarParser(grammar or self.grammar)
+        return parser, parser.parse_grammar(source)
+
+    def get_entry_paths(self):
+        return sorted(
+            os.path.join(self.cache_path, file_name)
+            for file_name in os.listdir(self.cache_path)
+        )
+
+    def test_round_trip(self):
+        pc = _ParseCache()
+        self.assertEqual(pc.get_cache_path(), self.cache_path)
+        parser, parse_output = self.parse()
+        pc.store_parse(parser, parse_output, "alpha")
+        entry_paths = self.get_entry_paths()
+        self.assertEqual(len(entry_paths), 1)
+        self.assertTrue(entry_paths[0].endswith("-alpha.jtpr"))
+        entry_file = open(entry_paths[0], "rb")
+        self.assertEqual(
+            zlib.decompress(entry_file.read()),
+            parser.dump_parse(parse_output)
+        )
+        entry_file.close()
+
+        loaded_parser = GrammarParser(self.grammar)
+        loaded_output = pc.load_parse(loaded_parser, JAVA_SOURCE, "alpha")
+        self.assertEqual(loaded_output, parse_output)
+        self.assertEqual(
+            [
+                (node["begin"], node["end"], node["name"])
+                for node in loaded_parser.find_all()
+            ],
+            [
+                (node["begin"], node["end"], node["name"])
+                for node in parser.find_all()
+            ]
+        )
+        self.assertIsNone(pc.load_parse(loaded_parser, JAVA_SOURCE, "bravo"))
+
+    def test_corrupt_entry(self):
+        pc = _ParseCache()
+        parser, parse_output = self.parse()
+        pc.store_parse(parser, parse_output, "alpha")
+        entry_path = self.get_entry_paths()[0]
+        entry_file = open(entry_path, "rb")
+        dumped = entry_file.read()
+        entry_file.close()
+
+        for corrupted in (
+            dumped[:len(dumped) // 2],
+            b"charlie",
+            zlib.compress(b"delta"),
+            zlib.compress(zlib.decompress(dumped)[:-8])
+        ):
+            entry_file = open(entry_path, "wb")
+            entry_file.write(corrupted)
+            entry_file.close()
+            self.assertIsNone(
+                pc.load_parse(GrammarParser(self.grammar), JAVA_SOURCE, "alpha")
+            )
+
+    def test_grammar_changed(self):
+        pc = _ParseCache()
+        parser, parse_output = self.parse()
+        pc.store_parse(parser, parse_output, "alpha")
+
+        grammar = load_grammar()
+        grammar["Alpha"] = {"token": "alpha"}
+        changed_grammar = CompiledGrammar(grammar, optimize=True)
+        self.assertNotEqual(
+            changed_grammar.get_signature(), self.grammar.get_signature()
+        )
+        self.assertIsNone(
+            pc.load_parse(GrammarParser(changed_grammar), JAVA_SOURCE, "alpha")
+        )
+        self.assertIsNotNone(
+            pc.load_parse(GrammarParser(self.grammar), JAVA_SOURCE, "alpha")
+        )
+
+    def test_eviction(self):
+        pc = _ParseCache()
+        parser, parse_output = self.parse()
+        pc.store_parse(parser, parse_output, "alpha")
+        entry_size = os.path.getsize(self.get_entry_paths()[0])
+        # Room for three entries
+        self.settings["parse_cache_size"] = entry_size * 3.5 / 1024 / 1024
+
+        for content_hash in ("bravo", "charlie"):
+            pc.store_parse(parser, parse_output, content_hash)
+        mtime = os.path.getmtime(self.get_entry_paths()[0]) - 60
+        for index, content_hash in enumerate(("alpha", "bravo", "charlie")):
+            entry_path = pc.get_entry_path(
+                self.cache_path, parser, content_hash
+            )
+            os.utime(entry_path, (mtime + index, mtime + index))
+        self.assertEqual(len(self.get_entry_paths()), 3)
+
+        # Loaded entry is used recently
+        self.assertIsNotNone(
+            pc.load_parse(GrammarParser(self.grammar), JAVA_SOURCE, "alpha")
+        )
+        # Least recently used entries are removed until the cache is
+        #   smaller than 80% of its maximum size
+        pc.store_parse(parser, parse_output, "delta")
+        self.assertEqual(
+            [
+                os.path.basename(entry_path).split("-")[1]
+                for entry_path in self.get_entry_paths()
+            ],
+            ["alpha.jtpr", "delta.jtpr"]
+        )
+        self.assertLessEqual(
+            pc.get_cache_size(self.cache_path), entry_size * 3.5
+        )
+
+    def test_disabled(self):
+        self.settings["parse_cache_size"] = 0
+        pc = _ParseCache()
+        self.assertIsNone(pc.get_cache_path())
+        parser, parse_output = self.parse()
+        pc.store_parse(parser, parse_output, "alpha")
+        self.assertFalse(os.path.exists(self.cache_path))
@@ -0,0 +1,377 @@
+import json
+import os
+import threading
+import time
+from unittest.mock import patch
+from Javatar.core.symbol_index import _SymbolIndex
+from .helpers import TempDirTestCase
+
+
+class TestSymbolIndex(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.dir_path, "cache")
+        self.source_folder = os.path.join(self.dir_path, "src")
+        os.makedirs(self.cache_path)
+        os.makedirs(self.source_folder)
+        self.patch_settings({
+            "java_extensions": [".java"],
+            "symbol_index_members": False,
+            "symbol_index_queue_size": 1000,
+            "enable_action_history": False
+        })
+        self.start_patch(
+            "Javatar.core.macro._Macro.parse", return_value=self.cache_path
+        )
+        self.start_patch(
+            "Javatar.core.state_property._StateProperty.get_source_folders",
+            return_value=[self.source_folder]
+        )
+        self.set_timeout = self.start_patch("sublime.set_timeout")
+        self.index_path = os.path.join(
+            self.cache_path, ".javatar-symbol-index"
+        )
+
+    def write_source(self, name, source_code, mtime=None):
+        return self.write_file(os.path.join("src", name), source_code, mtime)
+
+    def run_indexer(self, si):
+        task = si.next_task()
+        while task is not None:
+            si.run_task(task)
+            task = si.next_task()
+
+    def test_get_index(self):
+        alpha = self.write_source(
+            os.path.join("alpha", "Bravo.java"),
+            "package alpha; class Bravo {}"
+        )
+        si = _SymbolIndex()
+        # Index is built by the indexer, files named after the classes are
+        #   found until then
+        self.assertIsNone(si.get_index())
+        self.assertEqual(si.get_class_paths("Bravo"), ["alpha.Bravo"])
+        self.assertIsNone(si.get_class_file("alpha.Bravo"))
+        self.assertEqual(si.find_methods("charlie"), [])
+        task = si.next_task()
+        self.assertEqual(task, ("build", si.get_index_key()))
+        # Index is only built once
+        self.assertIsNone(si.get_index())
+        self.assertIsNone(si.next_task())
+
+        si.run_task(task)
+        self.assertIsNone(si.next_task())
+        index = si.get_index()
+        self.assertEqual(index["files"][alpha]["classes"], ["Bravo"])
+        self.assertEqual(si.get_class_paths("Bravo"), ["alpha.Bravo"])
+        self.assertEqual(si.get_class_file("alpha.Bravo"), alpha)
+        self.assertTrue(os.path.exists(self.index_path))
+
+        # Stored index is loaded without building
+        si = _SymbolIndex()
+        self.assertEqual(si.get_index()["files"], index["files"])
+        self.assertIsNone(si.next_task())
+
+    def test_get_index_unusable(self):
+        self.write_source("Alpha.java", "class Alpha {}")
+        si = _SymbolIndex()
+        # Index of other source folders
+        si.store_index(self.index_path, si.create_index(
+            [self.dir_path], False
+        ))
+        mtime = os.path.getmtime(self.index_path)
+        with patch(
+                "Javatar.core.symbol_index._SymbolIndex.load_index",
+                wraps=si.load_index) as load_index:
+            for _ in range(3):
+                self.assertIsNone(si.get_index(build=False))
+            # Unusable index file is only read once
+            self.assertEqual(load_index.call_count, 1)
+
+            self.settings["symbol_index_members"] = True
+            self.assertIsNone(si.get_index(build=False))
+            self.assertEqual(load_index.call_count, 2)
+
+            si.store_index(self.index_path, si.create_index(
+                [self.source_folder], True
+            ))
+            os.utime(self.index_path, (mtime + 10, mtime + 10))
+            self.assertIsNotNone(si.get_index(build=False))
+            self.assertEqual(load_index.call_count, 3)
+
+    def test_get_index_wait(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}")
+        si = _SymbolIndex()
+        index = si.get_index(wait=True)
+        self.assertEqual(list(index["files"]), [alpha])
+        self.assertIs(si.get_index(), index)
+
+    def test_update_file(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}", 1000)
+        si = _SymbolIndex()
+        index = si.get_index(wait=True)
+        self.assertFalse(si.update_file(index, alpha))
+
+        # File is added
+        bravo = self.write_source("Bravo.java", "class Bravo {}")
+        self.assertTrue(si.update_file(index, bravo))
+        self.assertEqual(si.get_class_paths("Bravo"), ["Bravo"])
+        self.assertIn("main", index["files"][bravo])
+
+        # File is modified
+        self.write_source(
+            "Alpha.java",
+            "class Alpha { public static void main(String[] args) {} }",
+            2000
+        )
+        self.assertTrue(si.update_file(index, alpha))
+        self.assertEqual(index["files"][alpha]["mtime"], 2000)
+
+        # File is removed
+        os.remove(bravo)
+        self.assertTrue(si.update_file(index, bravo))
+        self.assertNotIn(bravo, index["files"])
+        self.assertEqual(si.get_class_paths("Bravo"), [])
+        self.assertNotIn("Bravo", index["class_files"])
+        self.assertFalse(si.update_file(index, bravo))
+
+    def test_members(self):
+        self.settings["symbol_index_members"] = True
+        alpha = self.write_source("Alpha.java", "class Alpha {}")
+        index = {
+            "mtime": os.path.getmtime(alpha),
+            "package": "",
+            "classes": ["Alpha", "Bravo"],
+            "methods": {"Alpha": ["charlie"], "Bravo": ["charlie"]},
+            "fields": {"Bravo": ["delta"]}
+        }
+        si = _SymbolIndex()
+        with patch(
+                "Javatar.core.symbol_index._SymbolIndex.get_file_entry",
+                return_value=index):
+            si.get_index(wait=True)
+        self.assertEqual(si.get_class_paths("Bravo"), ["Bravo"])
+        self.assertEqual(si.find_methods("charlie"), ["Alpha", "Bravo"])
+        self.assertEqual(si.find_fields("delta"), ["Bravo"])
+
+        # Index without members is rebuilt
+        self.settings["symbol_index_members"] = False
+        self.assertIsNone(si.get_index())
+        self.assertEqual(si.find_methods("charlie"), [])
+
+    def test_store_index(self):
+        self.write_source("Alpha.java", "class Alpha {}")
+        si = _SymbolIndex()
+        index = si.get_index(wait=True)
+        self.assertEqual(os.listdir(self.cache_path), [".javatar-symbol-index"])
+        loaded_index = si.load_index(self.index_path)
+        self.assertEqual(loaded_index, index)
+
+        # Index is replaced, so a failed write keeps the stored index
+        with patch("os.replace", side_effect=OSError):
+            si.store_index(self.index_path, si.create_index([], False))
+        self.assertEqual(si.load_index(self.index_path), index)
+        self.assertEqual(os.listdir(self.cache_path), [".javatar-symbol-index"])
+
+    def test_corrupt_index(self):
+        self.write_source("Alpha.java", "class Alpha {}")
+        si = _SymbolIndex()
+        si.store_index(self.index_path, si.create_index(
+            [self.source_folder], False
+        ))
+        index_file = open(self.index_path, "r")
+        data = index_file.read()
+        index_file.close()
+        for corrupted in (
+            data[:len(data) // 2],
+            json.dumps({"version": 0}),
+            json.dumps({"version": 1}),
+            "[]"
+        ):
+            index_file = open(self.index_path, "w")
+            index_file.write(corrupted)
+            index_file.close()
+            self.assertIsNone(si.load_index(self.index_path))
+
+        # Corrupt index is rebuilt
+        self.assertIsNone(si.get_index())
+        self.run_indexer(si)
+        self.assertEqual(si.get_class_paths("Alpha"), ["Alpha"])
+        self.assertEqual(
+            si.load_index(self.index_path)["classes"], {"Alpha": ["Alpha"]}
+        )
+
+    def test_queue_file(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}")
+        bravo = self.write_source("Bravo.java", "class Bravo {}")
+        si = _SymbolIndex()
+        si.get_index(wait=True)
+        si.queue_file(alpha)
+        si.queue_file(bravo)
+        si.queue_file(alpha)
+        si.queue_file(os.path.join(self.source_folder, "Charlie.txt"))
+        si.queue_file(None)
+        # Files saved together are indexed by a single indexer
+        self.set_timeout.assert_called_once_with(si.start_indexer, 500)
+        self.assertEqual(si.get_queue_size(), 2)
+        self.assertEqual(si.next_task(), ("file", alpha))
+        self.assertEqual(si.next_task(), ("file", bravo))
+        self.assertIsNone(si.next_task())
+
+        # Too many files, the whole index is reconciled instead
+        self.settings["symbol_index_queue_size"] = 1
+        si.queue_file(alpha)
+        si.queue_file(bravo)
+        si.queue_file(alpha)
+        self.assertEqual(si.get_queue_size(), 0)
+        self.assertEqual(si.next_task(), ("reconcile", None))
+        self.assertIsNone(si.next_task())
+
+    def test_queue_store(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}", 1000)
+        si = _SymbolIndex()
+        si.get_index(wait=True)
+        self.write_source("Alpha.java", "class Alpha { int bravo; }", 2000)
+        charlie = self.write_source("Charlie.java", "class Charlie {}")
+        si.queue_file(alpha)
+        si.queue_file(charlie)
+        si.queue_file(os.path.join(self.dir_path, "Delta.java"))
+        for _ in range(3):
+            task = si.next_task()
+            self.assertEqual(task[0], "file")
+            si.run_task(task)
+        index = si.get_index()
+        self.assertEqual(sorted(index["files"]), [alpha, charlie])
+        self.assertEqual(index["files"][alpha]["mtime"], 2000)
+        # Index is stored once after all queued files
+        self.assertEqual(si.next_task(), ("store", (self.index_path, index)))
+        self.assertIsNone(si.next_task())
+
+    def test_startup(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}", 1000)
+        bravo = self.write_source("Bravo.java", "class Bravo {}", 1000)
+        si = _SymbolIndex()
+        si.get_index(wait=True)
+
+        # Files are changed while Sublime Text is closed
+        self.write_source("Alpha.java", "class Alpha { int charlie; }", 2000)
+        os.remove(bravo)
+        delta = self.write_source("Delta.java", "class Delta {}")
+        si = _SymbolIndex()
+        si.startup()
+        self.run_indexer(si)
+        index = si.load_index(self.index_path)
+        self.assertEqual(sorted(index["files"]), [alpha, delta])
+        self.assertEqual(index["files"][alpha]["mtime"], 2000)
+        self.assertEqual(index["classes"], {
+            "Alpha": ["Alpha"],
+            "Delta": ["Delta"]
+        })
+        self.assertEqual(si.get_index()["files"], index["files"])
+
+        # Nothing is changed
+        si.startup()
+        self.run_indexer(si)
+        self.assertEqual(si.modified_indexes, {})
+        self.assertEqual(si.load_index(self.index_path), index)
+
+    def test_has_main_method(self):
+        alpha = self.write_source(
+            "Alpha.java",
+            "class Alpha { public static void main(String[] args) {} }"
+        )
+        bravo = self.write_source(
+            "Bravo.java",
+            "class Bravo { static void main(int charlie) {} }"
+        )
+        delta = self.write_source(
+            "Delta.java", "class Delta { void main() {} }"
+        )
+        methods = {
+            "Alpha": [{"name": "main", "params": [{"type": "String[]"}]}],
+            "Bravo": [{"name": "main", "params": [{"type": "int"}]}]
+        }
+        si = _SymbolIndex()
+        with patch(
+                "Javatar.core.java_structure._JavaStructure.classes_in_file",
+                side_effect=lambda file_path: [{
+                    "name": os.path.splitext(os.path.basename(file_path))[0],
+                    "methods": methods.get(
+                        os.path.splitext(os.path.basename(file_path))[0], []
+                    )
+                }]) as classes_in_file:
+            self.assertTrue(si.has_main_method(alpha))
+            self.assertFalse(si.has_main_method(bravo))
+            self.assertEqual(classes_in_file.call_count, 2)
+            # Files without a main method declaration are not parsed
+            self.assertFalse(si.has_main_method(delta))
+            self.assertFalse(si.has_main_method(
+                os.path.join(self.source_folder, "Echo.java")
+            ))
+            self.assertEqual(classes_in_file.call_count, 2)
+
+    def test_get_main_files(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}")
+        bravo = self.write_source("Bravo.java", "class Bravo {}")
+        charlie = self.write_source("Charlie.java", "class Charlie {}")
+        main_files = [alpha, charlie]
+        si = _SymbolIndex()
+        with patch(
+                "Javatar.core.symbol_index._SymbolIndex.has_main_method",
+                side_effect=lambda file_path: file_path in main_files
+                ) as has_main_method:
+            self.assertEqual(si.get_main_files(), [alpha, charlie])
+            self.assertEqual(has_main_method.call_count, 3)
+            # Checked files are stored with the index
+            index = si.load_index(self.index_path)
+            self.assertEqual(
+                [entry["main"] for entry in index["files"].values()],
+                [True, False, True]
+            )
+            self.assertEqual(si.get_main_files(), [alpha, charlie])
+            self.assertEqual(has_main_method.call_count, 3)
+
+            # Removed file is dropped before the indexer is notified
+            os.remove(alpha)
+            self.assertEqual(si.get_main_files(), [charlie])
+            self.assertNotIn(
+                alpha, si.load_index(self.index_path)["files"]
+            )
+            self.assertEqual(si.get_class_paths("Alpha"), [])
+            self.assertIn(bravo, si.get_index()["files"])
+            self.assertEqual(has_main_method.call_count, 3)
+
+    def test_query_while_updating(self):
+        alpha = self.write_source("Alpha.java", "class Alpha {}", 1000)
+        si = _SymbolIndex()
+        si.get_index(wait=True)
+        self.write_source("Alpha.java", "class Alpha { int bravo; }", 2000)
+        si.queue_file(alpha)
+        removed = threading.Event()
+        indexer = threading.Thread(target=self.run_indexer, args=[si])
+        get_index = si.get_index
+        remove_entry = si.remove_entry
+
+        def get_index_before_update(*args, **kwargs):
+            # Index is updated after the query gets the index
+            index = get_index(*args, **kwargs)
+            if not indexer.is_alive() and not removed.is_set():
+                indexer.start()
+                self.assertTrue(removed.wait(5))
+            return index
+
+        def remove_entry_slowly(index, file_path):
+            # Entry is removed before the updated entry is added
+            remove_entry(index, file_path)
+            removed.set()
+            time.sleep(0.2)
+
+        try:
+            with patch.object(si, "get_index", get_index_before_update):
+                with patch.object(si, "remove_entry", remove_entry_slowly):
+                    self.assertEqual(si.get_class_paths("Alpha"), ["Alpha"])
+        finally:
+            if indexer.is_alive():
+                indexer.join()
+        self.assertEqual(si.get_class_file("Alpha"), alpha)
+        self.assertEqual(si.get_index()["files"][alpha]["mtime"], 2000)
@@ -0,0 +1,795 @@
+import json
+import multiprocessing
+import os
+import re
+import threading
+import unittest
+from unittest.mock import patch
+from Javatar.parser.GrammarParser import (
+    CompiledGrammar, GrammarOptimizer, GrammarParser, RegionStore
+)
+
+
+def load_grammar(name):
+    grammar_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "grammars", name
+    )
+    grammar_file = open(grammar_path, "r")
+    grammar_data = grammar_file.read()
+    grammar_file.close()
+    return json.loads(re.sub(
+        "(?<=[\\r\\n])\\s*//[^\\r\\n]*(?=[\\r\\n])", "", grammar_data
+    ))
+
+
+# Parser of the chunk worker process
+chunk_worker = {}
+
+
+def init_chunk_worker(grammar):
+    chunk_worker["parser"] = GrammarParser(grammar)
+
+
+def parse_chunk_worker(chunk_data):
+    return chunk_worker["parser"].parse_chunk(chunk_data)
+
+
+JAVA_SOURCE = """package alpha.bravo;
+
+import java.util.List;
+import java.util.Map;
+
+/* Comment */
+public class Charlie extends Delta {
+    private int echo = 0;
+
+    public Charlie(int echo, String foxtrot) {
+        this.echo = echo;
+    }
+
+    public static void main(String[] args) {
+        for (int i = 0; i < args.length; i++) {
+            echo += i * 2;
+        }
+    }
+
+    // Comment
+    private List<String> golf(Map<String, String> hotel) {
+        return null;
+    }
+}
+"""
+
+
+class TestGrammarParser(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.grammar = load_grammar("Java8.javatar-grammar")
+
+    def test_parse(self):
+        parser = GrammarParser(self.grammar)
+        parse_output = parser.parse_grammar(JAVA_SOURCE)
+        self.assertTrue(parse_output["success"])
+        self.assertEqual(parse_output["end"], len(JAVA_SOURCE))
+        self.assertEqual(
+            [node["value"] for node in parser.find_by_selectors(
+                "@PackageDeclaration"
+            )],
+            ["package alpha.bravo;"]
+        )
+        self.assertEqual(
+            [node["value"] for node in parser.find_by_selectors(
+                ">ImportDeclaration>QualifiedName"
+            )],
+            ["java.util.List", "java.util.Map"]
+        )
+
+    def test_match_context(self):
+        # Patterns see the current position as the beginning of document
+        parser = GrammarParser({
+            "separator": {"match": " ", "multiple": True},
+            "compilation_unit": {
+                "parse": [
+                    {"name": "Alpha", "match": "ab"},
+                    {"name": "Bravo", "match": "\\bcd"},
+                    {"name": "Charlie", "match": "^e"},
+                    {"name": "Delta", "match": "(?<!e)f"}
+                ]
+            }
+        })
+        parse_output = parser.parse_grammar("abcdef")
+        self.assertTrue(parse_output["success"])
+        self.assertEqual(parse_output["end"], 6)
+        self.assertEqual(
+            [node["value"] for node in parser.find_all()],
+            ["ab", "cd", "e", "f"]
+        )
+
+    def test_printer(self):
+        messages = []
+        parser = GrammarParser(
+            self.grammar,
+            lambda level, message: messages.append(message)
+        )
+        parse_output = parser.parse_grammar(JAVA_SOURCE)
+        fast_parser = GrammarParser(self.grammar)
+        self.assertEqual(fast_parser.parse_grammar(JAVA_SOURCE), parse_output)
+        self.assertEqual(fast_parser.find_all(), parser.find_all())
+        self.assertIn("== Compilation unit ==", messages)
+        self.assertIn("== Rule PackageDeclaration [0] ==", messages)
+
+    def test_compiled_grammar(self):
+        compiled_grammar = CompiledGrammar(self.grammar)
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+
+        outputs = []
+
+        def parse():
+            compiled_parser = GrammarParser(compiled_grammar)
+            compiled_parser.parse_grammar(JAVA_SOURCE)
+            outputs.append(compiled_parser.find_all())
+
+        threads = [threading.Thread(target=parse) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(outputs), 4)
+        for output in outputs:
+            self.assertEqual(output, parser.find_all())
+
+    def test_packrat(self):
+        parser = GrammarParser(self.grammar)
+        parse_output = parser.parse_grammar(JAVA_SOURCE)
+        packrat_parser = GrammarParser(self.grammar, packrat=True)
+        packrat_output = packrat_parser.parse_grammar(JAVA_SOURCE)
+        self.assertEqual(packrat_output, parse_output)
+        self.assertEqual(packrat_parser.find_all(), parser.find_all())
+
+        stats = packrat_parser.get_packrat_stats()
+        self.assertGreater(stats["hits"], 0)
+        self.assertGreater(stats["misses"], 0)
+        self.assertEqual(stats["entries"], stats["misses"])
+
+    def test_packrat_limit(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        packrat_parser = GrammarParser(
+            self.grammar, packrat=True, packrat_limit=100
+        )
+        packrat_parser.parse_grammar(JAVA_SOURCE)
+        self.assertEqual(packrat_parser.find_all(), parser.find_all())
+        self.assertLessEqual(packrat_parser.get_packrat_stats()["size"], 100)
+
+    def test_packrat_reset(self):
+        parser = GrammarParser(self.grammar, packrat=True)
+        parser.parse_grammar(JAVA_SOURCE)
+        misses = parser.get_packrat_stats()["misses"]
+        parser.parse_grammar("package alpha;")
+        stats = parser.get_packrat_stats()
+        self.assertLess(stats["misses"], misses)
+        self.assertEqual(
+            [node["value"] for node in parser.find_by_selectors(
+                "@PackageDeclaration"
+            )],
+            ["package alpha;"]
+        )
+
+    def test_prefix(self):
+        full_parser = GrammarParser(self.grammar)
+        full_output = full_parser.parse_grammar(JAVA_SOURCE)
+        parser = GrammarParser(self.grammar)
+        for targets in (
+            "@PackageDeclaration",
+            ">ImportDeclaration>QualifiedName",
+            ["@PackageDeclaration", "@ImportDeclaration"]
+        ):
+            parse_output = parser.parse_grammar(JAVA_SOURCE, targets)
+            self.assertTrue(parse_output["success"])
+            self.assertTrue(parse_output["prefix"])
+            self.assertLessEqual(
+                parse_output["end"], JAVA_SOURCE.index("public class")
+            )
+            self.assertEqual(
+                parser.find_by_selectors(targets),
+                full_parser.find_by_selectors(targets)
+            )
+
+        # Type declarations have to be parsed
+        parse_output = parser.parse_grammar(JAVA_SOURCE, "@VariableType")
+        self.assertEqual(parse_output, full_output)
+
+        parser.parse_grammar(JAVA_SOURCE, "@PackageDeclaration")
+        self.assertEqual(parser.parse_grammar(JAVA_SOURCE), full_output)
+        self.assertEqual(parser.find_all(), full_parser.find_all())
+
+    def test_iter_regions(self):
+        source = JAVA_SOURCE + "\nclass India {\n    int juliet;\n}\n"
+        full_parser = GrammarParser(self.grammar)
+        full_output = full_parser.parse_grammar(source)
+        parser = GrammarParser(self.grammar)
+        regions = parser.iter_regions(source)
+        unit_region = dict(full_parser.find_all()[0])
+        self.assertEqual(
+            list(regions),
+            [dict(region) for region in full_parser.find_all()[1:]] +
+            [unit_region]
+        )
+
+        selector = ">ClassDeclaration>Identifier"
+        regions = parser.iter_regions(source, selector)
+        self.assertEqual(next(regions)["value"], "Charlie")
+        self.assertEqual(next(regions)["value"], "India")
+        with self.assertRaises(StopIteration) as context:
+            next(regions)
+        self.assertEqual(context.exception.value, full_output)
+
+        # Parsing is stopped with the iteration
+        regions = parser.iter_regions(source, selector)
+        self.assertEqual(next(regions)["value"], "Charlie")
+        regions.close()
+        self.assertEqual(len(parser.regions), 0)
+        self.assertEqual(parser.parse_grammar(source), full_output)
+        self.assertEqual(parser.find_all(), full_parser.find_all())
+
+        # Only regions of the current step are kept
+        sizes = [len(regions) for regions in parser.iter_steps(source)]
+        self.assertEqual(len(sizes), 6)
+        self.assertEqual(sum(sizes), len(full_parser.regions))
+
+    def test_parse_parallel(self):
+        source = (
+            JAVA_SOURCE + "\nclass India {\n    int juliet;\n}\n" +
+            "\n/* Kilo */\nenum Lima { MIKE }\n"
+        )
+        chunk_parser = GrammarParser(self.grammar)
+        chunks = []
+
+        def map_chunks(chunk_data):
+            chunks.extend(chunk_data)
+            return [chunk_parser.parse_chunk(data) for data in chunk_data]
+
+        # Chunk with unmatched brace is parsed sequentially
+        for source in (source, source.replace("class India", "} class India")):
+            del chunks[:]
+            full_parser = GrammarParser(self.grammar)
+            full_output = full_parser.parse_grammar(source)
+            parser = GrammarParser(self.grammar)
+            self.assertEqual(
+                parser.parse_parallel(source, map_chunks, 3), full_output
+            )
+            self.assertEqual(parser.find_all(), full_parser.find_all())
+            self.assertEqual(len(chunks), 2)
+            self.assertIn("public class Charlie", chunks[0])
+            self.assertIn("class India", chunks[1])
+
+        # Parallel parse can be reparsed incrementally
+        begin = source.index("MIKE")
+        source = source[:begin] + "NOVEMBER" + source[begin+4:]
+        self.assertEqual(
+            parser.parse_incremental(source, [(begin, begin+4, begin+8)]),
+            full_parser.parse_grammar(source)
+        )
+        self.assertEqual(parser.find_all(), full_parser.find_all())
+
+    def test_parse_parallel_pool(self):
+        source = JAVA_SOURCE + "".join(
+            "\nclass Class%d {\n    int field%d;\n}\n" % (index, index)
+            for index in range(8)
+        )
+        full_parser = GrammarParser(self.grammar)
+        full_output = full_parser.parse_grammar(source)
+        pool = multiprocessing.Pool(2, init_chunk_worker, (self.grammar,))
+        results = []
+
+        def map_chunks(chunk_data):
+            results.extend(pool.map(parse_chunk_worker, chunk_data))
+            return results
+
+        try:
+            parser = GrammarParser(self.grammar)
+            parse_output = parser.parse_parallel(source, map_chunks, 4)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertGreater(len(results), 1)
+        self.assertNotIn(None, results)
+        self.assertEqual(parse_output, full_output)
+        self.assertEqual(parser.find_all(), full_parser.find_all())
+
+    def test_recover(self):
+        parser = GrammarParser(self.grammar)
+        recover_parser = GrammarParser(self.grammar, recover=True)
+        parse_output = recover_parser.parse_grammar(JAVA_SOURCE)
+        self.assertEqual(parse_output.pop("errors"), [])
+        self.assertEqual(parse_output, parser.parse_grammar(JAVA_SOURCE))
+        self.assertEqual(recover_parser.find_all(), parser.find_all())
+
+        source = JAVA_SOURCE.replace(
+            "private int echo = 0;", "private int echo = ;"
+        ).replace("echo += i * 2;", "echo += i *;")
+        source = source[:source.rindex("}")]
+        self.assertLess(parser.parse_grammar(source)["end"], len(source))
+        parse_output = recover_parser.parse_grammar(source)
+        self.assertTrue(parse_output["success"])
+        self.assertEqual(parse_output["end"], len(source))
+        self.assertEqual(len(parse_output["errors"]), 3)
+        self.assertEqual(
+            source[slice(*parse_output["errors"][0])],
+            "private int echo = ;"
+        )
+        self.assertEqual(parse_output["errors"][2][0], len(source))
+        self.assertEqual(
+            [node["value"] for node in recover_parser.find_by_selectors(
+                ">ClassDeclaration>Identifier"
+            )],
+            ["Charlie"]
+        )
+        self.assertEqual(len(recover_parser.find_by_selectors(
+            "@MethodDeclaration"
+        )), 2)
+        self.assertEqual(
+            [
+                (node["begin"], node["end"])
+                for node in recover_parser.find_by_selectors("@Error")
+            ],
+            parse_output["errors"]
+        )
+
+    def test_interface_body(self):
+        source = (
+            "interface Alpha extends Bravo {\n"
+            "    int CHARLIE = 1;\n"
+            "    ;\n"
+            "    void delta(int echo);\n"
+            "    String foxtrot();\n"
+            "    <T> List<T> golf(T hotel);\n"
+            "    public abstract int[] india() throws Exception;\n"
+            "    class Juliet {}\n"
+            "}\n"
+        )
+        # Interface bodies are parsed without recover rules
+        parser = GrammarParser(self.grammar)
+        parse_output = parser.parse_grammar(source)
+        self.assertTrue(parse_output["success"])
+        self.assertEqual(parse_output["end"], len(source))
+        self.assertEqual(len(parser.find_by_selectors(
+            "@InterfaceBodyDeclaration"
+        )), 7)
+        self.assertEqual(
+            [
+                node["value"] for node in parser.find_by_selectors(
+                    "@InterfaceMethodDeclaration"
+                )
+            ][:2],
+            ["void delta(int echo);", "String foxtrot();"]
+        )
+        self.assertEqual(len(parser.find_by_selectors(
+            "@InterfaceMethodDeclaration"
+        )), 3)
+        for selector, value in (
+            ("@ConstDeclaration", "int CHARLIE = 1;"),
+            ("@GenericInterfaceMethodDeclaration", "<T> List<T> golf(T hotel);"),
+            ("@ClassDeclaration", "class Juliet {}")
+        ):
+            self.assertEqual(
+                [node["value"] for node in parser.find_by_selectors(selector)],
+                [value]
+            )
+
+        recover_parser = GrammarParser(self.grammar, recover=True)
+        recover_output = recover_parser.parse_grammar(source)
+        self.assertEqual(recover_output.pop("errors"), [])
+        self.assertEqual(recover_output, parse_output)
+        self.assertEqual(recover_parser.find_all(), parser.find_all())
+
+    def test_incremental(self):
+        source = JAVA_SOURCE + "\nclass India {\n    int juliet;\n}\n"
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(source)
+
+        edits = [
+            # Edit inside the last class
+            ("int juliet;", "long juliet;"),
+            # Edit inside the first class (following classes are shifted)
+            ("echo += i * 2;", "echo -= i;"),
+            # Edit between imports and the first class
+            ("/* Comment */", "/* Kilo */\nclass Lima {}\n")
+        ]
+        for old_text, new_text in edits:
+            begin = source.index(old_text)
+            end = begin + len(old_text)
+            source = source[:begin] + new_text + source[end:]
+            parse_output = parser.parse_incremental(
+                source, [(begin, end, begin + len(new_text))]
+            )
+            full_parser = GrammarParser(self.grammar)
+            self.assertEqual(parse_output, full_parser.parse_grammar(source))
+            self.assertEqual(parser.find_all(), full_parser.find_all())
+
+    def test_incremental_multiple_edits(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        source = JAVA_SOURCE.replace("alpha.bravo", "alpha")
+        begin = source.index("return null;")
+        source = source[:begin] + source[begin + len("return null;"):]
+        parse_output = parser.parse_incremental(source, [
+            (8, 19, 13),
+            (begin, begin + len("return null;"), begin)
+        ])
+        full_parser = GrammarParser(self.grammar)
+        self.assertEqual(parse_output, full_parser.parse_grammar(source))
+        self.assertEqual(parser.find_all(), full_parser.find_all())
+
+    def test_region_store(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        self.assertIsInstance(parser.regions, RegionStore)
+
+        nodes = parser.find_by_selectors("@PackageDeclaration")
+        self.assertEqual(len(nodes), 1)
+        node = nodes[0]
+        self.assertEqual(dict(node), {
+            "begin": 0,
+            "end": 20,
+            "value": "package alpha.bravo;",
+            "parent": "CompilationUnit>PackageDeclaration",
+            "name": "PackageDeclaration"
+        })
+        self.assertEqual(node, dict(node))
+        self.assertEqual("{begin}:{end} {name}".format_map(node), "0:20 PackageDeclaration")
+
+        # Names and parent paths are interned
+        regions = parser.regions
+        self.assertEqual(len(regions.names), len(set(regions.names)))
+        self.assertEqual(len(regions.paths), len(set(regions.paths)))
+        self.assertEqual(parser.find_all()[-1], regions[-1])
+
+    def test_selector_query(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        # Plain dictionaries are searched without the index
+        plain_regions = [dict(region) for region in parser.find_all()]
+
+        for selector in (
+            "@PackageDeclaration|>ImportDeclaration>|>ImportDeclaration",
+            ">ClassDeclaration>[Identifier=Charlie]",
+            ">ClassDeclaration>[Identifier=Golf]",
+            ">MethodDeclaration>MethodHeader>Identifier",
+            "@VariableType|@StaticClassOrInterfaceType|@CatchType",
+            "@Block>"
+        ):
+            nodes = parser.find_by_selectors(selector)
+            self.assertEqual(
+                nodes, GrammarParser.filter_by_selectors(selector, plain_regions)
+            )
+            # Found nodes can be searched again
+            self.assertEqual(
+                GrammarParser.filter_by_selectors(">Identifier", nodes),
+                GrammarParser.filter_by_selectors(
+                    ">Identifier", [dict(node) for node in nodes]
+                )
+            )
+
+        class_nodes = parser.find_by_selector(
+            ">ClassDeclaration>[Identifier=Charlie]"
+        )
+        self.assertEqual(
+            [node["value"] for node in parser.find_by_selector(
+                ">MethodDeclaration>MethodHeader>Identifier", class_nodes
+            )],
+            ["main", "golf"]
+        )
+        self.assertEqual(
+            parser.find_inside_region([21, 44]),
+            GrammarParser.filter_inside_region([21, 44], plain_regions)
+        )
+        self.assertEqual(
+            parser.find_by_region(30),
+            GrammarParser.filter_by_region(30, plain_regions)
+        )
+        self.assertEqual(
+            parser.find_by_regex("@.*Declaration"),
+            parser.find_by_regex("@.*Declaration", plain_regions)
+        )
+
+    def test_region_tree(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        roots = parser.regions.get_roots()
+        self.assertEqual(len(roots), 1)
+        self.assertIsNone(roots[0].get_parent())
+
+        for node in parser.find_all():
+            parent = node.get_parent()
+            if parent is None:
+                continue
+            self.assertEqual(parent["parent"] + ">" + node["name"], node["parent"])
+            self.assertIn(node, parent.get_children())
+            self.assertEqual(
+                parent.get_descendants(),
+                [
+                    child for child in parser.find_inside_region(
+                        [parent["begin"], parent["end"]]
+                    ) if child["parent"].startswith(parent["parent"] + ">")
+                ]
+            )
+
+        methods = parser.find_by_selector(">MethodDeclaration>MethodHeader")
+        self.assertEqual(
+            [
+                GrammarParser.filter_by_selector(
+                    ">MethodHeader>Identifier", method.get_descendants()
+                )[0]["value"] for method in methods
+            ],
+            ["main", "golf"]
+        )
+
+    def test_multiple(self):
+        grammar = {
+            "separator": {"match": "\\s+"},
+            "compilation_unit": {
+                "parse": [
+                    {"name": "Item", "match": "[a-z]+", "multiple": True},
+                    {"name": "End", "match": ";"}
+                ]
+            }
+        }
+        parser = GrammarParser(grammar)
+        parse_output = parser.parse_grammar("ab cd ef;")
+        self.assertEqual(parse_output, {"success": True, "begin": 0, "end": 9})
+        # Each occurrence is nested in the previous one
+        self.assertEqual(
+            [(node["begin"], node["end"], node["parent"]) for node in parser.find_all()],
+            [
+                (0, 2, "Item"),
+                (3, 8, "Item"),
+                (3, 5, "Item>Item"),
+                (6, 8, "Item>Item"),
+                (6, 8, "Item>Item>Item"),
+                (8, 8, "Item>Item>Item"),
+                (8, 9, "End")
+            ]
+        )
+
+        # Occurrence without any progress is not repeated
+        parser = GrammarParser({
+            "compilation_unit": {
+                "parse": [{"match": "x*", "multiple": True}, {"match": ";"}]
+            }
+        })
+        self.assertEqual(parser.parse_grammar(";")["end"], 1)
+
+    def test_no_recursion_limit(self):
+        source = "package alpha;\n" + "import alpha.bravo.Charlie;\n" * 5000
+        parser = GrammarParser(self.grammar)
+        parse_output = parser.parse_grammar(source)
+        self.assertTrue(parse_output["success"])
+        self.assertEqual(parse_output["end"], len(source))
+        self.assertEqual(len(parser.find_by_selectors("@ImportDeclaration")), 5000)
+
+    def test_depth_limit(self):
+        parser = GrammarParser({
+            "compilation_unit": {"include": "Alpha"},
+            "repository": {
+                "Alpha": {"parse": [{"include": "Alpha"}, {"match": "a"}]}
+            }
+        })
+        with patch("Javatar.parser.GrammarParser.MAX_DEPTH", 100):
+            with self.assertRaisesRegex(RuntimeError, "depth"):
+                parser.parse_grammar("aaa")
+
+    def test_tokenizer(self):
+        parser = GrammarParser(self.grammar)
+        plain_parser = GrammarParser(self.grammar, tokenize=False)
+        self.assertEqual(
+            parser.parse_grammar(JAVA_SOURCE),
+            plain_parser.parse_grammar(JAVA_SOURCE)
+        )
+        self.assertEqual(parser.find_all(), plain_parser.find_all())
+        self.assertIsNone(plain_parser.tokens)
+
+        # Tokens are in their original positions without any separator
+        tokens = [
+            JAVA_SOURCE[begin:end] for begin, end in parser.tokens.get_tokens()
+        ]
+        self.assertEqual(tokens[:6], ["package", "alpha", ".", "bravo", ";", "import"])
+        self.assertNotIn("/* Comment */", tokens)
+        self.assertNotIn("// Comment", tokens)
+        self.assertFalse([token for token in tokens if token.isspace()])
+
+        source = "class Alpha { String bravo = \"/* */\"; /* Charlie"
+        self.assertEqual(
+            parser.parse_grammar(source),
+            plain_parser.parse_grammar(source)
+        )
+        self.assertEqual(parser.find_all(), plain_parser.find_all())
+
+    def test_lookahead(self):
+        grammar = {
+            "separator": {"match": "\\s+"},
+            "tokenizer": {"separator": "\\s+", "tokens": "\\w+|[\\s\\S]"},
+            "compilation_unit": {"include": "Values", "multiple": True},
+            "repository": {
+                "Values": {"parse_any": [
+                    {"name": "Number", "match": "[0-9]+"},
+                    {"name": "Word", "match": "[a-z]+"},
+                    {"name": "Any", "match": "(?=[^;])."},
+                    {"name": "Empty", "match": ";*"}
+                ]}
+            }
+        }
+        parser = GrammarParser(grammar)
+        plain_parser = GrammarParser(grammar, tokenize=False)
+        source = "12 alpha ; + bravo"
+        self.assertEqual(
+            parser.parse_grammar(source),
+            plain_parser.parse_grammar(source)
+        )
+        self.assertEqual(parser.find_all(), plain_parser.find_all())
+
+        values = parser.compiled_grammar.repository["Values"]
+        number, word, any_char, empty = values.rules
+        self.assertEqual(values.lookahead[ord("1")], (number, any_char, empty))
+        self.assertEqual(values.lookahead[ord("a")], (word, any_char, empty))
+        self.assertEqual(values.lookahead[ord(";")], (any_char, empty))
+        self.assertEqual(values.lookahead[-1], (empty,))
+        self.assertEqual(values.lookahead[0x80], (any_char, empty))
+        self.assertEqual(
+            parser.validate_grammar()["unpredictable_rules"],
+            ["Values [3/4] name: Any", "Values [4/4] name: Empty"]
+        )
+
+        # Java alternatives are predicted from their patterns
+        parser = GrammarParser(self.grammar)
+        self.assertEqual(
+            parser.validate_grammar()["unpredictable_rules"],
+            ["CharacterLiteral [1/2] match: (?![\\r\\v'\\\\])."]
+        )
+
+    def test_profile(self):
+        parser = GrammarParser(self.grammar)
+        parser.parse_grammar(JAVA_SOURCE)
+        self.assertEqual(parser.get_profile(), [])
+        for packrat in (False, True):
+            profile_parser = GrammarParser(
+                self.grammar, packrat=packrat, profile=True
+            )
+            profile_parser.parse_grammar(JAVA_SOURCE)
+            self.assertEqual(profile_parser.find_all(), parser.find_all())
+
+            profile = profile_parser.get_profile()
+            self.assertEqual(profile[0]["rule"], "TypeDeclaration")
+            times = [stats["time"] for stats in profile]
+            self.assertEqual(times, sorted(times, reverse=True))
+            for stats in profile:
+                self.assertEqual(
+                    stats["attempts"],
+                    stats["successes"] + stats["backtracks"]
+                )
+                self.assertLessEqual(stats["self_time"], stats["time"] + 1e-6)
+            stats = dict((stats["rule"], stats) for stats in profile)
+            self.assertEqual(stats["ImportDeclaration"]["successes"], 2)
+            self.assertEqual(
+                stats["ImportDeclaration"]["consumed"],
+                len("import java.util.List;\nimport java.util.Map;\n\n")
+            )
+            self.assertGreater(stats["TypeDeclaration"]["backtracks"], 0)
+
+        # Consumed data is counted in bytes
+        profile_parser = GrammarParser({
+            "compilation_unit": {"include": "Alpha", "multiple": True},
+            "repository": {"Alpha": {"match": "[^;]*;"}}
+        }, profile=True)
+        source = "\u00e9;b;\u20ac;"
+        profile_parser.parse_grammar(source)
+        self.assertEqual(
+            profile_parser.get_profile()[0]["consumed"],
+            len(source.encode("utf-8"))
+        )
+
+        # Rule calls are also profiled while printing
+        profile_parser = GrammarParser(
+            self.grammar, lambda level, message: None, profile=True
+        )
+        profile_parser.parse_grammar(JAVA_SOURCE)
+        profile = profile_parser.get_profile()
+        self.assertEqual(profile[0]["rule"], "TypeDeclaration")
+        for stats in profile:
+            self.assertEqual(
+                stats["attempts"], stats["successes"] + stats["backtracks"]
+            )
+        stats = dict((stats["rule"], stats) for stats in profile)
+        self.assertEqual(stats["ImportDeclaration"]["successes"], 2)
+
+        profile_parser.reset_profile()
+        self.assertEqual(profile_parser.get_profile(), [])
+
+    def test_dump_parse(self):
+        parser = GrammarParser(self.grammar)
+        parse_output = parser.parse_grammar(JAVA_SOURCE)
+        dumped = parser.dump_parse(parse_output)
+
+        # Loaded regions are the same in a parser with different paths
+        load_parser = GrammarParser(self.grammar)
+        load_parser.parse_grammar("class Alpha { int bravo; }")
+        self.assertEqual(
+            load_parser.load_parse(JAVA_SOURCE, dumped), parse_output
+        )
+        self.assertEqual(load_parser.find_all(), parser.find_all())
+        self.assertEqual(
+            load_parser.find_by_selectors("@MethodDeclaration"),
+            parser.find_by_selectors("@MethodDeclaration")
+        )
+
+        self.assertIsNone(load_parser.load_parse(JAVA_SOURCE, dumped[:-4]))
+        self.assertIsNone(load_parser.load_parse(JAVA_SOURCE, b"JTPR"))
+        self.assertEqual(load_parser.find_all(), parser.find_all())
+
+        self.assertEqual(
+            parser.compiled_grammar.get_signature(),
+            CompiledGrammar(load_grammar("Java8.javatar-grammar")).get_signature()
+        )
+        self.assertNotEqual(
+            parser.compiled_grammar.get_signature(),
+            CompiledGrammar({}).get_signature()
+        )
+
+    def test_optimize(self):
+        parser = GrammarParser(self.grammar)
+        optimized_parser = GrammarParser(self.grammar, optimize=True)
+        self.assertEqual(
+            optimized_parser.parse_grammar(JAVA_SOURCE),
+            parser.parse_grammar(JAVA_SOURCE)
+        )
+        self.assertEqual(optimized_parser.find_all(), parser.find_all())
+        stats = optimized_parser.compiled_grammar.optimizer.get_stats()
+        self.assertLess(stats["rules"][1], stats["rules"][0])
+        self.assertGreater(stats["inlined"], 0)
+        self.assertGreater(stats["merged"], 0)
+        self.assertGreater(stats["hoisted"], 0)
+
+        grammar = {
+            "separator": {"match": "\\s*"},
+            "tokenizer": {"separator": "\\s+"},
+            "compilation_unit": {"include": "Statement", "multiple": True},
+            "repository": {
+                "Statement": {"name": "Statement", "parse_any": [
+                    {"parse": [{"include": "Else"}, {"match": "if"}, {"include": "Name"}]},
+                    {"parse": [{"include": "Else"}, {"include": "Name"}]},
+                    {"match": "\\+"},
+                    {"match": "-"},
+                    {"parse": [{"match": "do"}, {"include": "Else"}, {"include": "Name"}]},
+                    {"include": "Name"}
+                ]},
+                "Else": {"match": "else"},
+                "Name": {"name": "Name", "match": "[a-z]+", "multiple": True},
+                "Unused": {"match": "unused"}
+            }
+        }
+        optimizer = GrammarOptimizer(grammar)
+        optimized_grammar = optimizer.optimize()
+        self.assertIn("Unused", grammar["repository"])
+        alternatives = optimized_grammar["repository"]["Statement"]["parse_any"]
+        self.assertEqual(alternatives[0]["parse"][0], {"match": "else"})
+        self.assertEqual(alternatives[1], {"match": "\\+|-"})
+        self.assertEqual(alternatives[2]["parse"][1], {
+            "name": "Name", "match": "[a-z]+", "multiple": True
+        })
+        stats = optimizer.get_stats()
+        self.assertEqual(stats["rules"], [4, 1])
+        self.assertEqual(stats["collapsed"], 1)
+        self.assertEqual(stats["hoisted"], 1)
+        self.assertEqual(stats["merged"], 1)
+        for tokenize in (True, False):
+            for source in ("else if alpha + else bravo - charlie", "else  ifif - else", "do\n else delta", "doelse"):
+                parser = GrammarParser(grammar, tokenize=tokenize)
+                optimized_parser = GrammarParser(
+                    grammar, tokenize=tokenize, optimize=True
+                )
+                self.assertEqual(
+                    optimized_parser.parse_grammar(source),
+                    parser.parse_grammar(source)
+                )
+                self.assertEqual(optimized_parser.find_all(), parser.find_all())
@@ -0,0 +1,165 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# run.py is a script which imports GrammarParser as a top-level module
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "..", "parser")
+)
+import run as parser_run
+
+
+GRAMMAR_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "grammars", "Java8.javatar-grammar"
+)
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_path)
+        self.alpha = self.write_file("Alpha.java", "class Alpha {}")
+        self.bravo = self.write_file(
+            os.path.join("bravo", "Bravo.java"),
+            "package bravo;\n\nclass Bravo { int charlie; }\n"
+        )
+        self.delta = self.write_file(
+            os.path.join("bravo", "delta", "Delta.java"), "class Delta {"
+        )
+        self.write_file(os.path.join("bravo", "echo.txt"), "echo")
+
+    def write_file(self, name, data):
+        file_path = os.path.join(self.dir_path, name)
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        source_file = open(file_path, "w")
+        source_file.write(data)
+        source_file.close()
+        return file_path
+
+    def get_options(self, **options):
+        defaults = {
+            "source": [self.dir_path],
+            "extension": ".java",
+            "grammar": GRAMMAR_PATH,
+            "output": os.path.join(self.dir_path, "output.jsonl"),
+            "jobs": 1,
+            "optimize": False,
+            "packrat": False,
+            "selector": None
+        }
+        defaults.update(options)
+        return argparse.Namespace(**defaults)
+
+    def run_batch(self, options):
+        with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            parser_run.run_batch(options)
+        output_file = open(options.output, "r")
+        records = [json.loads(line) for line in output_file]
+        output_file.close()
+        return (
+            sorted(records, key=lambda record: record["file"]),
+            stderr.getvalue()
+        )
+
+    def test_find_sources(self):
+        self.assertEqual(
+            parser_run.find_sources([self.dir_path], ".java"),
+            sorted([self.alpha, self.bravo, self.delta])
+        )
+        self.assertEqual(
+            parser_run.find_sources([
+                os.path.join(self.dir_path, "**", "*.java"),
+                self.alpha,
+                os.path.join(self.dir_path, "foxtrot.java"),
+                os.path.join(self.dir_path, "bravo")
+            ], ".txt"),
+            sorted([
+                self.alpha,
+                self.bravo,
+                self.delta,
+                os.path.join(self.dir_path, "bravo", "echo.txt")
+            ])
+        )
+
+    def test_run_batch(self):
+        records, summary = self.run_batch(self.get_options())
+        self.assertEqual(
+            [record["file"] for record in records],
+            sorted([self.alpha, self.bravo, self.delta])
+        )
+        alpha, bravo, delta = records
+        self.assertTrue(alpha["success"])
+        self.assertEqual(alpha["end"], alpha["length"])
+        self.assertEqual(alpha["size"], len("class Alpha {}"))
+        self.assertEqual(bravo["end"], bravo["length"])
+        self.assertNotIn("nodes", bravo)
+        # Incomplete parsing is counted as a failure
+        self.assertFalse(
+            delta["success"] and delta["end"] == delta["length"]
+        )
+        self.assertIn("Files: 3 (1 failed)", summary)
+        self.assertIn("with 1 jobs", summary)
+
+    def test_run_batch_selector(self):
+        records, _ = self.run_batch(self.get_options(
+            source=[self.bravo], selector="@FieldDeclaration"
+        ))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            [node["value"] for node in records[0]["nodes"]],
+            ["int charlie;"]
+        )
+
+    def test_run_batch_jobs(self):
+        records, summary = self.run_batch(self.get_options(jobs=2))
+        expected_records, _ = self.run_batch(self.get_options())
+        for record in records + expected_records:
+            del record["time"]
+        self.assertEqual(records, expected_records)
+        self.assertIn("with 2 jobs", summary)
+
+    def test_parse_batch_source_error(self):
+        parser_run.init_batch_worker(GRAMMAR_PATH, False, False, None)
+        record = parser_run.parse_batch_source(
+            os.path.join(self.dir_path, "Foxtrot.java")
+        )
+        self.assertFalse(record["success"])
+        self.assertTrue(record["error"].startswith("FileNotFoundError"))
+
+    def test_run_batch_worker_error(self):
+        options = self.get_options()
+        parser_run.init_batch_worker(GRAMMAR_PATH, False, False, None)
+        parse_batch_source = parser_run.parse_batch_source
+        opened_files = []
+
+        def open_file(*args, **kwargs):
+            opened_files.append(open(*args, **kwargs))
+            return opened_files[-1]
+
+        with patch.object(
+                parser_run, "parse_batch_source",
+                side_effect=[parse_batch_source(self.alpha), ValueError]):
+            with patch.object(
+                    parser_run, "open", create=True, side_effect=open_file):
+                with self.assertRaises(ValueError):
+                    parser_run.run_batch(options)
+        output_files = [
+            opened_file
+            for opened_file in opened_files
+            if opened_file.name == options.output
+        ]
+        self.assertEqual(len(output_files), 1)
+        self.assertTrue(output_files[0].closed)
+        output_file = open(options.output, "r")
+        self.assertEqual(
+            [json.loads(line)["file"] for line in output_file],
+            [self.alpha]
+        )
+        output_file.close()
@@ -2,4 +2,5 @@ from .build_system import *
 from .jdk_manager import *
 from .packages_manager import *
 from .snippets_manager import *
+from .symbol_indexer import *
 from .utils import *
@@ -3,9 +3,9 @@ import threading
 from os.path import basename
 from ..core import (
     ActionHistory,
+    GrammarManager,
     Logger
 )
-from ..parser.GrammarParser import GrammarParser
 
 
 class SnippetsLoaderThread(threading.Thread):
@@ -17,9 +17,7 @@ class SnippetsLoaderThread(threading.Thread):
     def __init__(self, on_complete=None):
         self.running = True
         self.on_complete = on_complete
-        self.parser = GrammarParser(sublime.decode_value(sublime.load_resource(
-            "Packages/Javatar/grammars/JavatarSnippet.javatar-grammar"
-        )))
+        self.parser = GrammarManager().get_parser("JavatarSnippet")
         threading.Thread.__init__(self)
 
     def analyse_snippet(self, filename):
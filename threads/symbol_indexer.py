@@ -0,0 +1,35 @@
+import threading
+
+
+class SymbolIndexerThread(threading.Thread):
+
+    """
+    A thread to update the symbol index with the queued files
+    """
+
+    def __init__(self, symbol_index):
+        self.symbol_index = symbol_index
+        self.msg = ""
+        threading.Thread.__init__(self)
+
+    def set_progress(self, done, total):
+        """
+        Updates the progress message
+
+        @param done: a number of processed files
+        @param total: a number of all files
+        """
+        self.msg = " (%s/%s)" % (done, total)
+
+    def run(self):
+        done = 0
+        task = self.symbol_index.next_task()
+        while task is not None:
+            if task[0] == "file":
+                done += 1
+                self.set_progress(
+                    done, done + self.symbol_index.get_queue_size()
+                )
+            self.symbol_index.run_task(task, self.set_progress)
+            task = self.symbol_index.next_task()
+        self.result = True
@@ -9,7 +9,8 @@ from ..core import (
     ProjectRestoration,
     Settings,
     SnippetsManager,
-    StatusManager
+    StatusManager,
+    SymbolIndex
 )
 from .timer import Timer
 
@@ -83,6 +84,7 @@ class Constant:
         ProjectRestoration().load_state()
         SnippetsManager().startup()
         HelperService().startup()
+        SymbolIndex().startup()
 
     @staticmethod
     def post_startup():